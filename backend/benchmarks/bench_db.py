@@ -0,0 +1,138 @@
+"""
+数据库访问基准：对比“每次调用新建连接并在事件循环中同步执行”（旧实现）
+与“线程长连接 + 数据库线程池”（当前实现）在并发请求下的延迟
+
+用法：python -m backend.benchmarks.bench_db [--rows 5000] [--clients 50] [--requests 40]
+"""
+
+import argparse
+import asyncio
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from backend.db import sqlite as db
+
+
+@contextmanager
+def _legacy_get_db():
+    db.DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db.DB_PATH), timeout=10, isolation_level=None)
+    try:
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA foreign_keys=ON;")
+        yield conn
+    finally:
+        conn.close()
+
+
+def _handler(i: int) -> None:
+    """
+    模拟一次拉流列表页请求：分页查询 + 录像策略查询，约 10% 的请求带一次写入
+    """
+    db.query_pull_proxies(
+        vhost="__defaultVhost__",
+        app="app" if i % 3 else None,
+        sort="stream",
+        order="asc",
+        limit=16,
+        offset=(i % 50) * 16,
+    )
+    db.get_record_policy(vhost="__defaultVhost__", app="app", stream=f"s{i % 500}")
+    if i % 10 == 0:
+        db.upsert_pull_proxy(
+            vhost="__defaultVhost__",
+            app="app",
+            stream=f"s{i % 500}",
+            url=f"rtsp://127.0.0.1/{i}",
+            audio_type=None,
+        )
+
+
+async def _run(mode: str, clients: int, requests: int) -> dict:
+    latencies: list[float] = []
+    lags: list[float] = []
+    stop = asyncio.Event()
+
+    async def ticker() -> None:
+        # 事件循环延迟：10ms 定时器实际被唤醒的滞后
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - t0 - 0.01)
+
+    async def client(cid: int) -> None:
+        for r in range(requests):
+            i = cid * requests + r
+            t0 = time.perf_counter()
+            if mode == "legacy":
+                _handler(i)
+            else:
+                await db.run_db(_handler, i)
+            latencies.append(time.perf_counter() - t0)
+            await asyncio.sleep(random.uniform(0, 0.002))
+
+    tick = asyncio.create_task(ticker())
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client(c) for c in range(clients)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await tick
+
+    latencies.sort()
+
+    def pct(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return {
+        "mode": mode,
+        "req/s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(pct(0.50), 2),
+        "p95_ms": round(pct(0.95), 2),
+        "p99_ms": round(pct(0.99), 2),
+        "loop_lag_max_ms": round(max(lags, default=0) * 1000, 2),
+        "loop_lag_mean_ms": round(statistics.fmean(lags) * 1000, 2) if lags else 0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=40)
+    args = parser.parse_args()
+
+    db.DB_PATH = Path(tempfile.mkdtemp()) / "bench.db"
+    db.init_db()
+    db.upsert_pull_proxies(
+        [
+            {
+                "vhost": "__defaultVhost__",
+                "app": "app" if i % 2 else "cam",
+                "stream": f"s{i}",
+                "url": f"rtsp://127.0.0.1/{i}",
+                "audio_type": None,
+            }
+            for i in range(args.rows)
+        ]
+    )
+
+    pooled_get_db = db.get_db
+    db.get_db = _legacy_get_db
+    legacy = asyncio.run(_run("legacy", args.clients, args.requests))
+    db.get_db = pooled_get_db
+    pooled = asyncio.run(_run("pooled", args.clients, args.requests))
+    db.close_db()
+
+    print(f"rows={args.rows} clients={args.clients} requests/client={args.requests}")
+    for result in (legacy, pooled):
+        print("  ".join(f"{k}={v}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    main()
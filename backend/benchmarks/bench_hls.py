@@ -0,0 +1,275 @@
+"""
+HLS 回放重新封装基准：生成与录像片段结构相同的 MP4（H264 + AAC，moov 在末尾），
+对比直接读取整个文件（nginx /record/ 的开销下限）与 解析 moov + 生成 init/全部分片 的耗时，
+并校验分片中的样本数据与原文件逐字节一致
+
+用法：python -m backend.benchmarks.bench_hls [--seconds 300] [--bitrate 2000] [--files 12]
+"""
+
+import argparse
+import os
+import random
+import struct
+import tempfile
+import time
+from pathlib import Path
+
+from backend import mp4
+
+
+def _box(box_type: bytes, *payload: bytes) -> bytes:
+    body = b"".join(payload)
+    return struct.pack(">I4s", 8 + len(body), box_type) + body
+
+
+def _full(box_type: bytes, *payload: bytes, version: int = 0) -> bytes:
+    return _box(box_type, struct.pack(">I", version << 24), *payload)
+
+
+def _trak(track_id, handler, timescale, stsd, durations, sizes, chunks, sync, cto):
+    stts = _full(
+        b"stts",
+        struct.pack(">I", len(durations)),
+        *(struct.pack(">II", 1, d) for d in durations),
+    )
+    stsc = _full(
+        b"stsc",
+        struct.pack(">I", len(chunks)),
+        *(struct.pack(">III", i + 1, n, 1) for i, (_, n) in enumerate(chunks)),
+    )
+    stsz = _full(
+        b"stsz",
+        struct.pack(">II", 0, len(sizes)),
+        struct.pack(f">{len(sizes)}I", *sizes),
+    )
+    stco = _full(
+        b"stco",
+        struct.pack(">I", len(chunks)),
+        *(struct.pack(">I", off) for off, _ in chunks),
+    )
+    tables = [stsd, stts, stsc, stsz, stco]
+    if sync is not None:
+        tables.append(
+            _full(
+                b"stss",
+                struct.pack(">I", len(sync)),
+                struct.pack(f">{len(sync)}I", *sync),
+            )
+        )
+    if cto is not None:
+        tables.append(
+            _full(
+                b"ctts",
+                struct.pack(">I", len(cto)),
+                *(struct.pack(">II", 1, c) for c in cto),
+            )
+        )
+    media_header = (
+        _full(b"vmhd", struct.pack(">HHHH", 0, 0, 0, 0))
+        if handler == b"vide"
+        else _full(b"smhd", struct.pack(">HH", 0, 0))
+    )
+    return _box(
+        b"trak",
+        _full(b"tkhd", struct.pack(">IIII", 0, 0, track_id, 0), bytes(64)),
+        _box(
+            b"mdia",
+            _full(
+                b"mdhd",
+                struct.pack(">IIIIHH", 0, 0, timescale, sum(durations), 0x55C4, 0),
+            ),
+            _full(b"hdlr", struct.pack(">I4s", 0, handler), bytes(12), b"\0"),
+            _box(
+                b"minf",
+                media_header,
+                _box(b"dinf", _full(b"dref", struct.pack(">I", 0))),
+                _box(b"stbl", *tables),
+            ),
+        ),
+    )
+
+
+def write_sample_mp4(
+    path: Path, *, seconds: int, bitrate_kbps: int
+) -> dict[int, list[bytes]]:
+    """
+    写入测试文件，返回 track_id -> 各样本数据，用于校验
+    """
+    fps, gop, sample_rate = 25, 50, 16000
+    video_count = seconds * fps
+    audio_count = seconds * sample_rate // 1024
+    avg = bitrate_kbps * 1000 // 8 // fps
+    rnd = random.Random(1)
+    video = [
+        os.urandom(avg * 4 if i % gop == 0 else rnd.randint(avg // 2, avg))
+        for i in range(video_count)
+    ]
+    audio = [os.urandom(rnd.randint(200, 400)) for _ in range(audio_count)]
+
+    ftyp = _box(b"ftyp", b"isom", struct.pack(">I", 0x200), b"isomiso2avc1mp41")
+    body = bytearray()
+    base = len(ftyp) + 8
+    video_chunks, audio_chunks = [], []
+    vi = ai = 0
+    # 每 200ms 交错写入一个视频块和一个音频块
+    for step in range(seconds * 5):
+        n = min(5, video_count - vi)
+        if n > 0:
+            video_chunks.append((base + len(body), n))
+            for s in video[vi : vi + n]:
+                body += s
+            vi += n
+        target = min(audio_count, (step + 1) * 200 * sample_rate // 1024 // 1000)
+        if target > ai:
+            audio_chunks.append((base + len(body), target - ai))
+            for s in audio[ai:target]:
+                body += s
+            ai = target
+    if ai < audio_count:
+        audio_chunks.append((base + len(body), audio_count - ai))
+        for s in audio[ai:]:
+            body += s
+
+    avc1 = _box(
+        b"avc1",
+        bytes(6),
+        struct.pack(">H", 1),
+        bytes(16),
+        struct.pack(">HH", 1920, 1080),
+        bytes(50),
+        _box(b"avcC", bytes(8)),
+    )
+    mp4a = _box(
+        b"mp4a",
+        bytes(6),
+        struct.pack(">H", 1),
+        bytes(8),
+        struct.pack(">HHHHI", 1, 16, 0, 0, sample_rate << 16),
+        _full(b"esds", bytes(20)),
+    )
+    moov = _box(
+        b"moov",
+        _full(b"mvhd", struct.pack(">IIII", 0, 0, 1000, seconds * 1000), bytes(80)),
+        _trak(
+            1,
+            b"vide",
+            90000,
+            _full(b"stsd", struct.pack(">I", 1), avc1),
+            [3600] * video_count,
+            [len(s) for s in video],
+            video_chunks,
+            list(range(1, video_count + 1, gop)),
+            [3600 * (i % 3) for i in range(video_count)],
+        ),
+        _trak(
+            2,
+            b"soun",
+            sample_rate,
+            _full(b"stsd", struct.pack(">I", 1), mp4a),
+            [1024] * audio_count,
+            [len(s) for s in audio],
+            audio_chunks,
+            None,
+            None,
+        ),
+    )
+    with open(path, "wb") as f:
+        f.write(ftyp)
+        f.write(struct.pack(">I4s", 8 + len(body), b"mdat"))
+        f.write(body)
+        f.write(moov)
+    return {1: video, 2: audio}
+
+
+def _samples_of(segment: bytes) -> dict[int, list[bytes]]:
+    """
+    按 moof/trun 从分片中拆出各轨道样本
+    """
+    result: dict[int, list[bytes]] = {}
+    boxes = list(mp4.iter_boxes(segment))
+    moof_start = boxes[0][1]
+    for t, _, payload, end in mp4.iter_boxes(segment, boxes[0][2], boxes[0][3]):
+        if t != b"traf":
+            continue
+        track_id = data_offset = None
+        sizes: list[int] = []
+        for t2, _, p2, e2 in mp4.iter_boxes(segment, payload, end):
+            if t2 == b"tfhd":
+                (track_id,) = struct.unpack_from(">I", segment, p2 + 4)
+            elif t2 == b"trun":
+                flags = struct.unpack_from(">I", segment, p2)[0] & 0xFFFFFF
+                count, data_offset = struct.unpack_from(">Ii", segment, p2 + 4)
+                entry = 4 * bin(flags & 0xF00).count("1")
+                for i in range(count):
+                    sizes.append(
+                        struct.unpack_from(">I", segment, p2 + 12 + i * entry + 4)[0]
+                    )
+        pos = moof_start + data_offset
+        for size in sizes:
+            result.setdefault(track_id, []).append(segment[pos : pos + size])
+            pos += size
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=int, default=300)
+    parser.add_argument("--bitrate", type=int, default=2000, help="视频码率 kbps")
+    parser.add_argument("--files", type=int, default=12)
+    args = parser.parse_args()
+
+    tmp = Path(tempfile.mkdtemp())
+    paths = [tmp / f"{i}.mp4" for i in range(args.files)]
+    expected = write_sample_mp4(
+        paths[0], seconds=args.seconds, bitrate_kbps=args.bitrate
+    )
+    for p in paths[1:]:
+        p.write_bytes(paths[0].read_bytes())
+    file_size = paths[0].stat().st_size
+
+    # 校验
+    index = mp4.load_index(paths[0])
+    got: dict[int, list[bytes]] = {}
+    for seq in range(len(index.segments)):
+        for track_id, samples in _samples_of(index.media_segment(seq)).items():
+            got.setdefault(track_id, []).extend(samples)
+    assert got == expected, "分片样本与原文件不一致"
+
+    # 直接读取整个文件
+    t0 = time.perf_counter()
+    for p in paths:
+        with open(p, "rb") as f:
+            while f.read(1 << 20):
+                pass
+    raw = time.perf_counter() - t0
+
+    # 冷启动：解析 moov（生成播放列表的开销）
+    mp4.clear_cache()
+    t0 = time.perf_counter()
+    indexes = [mp4.load_index(p) for p in paths]
+    parse = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    segments = 0
+    for index in indexes:
+        index.init_segment()
+        for seq in range(len(index.segments)):
+            index.media_segment(seq)
+            segments += 1
+    remux = time.perf_counter() - t0
+
+    total_mb = file_size * len(paths) / (1 << 20)
+    print(
+        f"files={len(paths)} size={file_size / (1 << 20):.1f}MB segments={segments} (verified)"
+    )
+    print(f"raw read      {raw * 1000:8.1f} ms  {total_mb / raw:8.1f} MB/s")
+    print(
+        f"moov parse    {parse * 1000:8.1f} ms  {parse / len(paths) * 1000:.2f} ms/file (playlist, cold)"
+    )
+    print(
+        f"remux serve   {remux * 1000:8.1f} ms  {total_mb / remux:8.1f} MB/s  {remux / segments * 1000:.2f} ms/segment"
+    )
+
+
+if __name__ == "__main__":
+    main()
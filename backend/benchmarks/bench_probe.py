@@ -0,0 +1,71 @@
+"""
+录像时间信息读取基准：对比 ffprobe 子进程（旧实现）与直接解析 MP4 头部（当前实现）
+读取 creation_time/时长 的耗时，并校验两者结果一致（未安装 ffprobe 时只测当前实现）
+
+用法：python -m backend.benchmarks.bench_probe [--files 50] [--seconds 300] [--bitrate 2000]
+"""
+
+import argparse
+import shutil
+import struct
+import tempfile
+import time
+from pathlib import Path
+
+from backend import utils
+from backend.benchmarks.bench_hls import write_sample_mp4
+
+
+def _set_creation_time(path: Path, ts: int) -> None:
+    """
+    写入 mvhd.creation_time（测试文件默认为 0）
+    """
+    data = bytearray(path.read_bytes())
+    pos = data.rfind(b"mvhd") + 8
+    struct.pack_into(">I", data, pos, ts + utils._MP4_EPOCH_OFFSET)
+    path.write_bytes(bytes(data))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--seconds", type=int, default=300)
+    parser.add_argument("--bitrate", type=int, default=2000, help="视频码率 kbps")
+    args = parser.parse_args()
+
+    tmp = Path(tempfile.mkdtemp())
+    paths = [tmp / f"event_{i}.mp4" for i in range(args.files)]
+    write_sample_mp4(paths[0], seconds=args.seconds, bitrate_kbps=args.bitrate)
+    _set_creation_time(paths[0], 1758506400)
+    for p in paths[1:]:
+        shutil.copyfile(paths[0], p)
+
+    t0 = time.perf_counter()
+    native = [utils.get_video_shanghai_time(p) for p in paths]
+    native_time = time.perf_counter() - t0
+    assert all(r and r["duration"] == args.seconds for r in native), native[0]
+    print(
+        f"files={len(paths)} size={paths[0].stat().st_size / (1 << 20):.1f}MB "
+        f"start={native[0]['start']} duration={native[0]['duration']}"
+    )
+    print(
+        f"mp4 header  {native_time * 1000:8.1f} ms  {native_time / len(paths) * 1000:.3f} ms/file"
+    )
+
+    if shutil.which("ffprobe") is None:
+        print("ffprobe    未安装，跳过对比")
+        return
+    t0 = time.perf_counter()
+    probed = [utils._ffprobe_shanghai_time(p) for p in paths]
+    probe_time = time.perf_counter() - t0
+    for a, b in zip(native, probed):
+        assert b is not None and a["start"] == b["start"], (a, b)
+        assert abs(a["duration"] - b["duration"]) < 0.05, (a, b)
+    print(
+        f"ffprobe     {probe_time * 1000:8.1f} ms  {probe_time / len(paths) * 1000:.3f} ms/file"
+        f"  ({probe_time / native_time:.0f}x, verified)"
+    )
+
+
+if __name__ == "__main__":
+    main()
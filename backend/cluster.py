@@ -0,0 +1,285 @@
+"""
+ZLM 多节点：节点池、负载评估、心跳健康状态与拉流代理放置。
+每个节点的负载由网络线程负载、流数量（在线流与已分配代理取大者）和入流带宽三项
+按各自上限归一化后相加，新代理放到得分最低的健康且未过载的节点上
+"""
+
+import json
+import time
+from typing import Any
+from typing import Hashable
+from typing import Iterator
+from typing import TypeVar
+
+K = TypeVar("K", bound=Hashable)
+
+
+class ZlmNode:
+    __slots__ = (
+        "id",
+        "url",
+        "secret",
+        "rtsp_port",
+        "max_streams",
+        "max_bandwidth",
+        "healthy",
+        "overloaded",
+        "failures",
+        "successes",
+        "last_seen",
+        "down_since",
+        "threads_load",
+        "streams",
+        "bandwidth",
+        "proxies",
+        "updated_at",
+    )
+
+    def __init__(
+        self,
+        *,
+        id: str,
+        url: str,
+        secret: str,
+        rtsp_port: str | int = 554,
+        max_streams: int = 300,
+        max_bandwidth_mbps: float = 1000,
+    ) -> None:
+        self.id = id
+        self.url = url.rstrip("/")
+        self.secret = secret
+        self.rtsp_port = str(rtsp_port)
+        self.max_streams = max(1, int(max_streams))
+        # 字节/秒，与 getMediaList 的 bytesSpeed 一致
+        self.max_bandwidth = max(1.0, float(max_bandwidth_mbps) * 1_000_000 / 8)
+        self.healthy = True
+        self.overloaded = False
+        # 连续失败/成功的心跳次数，用于判定宕机与恢复（避免抖动）
+        self.failures = 0
+        self.successes = 0
+        # 最近一次心跳成功的时间及判定宕机时采用的故障起点（time.monotonic）
+        self.last_seen: float | None = None
+        self.down_since: float | None = None
+        # 网络线程平均负载（0-100）
+        self.threads_load = 0.0
+        self.streams = 0
+        self.bandwidth = 0.0
+        # 数据库中分配到该节点的拉流代理数
+        self.proxies = 0
+        self.updated_at: float | None = None
+
+    def api(self, name: str) -> str:
+        return f"{self.url}/index/api/{name}"
+
+    @property
+    def score(self) -> float:
+        streams = max(self.streams, self.proxies)
+        return (
+            self.threads_load / 100
+            + streams / self.max_streams
+            + self.bandwidth / self.max_bandwidth
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "url": self.url,
+            "healthy": self.healthy,
+            "overloaded": self.overloaded,
+            "failures": self.failures,
+            "threads_load": round(self.threads_load, 1),
+            "streams": self.streams,
+            "proxies": self.proxies,
+            "bandwidth": int(self.bandwidth),
+            "max_streams": self.max_streams,
+            "max_bandwidth": int(self.max_bandwidth),
+            "score": round(self.score, 4),
+            "updated_at": self.updated_at,
+        }
+
+
+def parse_nodes(spec: str, *, default: ZlmNode) -> list[ZlmNode]:
+    """
+    解析 ZLM_NODES：JSON 数组，每项含 id、url、secret，
+    可选 rtsp_port、max_streams、max_bandwidth_mbps；为空时只有 default 一个节点
+    """
+    if not spec.strip():
+        return [default]
+    raw = json.loads(spec)
+    if not isinstance(raw, list) or not raw:
+        raise ValueError("ZLM_NODES 需为非空 JSON 数组")
+    nodes: list[ZlmNode] = []
+    seen: set[str] = set()
+    for item in raw:
+        if not isinstance(item, dict) or not item.get("id") or not item.get("url"):
+            raise ValueError(f"ZLM_NODES 节点缺少 id 或 url: {item}")
+        node_id = str(item["id"])
+        if node_id in seen:
+            raise ValueError(f"ZLM_NODES 节点 id 重复: {node_id}")
+        seen.add(node_id)
+        nodes.append(
+            ZlmNode(
+                id=node_id,
+                url=str(item["url"]),
+                secret=str(item.get("secret") or default.secret),
+                rtsp_port=item.get("rtsp_port") or default.rtsp_port,
+                max_streams=item.get("max_streams") or 300,
+                max_bandwidth_mbps=item.get("max_bandwidth_mbps") or 1000,
+            )
+        )
+    return nodes
+
+
+class NodePool:
+    """
+    ZLM 节点池，第一个节点为默认节点（推流、配置等无法确定归属的请求发往默认节点）
+    """
+
+    def __init__(self, nodes: list[ZlmNode]) -> None:
+        if not nodes:
+            raise ValueError("至少需要一个 ZLM 节点")
+        self.nodes = {node.id: node for node in nodes}
+        self.default = nodes[0]
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __iter__(self) -> Iterator[ZlmNode]:
+        return iter(self.nodes.values())
+
+    def get(self, node_id: str | None) -> ZlmNode | None:
+        return self.nodes.get(node_id) if node_id else None
+
+    def healthy(self) -> list[ZlmNode]:
+        return [node for node in self if node.healthy]
+
+    def pick(self) -> ZlmNode | None:
+        """
+        负载得分最低的健康节点（优先未过载的），没有可用节点时返回 None
+        """
+        candidates = self.healthy()
+        if not candidates:
+            return None
+        candidates = [n for n in candidates if not n.overloaded] or candidates
+        return min(candidates, key=lambda n: (n.score, n.proxies, n.id))
+
+    def assign(self, node: ZlmNode, previous: str | None = None) -> None:
+        """
+        记录一个代理分配到 node（从 previous 迁出），连续放置时后续选择能看到前面的分配
+        """
+        if previous == node.id:
+            return
+        node.proxies += 1
+        old = self.get(previous)
+        if old is not None:
+            old.proxies = max(0, old.proxies - 1)
+
+    def set_proxy_counts(self, counts: dict[str | None, int]) -> None:
+        for node in self:
+            node.proxies = counts.get(node.id, 0)
+
+    def update_load(
+        self,
+        node_id: str,
+        *,
+        threads_load: float,
+        streams: int,
+        bandwidth: float,
+        overload_load: float = 90,
+    ) -> None:
+        node = self.nodes[node_id]
+        node.threads_load = threads_load
+        node.streams = streams
+        node.bandwidth = bandwidth
+        node.updated_at = time.time()
+        node.overloaded = (
+            threads_load >= overload_load
+            or streams >= node.max_streams
+            or bandwidth >= node.max_bandwidth
+        )
+
+    def heartbeat(
+        self,
+        node_id: str,
+        *,
+        ok: bool,
+        fail_threshold: int = 3,
+        recover_threshold: int = 3,
+    ) -> str | None:
+        """
+        记录一次心跳结果，节点状态变化时返回 "down" / "up"。
+        连续 fail_threshold 次失败判定宕机，宕机后连续 recover_threshold 次成功判定恢复
+        """
+        node = self.nodes[node_id]
+        now = time.monotonic()
+        if ok:
+            node.failures = 0
+            node.successes += 1
+            node.last_seen = now
+            if not node.healthy and node.successes >= recover_threshold:
+                node.healthy = True
+                node.down_since = None
+                return "up"
+            return None
+        node.successes = 0
+        node.failures += 1
+        if node.healthy and node.failures >= fail_threshold:
+            node.healthy = False
+            # 故障起点取最后一次心跳成功的时间，故障转移耗时从这里算起
+            node.down_since = node.last_seen or now
+            return "down"
+        return None
+
+    def plan_rebalance(
+        self,
+        assignments: dict[str, list[K]],
+        *,
+        tolerance: float = 0.1,
+        max_moves: int = 50,
+    ) -> list[tuple[K, str, str]]:
+        """
+        assignments 为节点 id -> 该节点上的代理，返回迁移计划 [(代理, 源节点, 目标节点)]。
+        每次从得分最高的节点迁一个代理到得分最低的节点，两者得分差不超过 tolerance、
+        或迁移后会反超时停止；线程负载无法按流拆分，模拟时视为不变
+        """
+        healthy = {n.id: n for n in self.healthy()}
+        if len(healthy) < 2:
+            return []
+        streams = {i: max(n.streams, n.proxies) for i, n in healthy.items()}
+        bandwidth = {i: n.bandwidth for i, n in healthy.items()}
+        queues = {i: list(assignments.get(i, [])) for i in healthy}
+
+        def score(i: str) -> float:
+            n = healthy[i]
+            return (
+                n.threads_load / 100
+                + streams[i] / n.max_streams
+                + bandwidth[i] / n.max_bandwidth
+            )
+
+        moves: list[tuple[K, str, str]] = []
+        while len(moves) < max_moves:
+            sources = [i for i in healthy if queues[i]]
+            if not sources:
+                break
+            src = max(sources, key=score)
+            dst = min(healthy, key=score)
+            if src == dst or score(src) - score(dst) <= tolerance:
+                break
+            # 按源节点的平均每流带宽估算迁走一个代理的影响
+            per_stream = bandwidth[src] / streams[src] if streams[src] else 0.0
+            after_src = score(src) - (
+                1 / healthy[src].max_streams + per_stream / healthy[src].max_bandwidth
+            )
+            after_dst = score(dst) + (
+                1 / healthy[dst].max_streams + per_stream / healthy[dst].max_bandwidth
+            )
+            # 留出浮点误差，迁移后两者持平时仍然迁移
+            if after_dst > after_src + 1e-9:
+                break
+            moves.append((queues[src].pop(), src, dst))
+            streams[src] -= 1
+            streams[dst] += 1
+            bandwidth[src] -= per_stream
+            bandwidth[dst] += per_stream
+        return moves
@@ -1,8 +1,34 @@
+from .sqlite import close_db
+from .sqlite import count_pull_proxies_by_node
 from .sqlite import delete_pull_proxy
 from .sqlite import delete_record_policy
+from .sqlite import delete_record_segments
+from .sqlite import get_pull_proxy
+from .sqlite import get_record_dir_mtimes
 from .sqlite import get_record_policy
+from .sqlite import get_record_probes
 from .sqlite import init_db
+from .sqlite import iter_pull_proxies
+from .sqlite import list_estimated_record_segments
+from .sqlite import list_metric_rollups
+from .sqlite import list_oldest_record_segments
 from .sqlite import list_pull_proxies
+from .sqlite import list_record_days
 from .sqlite import list_record_policies
+from .sqlite import list_record_ranges
+from .sqlite import list_record_segments
+from .sqlite import list_record_segments_between
+from .sqlite import list_record_streams
+from .sqlite import query_pull_proxies
+from .sqlite import query_timings
+from .sqlite import run_db
+from .sqlite import sync_record_dir
+from .sqlite import update_pull_proxy_nodes
+from .sqlite import update_record_segment_durations
+from .sqlite import upsert_metric_rollups
+from .sqlite import upsert_pull_proxies
 from .sqlite import upsert_pull_proxy
+from .sqlite import upsert_record_policies
 from .sqlite import upsert_record_policy
+from .sqlite import upsert_record_probes
+from .sqlite import upsert_record_segments
@@ -1,13 +1,28 @@
+import asyncio
+import functools
+import json
+import os
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any
+from typing import Callable
 from typing import Iterator
 from typing import TypedDict
+from typing import TypeVar
+
+from ..stats import Histogram
 
 
 DB_PATH = Path(__file__).resolve().parent / "streamui.db"
+# 数据库线程池大小：每个线程持有一个长连接，即连接池大小
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+
+T = TypeVar("T")
 
 
 class PullProxyRow(TypedDict):
@@ -16,6 +31,8 @@ class PullProxyRow(TypedDict):
     stream: str
     url: str
     audio_type: int | None
+    # 所在的 ZLM 节点，尚未放置时为 None
+    node_id: str | None
     created_at: str
     updated_at: str
 
@@ -26,25 +43,159 @@ class RecordPolicyRow(TypedDict):
     stream: str
     retention_days: int
     enabled: int
+    priority: int
     created_at: str
     updated_at: str
 
 
+class RecordSegmentRow(TypedDict):
+    app: str
+    stream: str
+    date: str
+    filename: str
+    start_ts: float
+    duration: float
+    size: int
+    mtime: float
+    # 时长来源：hook（on_record_mp4 的 time_len）、header（MP4 头部）、
+    # probe（文件名无时间，探测所得）、estimate（未能读取，待回填）
+    duration_source: str
+
+
+class RecordProbeRow(TypedDict):
+    app: str
+    stream: str
+    date: str
+    filename: str
+    size: int
+    mtime: float
+    # 探测失败时为 None，文件变化前不再重复探测
+    start_ts: float | None
+    duration: float | None
+
+
+class RecordDayRow(TypedDict):
+    app: str
+    stream: str
+    date: str
+    slice_num: int
+    total_size: int
+    total_duration: float
+
+
+class MetricRollupRow(TypedDict):
+    resolution: int
+    ts: int
+    # 指标名 -> [avg, min, max]
+    data: dict[str, list[float]]
+
+
 def _utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat(timespec="seconds")
 
 
+_local = threading.local()
+_connections: list[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="sqlite")
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # 连接只在创建它的线程内使用；关闭 check_same_thread 仅为了 close_db 统一关闭
+    conn = sqlite3.connect(
+        str(path),
+        timeout=10,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=256,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA foreign_keys=ON;")
+    conn.execute("PRAGMA busy_timeout=10000;")
+    conn.execute("PRAGMA cache_size=-16384;")
+    conn.execute("PRAGMA mmap_size=268435456;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    with _connections_lock:
+        _connections.append(conn)
+    return conn
+
+
 @contextmanager
 def get_db() -> Iterator[sqlite3.Connection]:
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(DB_PATH), timeout=10, isolation_level=None)
+    """
+    返回当前线程的长连接，PRAGMA 只在建立连接时设置一次，
+    语句缓存随连接常驻，重复执行的 SQL 无需再次编译
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != DB_PATH:
+        conn = _connect(DB_PATH)
+        _local.conn = conn
+        _local.path = DB_PATH
     try:
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA journal_mode=WAL;")
-        conn.execute("PRAGMA foreign_keys=ON;")
         yield conn
     finally:
-        conn.close()
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+
+
+def close_db() -> None:
+    with _connections_lock:
+        for conn in _connections:
+            try:
+                conn.close()
+            except Exception:
+                continue
+        _connections.clear()
+
+
+# 数据库函数名 -> 执行耗时直方图及失败次数（不含线程池排队时间）
+_QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+_query_timings: dict[str, Histogram] = {}
+_query_errors: dict[str, int] = {}
+_query_timings_lock = threading.Lock()
+
+
+def _timed_call(fn: Callable[..., T], args: tuple, kwargs: dict) -> T:
+    started = time.perf_counter()
+    ok = False
+    try:
+        result = fn(*args, **kwargs)
+        ok = True
+        return result
+    finally:
+        elapsed = time.perf_counter() - started
+        name = getattr(fn, "__name__", "unknown")
+        with _query_timings_lock:
+            hist = _query_timings.get(name)
+            if hist is None:
+                hist = _query_timings[name] = Histogram(_QUERY_BUCKETS)
+            hist.observe(elapsed)
+            if not ok:
+                _query_errors[name] = _query_errors.get(name, 0) + 1
+
+
+def query_timings() -> dict[str, tuple[Histogram, int]]:
+    """
+    经 run_db 执行的各数据库函数的耗时直方图副本及失败次数
+    """
+    with _query_timings_lock:
+        return {
+            name: (hist.copy(), _query_errors.get(name, 0))
+            for name, hist in _query_timings.items()
+        }
+
+
+async def run_db(fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+    """
+    在数据库线程池中执行同步的数据库函数，避免阻塞事件循环
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, functools.partial(_timed_call, fn, args, kwargs)
+    )
 
 
 def init_db() -> None:
@@ -73,19 +224,195 @@ def init_db() -> None:
                 stream TEXT NOT NULL,
                 retention_days INTEGER NOT NULL,
                 enabled INTEGER NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
                 created_at TEXT NOT NULL,
                 updated_at TEXT NOT NULL,
                 UNIQUE(vhost, app, stream)
             )
             """
         )
+        # 旧库补充 priority 列：磁盘空间不足时优先级高的流保留更久
+        columns = {
+            row["name"]
+            for row in db.execute("PRAGMA table_info(record_policy)").fetchall()
+        }
+        if "priority" not in columns:
+            db.execute(
+                "ALTER TABLE record_policy ADD COLUMN priority INTEGER NOT NULL DEFAULT 0"
+            )
+        # 旧库补充 node_id 列：多节点部署时拉流代理所在的 ZLM 节点
+        columns = {
+            row["name"]
+            for row in db.execute("PRAGMA table_info(pull_proxy)").fetchall()
+        }
+        if "node_id" not in columns:
+            db.execute("ALTER TABLE pull_proxy ADD COLUMN node_id TEXT")
+        db.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_pull_proxy_node
+            ON pull_proxy(node_id)
+            """
+        )
+        db.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_pull_proxy_vhost_stream
+            ON pull_proxy(vhost, stream)
+            """
+        )
+        db.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_pull_proxy_vhost_updated
+            ON pull_proxy(vhost, updated_at)
+            """
+        )
+        # 录像片段索引：每个 .mp4 一行，record_day 为按 app/stream/日期 的汇总，
+        # 由触发器随 record_segment 的增删改自动维护
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS record_segment (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                app TEXT NOT NULL,
+                stream TEXT NOT NULL,
+                date TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                start_ts REAL NOT NULL,
+                duration REAL NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                duration_source TEXT NOT NULL DEFAULT 'estimate',
+                UNIQUE(app, stream, date, filename)
+            )
+            """
+        )
+        # 旧库补充 duration_source 列：已有片段的时长来源未知，统一标记为待回填
+        columns = {
+            row["name"]
+            for row in db.execute("PRAGMA table_info(record_segment)").fetchall()
+        }
+        if "duration_source" not in columns:
+            db.execute(
+                "ALTER TABLE record_segment ADD COLUMN duration_source TEXT NOT NULL DEFAULT 'estimate'"
+            )
+        db.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_record_segment_estimate
+            ON record_segment(duration_source) WHERE duration_source='estimate'
+            """
+        )
+        db.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_record_segment_start
+            ON record_segment(app, stream, start_ts)
+            """
+        )
+        # 按时间窗口查询时用流内最长片段时长确定起始时间下界
+        db.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_record_segment_duration
+            ON record_segment(app, stream, duration)
+            """
+        )
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS record_day (
+                app TEXT NOT NULL,
+                stream TEXT NOT NULL,
+                date TEXT NOT NULL,
+                slice_num INTEGER NOT NULL,
+                total_size INTEGER NOT NULL,
+                total_duration REAL NOT NULL,
+                PRIMARY KEY(app, stream, date)
+            )
+            """
+        )
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS record_dir (
+                app TEXT NOT NULL,
+                stream TEXT NOT NULL,
+                date TEXT NOT NULL,
+                mtime REAL NOT NULL,
+                PRIMARY KEY(app, stream, date)
+            )
+            """
+        )
+        # 文件名无法解析时间的片段的 ffprobe 结果，按 (size, mtime) 判断是否失效
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS record_probe (
+                app TEXT NOT NULL,
+                stream TEXT NOT NULL,
+                date TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                start_ts REAL,
+                duration REAL,
+                PRIMARY KEY(app, stream, date, filename)
+            ) WITHOUT ROWID
+            """
+        )
+        # 监控指标汇总：每个 (粒度, 桶起始时间) 一行，指标以 JSON 存储
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS metric_rollup (
+                resolution INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY(resolution, ts)
+            ) WITHOUT ROWID
+            """
+        )
+        db.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_record_segment_insert
+            AFTER INSERT ON record_segment
+            BEGIN
+                INSERT OR IGNORE INTO record_day (app, stream, date, slice_num, total_size, total_duration)
+                VALUES (NEW.app, NEW.stream, NEW.date, 0, 0, 0);
+                UPDATE record_day
+                SET slice_num = slice_num + 1,
+                    total_size = total_size + NEW.size,
+                    total_duration = total_duration + NEW.duration
+                WHERE app = NEW.app AND stream = NEW.stream AND date = NEW.date;
+            END
+            """
+        )
+        db.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_record_segment_delete
+            AFTER DELETE ON record_segment
+            BEGIN
+                UPDATE record_day
+                SET slice_num = slice_num - 1,
+                    total_size = total_size - OLD.size,
+                    total_duration = total_duration - OLD.duration
+                WHERE app = OLD.app AND stream = OLD.stream AND date = OLD.date;
+                DELETE FROM record_day
+                WHERE app = OLD.app AND stream = OLD.stream AND date = OLD.date
+                    AND slice_num <= 0;
+            END
+            """
+        )
+        db.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_record_segment_update
+            AFTER UPDATE OF size, duration ON record_segment
+            BEGIN
+                UPDATE record_day
+                SET total_size = total_size - OLD.size + NEW.size,
+                    total_duration = total_duration - OLD.duration + NEW.duration
+                WHERE app = NEW.app AND stream = NEW.stream AND date = NEW.date;
+            END
+            """
+        )
 
 
 def list_pull_proxies() -> list[PullProxyRow]:
     with get_db() as db:
         rows = db.execute(
             """
-            SELECT vhost, app, stream, url, audio_type, created_at, updated_at
+            SELECT vhost, app, stream, url, audio_type, node_id, created_at, updated_at
             FROM pull_proxy
             ORDER BY id DESC
             """
@@ -94,6 +421,102 @@ def list_pull_proxies() -> list[PullProxyRow]:
     return [dict(row) for row in rows]  # type: ignore[return-value]
 
 
+PULL_PROXY_SORT_COLUMNS = {
+    "id": "id",
+    "created_at": "id",
+    "updated_at": "updated_at",
+    "app": "app",
+    "stream": "stream",
+}
+
+
+# 前缀范围的上界：最大码位的 UTF-8 编码大于前缀之后可能出现的任何字符
+_PREFIX_UPPER = "\U0010ffff"
+
+
+def query_pull_proxies(
+    *,
+    vhost: str | None = None,
+    app: str | None = None,
+    stream: str | None = None,
+    online_keys: list[str] | None = None,
+    online: bool | None = None,
+    node_id: str | None = None,
+    sort: str = "id",
+    order: str = "desc",
+    limit: int | None = None,
+    offset: int = 0,
+) -> tuple[list[PullProxyRow], int]:
+    """
+    分页查询拉流代理，返回 (当前页, 过滤后总数)
+    app/stream 为前缀匹配（区分大小写），按范围条件查询，可走 (vhost, app, stream)、
+    (vhost, stream) 索引；online 为 True/False 时按 online_keys（vhost/app/stream）筛选
+    """
+    where: list[str] = []
+    params: list[Any] = []
+    if vhost:
+        where.append("vhost=?")
+        params.append(vhost)
+    if app:
+        where.append("app>=? AND app<?")
+        params += [app, app + _PREFIX_UPPER]
+    if stream:
+        where.append("stream>=? AND stream<?")
+        params += [stream, stream + _PREFIX_UPPER]
+    if node_id:
+        where.append("node_id=?")
+        params.append(node_id)
+    if online is not None:
+        op = "IN" if online else "NOT IN"
+        where.append(
+            f"(vhost || '/' || app || '/' || stream) {op} (SELECT value FROM json_each(?))"
+        )
+        params.append(json.dumps(online_keys or []))
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    column = PULL_PROXY_SORT_COLUMNS.get(sort, "id")
+    direction = "ASC" if str(order).lower() == "asc" else "DESC"
+    order_sql = f"ORDER BY {column} {direction}"
+    if column != "id":
+        order_sql += f", id {direction}"
+
+    page_sql = ""
+    page_params: list[Any] = []
+    if limit is not None:
+        page_sql = "LIMIT ? OFFSET ?"
+        page_params = [int(limit), max(int(offset), 0)]
+
+    with get_db() as db:
+        total = db.execute(
+            f"SELECT COUNT(*) FROM pull_proxy {where_sql}", params
+        ).fetchone()[0]
+        rows = db.execute(
+            f"""
+            SELECT vhost, app, stream, url, audio_type, node_id, created_at, updated_at
+            FROM pull_proxy
+            {where_sql}
+            {order_sql}
+            {page_sql}
+            """,
+            params + page_params,
+        ).fetchall()
+
+    return [dict(row) for row in rows], int(total)  # type: ignore[return-value]
+
+
+def get_pull_proxy(*, vhost: str, app: str, stream: str) -> PullProxyRow | None:
+    with get_db() as db:
+        row = db.execute(
+            """
+            SELECT vhost, app, stream, url, audio_type, node_id, created_at, updated_at
+            FROM pull_proxy
+            WHERE vhost=? AND app=? AND stream=?
+            """,
+            (vhost, app, stream),
+        ).fetchone()
+    return dict(row) if row else None  # type: ignore[return-value]
+
+
 def upsert_pull_proxy(
     *,
     vhost: str,
@@ -141,7 +564,7 @@ def upsert_pull_proxy(
 
         row = db.execute(
             """
-            SELECT vhost, app, stream, url, audio_type, created_at, updated_at
+            SELECT vhost, app, stream, url, audio_type, node_id, created_at, updated_at
             FROM pull_proxy
             WHERE vhost=? AND app=? AND stream=?
             """,
@@ -151,6 +574,124 @@ def upsert_pull_proxy(
     return dict(row) if row else {}
 
 
+def upsert_pull_proxies(
+    rows: list[dict[str, Any]],
+) -> dict[tuple[str, str, str], str | None]:
+    """
+    在一个事务中批量写入拉流代理，任一行失败则全部回滚。
+    返回写入的每个代理 (vhost, app, stream) -> 当前分配的节点（新代理为 None）
+    """
+    if not rows:
+        return {}
+    now = _utc_now_iso()
+    params = [
+        (r["vhost"], r["app"], r["stream"], r["url"], r.get("audio_type"), now, now)
+        for r in rows
+    ]
+    with get_db() as db:
+        db.execute("BEGIN")
+        try:
+            try:
+                db.executemany(
+                    """
+                    INSERT INTO pull_proxy (vhost, app, stream, url, audio_type, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(vhost, app, stream) DO UPDATE SET
+                        url=excluded.url,
+                        audio_type=excluded.audio_type,
+                        updated_at=excluded.updated_at
+                    """,
+                    params,
+                )
+            except sqlite3.OperationalError:
+                for vhost, app, stream, url, audio_type, created, updated in params:
+                    cur = db.execute(
+                        """
+                        UPDATE pull_proxy
+                        SET url=?, audio_type=?, updated_at=?
+                        WHERE vhost=? AND app=? AND stream=?
+                        """,
+                        (url, audio_type, updated, vhost, app, stream),
+                    )
+                    if cur.rowcount:
+                        continue
+                    db.execute(
+                        """
+                        INSERT INTO pull_proxy (vhost, app, stream, url, audio_type, created_at, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                        """,
+                        (vhost, app, stream, url, audio_type, created, updated),
+                    )
+            # 只按主键查询本次写入的代理，开销与表大小无关
+            assigned: dict[tuple[str, str, str], str | None] = {}
+            for vhost, app, stream, *_ in params:
+                row = db.execute(
+                    "SELECT node_id FROM pull_proxy WHERE vhost=? AND app=? AND stream=?",
+                    (vhost, app, stream),
+                ).fetchone()
+                assigned[(vhost, app, stream)] = row["node_id"] if row else None
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    return assigned
+
+
+def iter_pull_proxies(*, batch_size: int = 500) -> Iterator[PullProxyRow]:
+    """
+    按 id 分批读取全部拉流代理，用于流式导出；
+    每批单独取连接，不跨 yield 占用连接，可在不同线程中迭代
+    """
+    last_id = 0
+    while True:
+        with get_db() as db:
+            rows = db.execute(
+                """
+                SELECT id, vhost, app, stream, url, audio_type, node_id, created_at, updated_at
+                FROM pull_proxy
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+                """,
+                (last_id, batch_size),
+            ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1]["id"]
+        for row in rows:
+            item = dict(row)
+            item.pop("id")
+            yield item  # type: ignore[misc]
+
+
+def update_pull_proxy_nodes(rows: list[dict[str, Any]]) -> int:
+    """
+    在一个事务中批量更新拉流代理所在的节点，rows 含 vhost/app/stream/node_id
+    """
+    if not rows:
+        return 0
+    with get_db() as db:
+        db.execute("BEGIN")
+        try:
+            cur = db.executemany(
+                "UPDATE pull_proxy SET node_id=? WHERE vhost=? AND app=? AND stream=?",
+                [(r["node_id"], r["vhost"], r["app"], r["stream"]) for r in rows],
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    return int(cur.rowcount or 0)
+
+
+def count_pull_proxies_by_node() -> dict[str | None, int]:
+    with get_db() as db:
+        rows = db.execute(
+            "SELECT node_id, COUNT(*) AS n FROM pull_proxy GROUP BY node_id"
+        ).fetchall()
+    return {row["node_id"]: int(row["n"]) for row in rows}
+
+
 def delete_pull_proxy(*, vhost: str, app: str, stream: str) -> int:
     with get_db() as db:
         cur = db.execute(
@@ -165,7 +706,7 @@ def list_record_policies(*, enabled_only: bool = False) -> list[RecordPolicyRow]
         if enabled_only:
             rows = db.execute(
                 """
-                SELECT vhost, app, stream, retention_days, enabled, created_at, updated_at
+                SELECT vhost, app, stream, retention_days, enabled, priority, created_at, updated_at
                 FROM record_policy
                 WHERE enabled=1
                 ORDER BY id DESC
@@ -174,7 +715,7 @@ def list_record_policies(*, enabled_only: bool = False) -> list[RecordPolicyRow]
         else:
             rows = db.execute(
                 """
-                SELECT vhost, app, stream, retention_days, enabled, created_at, updated_at
+                SELECT vhost, app, stream, retention_days, enabled, priority, created_at, updated_at
                 FROM record_policy
                 ORDER BY id DESC
                 """
@@ -187,7 +728,7 @@ def get_record_policy(*, vhost: str, app: str, stream: str) -> RecordPolicyRow |
     with get_db() as db:
         row = db.execute(
             """
-            SELECT vhost, app, stream, retention_days, enabled, created_at, updated_at
+            SELECT vhost, app, stream, retention_days, enabled, priority, created_at, updated_at
             FROM record_policy
             WHERE vhost=? AND app=? AND stream=?
             """,
@@ -203,21 +744,37 @@ def upsert_record_policy(
     stream: str,
     retention_days: int,
     enabled: bool,
+    priority: int | None = None,
 ) -> dict[str, Any]:
+    """
+    priority 为 None 时保留已有值（新建时为 0）
+    """
     now = _utc_now_iso()
     enabled_int = 1 if enabled else 0
+    priority_int = None if priority is None else int(priority)
     with get_db() as db:
         try:
             db.execute(
                 """
-                INSERT INTO record_policy (vhost, app, stream, retention_days, enabled, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
+                INSERT INTO record_policy (vhost, app, stream, retention_days, enabled, priority, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, COALESCE(?, 0), ?, ?)
                 ON CONFLICT(vhost, app, stream) DO UPDATE SET
                     retention_days=excluded.retention_days,
                     enabled=excluded.enabled,
+                    priority=COALESCE(?, record_policy.priority),
                     updated_at=excluded.updated_at
                 """,
-                (vhost, app, stream, int(retention_days), enabled_int, now, now),
+                (
+                    vhost,
+                    app,
+                    stream,
+                    int(retention_days),
+                    enabled_int,
+                    priority_int,
+                    now,
+                    now,
+                    priority_int,
+                ),
             )
         except sqlite3.OperationalError:
             existing = db.execute(
@@ -228,23 +785,40 @@ def upsert_record_policy(
                 db.execute(
                     """
                     UPDATE record_policy
-                    SET retention_days=?, enabled=?, updated_at=?
+                    SET retention_days=?, enabled=?, priority=COALESCE(?, priority), updated_at=?
                     WHERE vhost=? AND app=? AND stream=?
                     """,
-                    (int(retention_days), enabled_int, now, vhost, app, stream),
+                    (
+                        int(retention_days),
+                        enabled_int,
+                        priority_int,
+                        now,
+                        vhost,
+                        app,
+                        stream,
+                    ),
                 )
             else:
                 db.execute(
                     """
-                    INSERT INTO record_policy (vhost, app, stream, retention_days, enabled, created_at, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    INSERT INTO record_policy (vhost, app, stream, retention_days, enabled, priority, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                     """,
-                    (vhost, app, stream, int(retention_days), enabled_int, now, now),
+                    (
+                        vhost,
+                        app,
+                        stream,
+                        int(retention_days),
+                        enabled_int,
+                        priority_int or 0,
+                        now,
+                        now,
+                    ),
                 )
 
         row = db.execute(
             """
-            SELECT vhost, app, stream, retention_days, enabled, created_at, updated_at
+            SELECT vhost, app, stream, retention_days, enabled, priority, created_at, updated_at
             FROM record_policy
             WHERE vhost=? AND app=? AND stream=?
             """,
@@ -254,6 +828,57 @@ def upsert_record_policy(
     return dict(row) if row else {}
 
 
+def upsert_record_policies(rows: list[dict[str, Any]]) -> int:
+    """
+    在一个事务中批量修改录像策略，任一行失败则全部回滚。
+    enabled 为真时按 upsert_record_policy 写入（priority 为 None 时保留已有值）；
+    为假时只停用已有策略，保留录像天数
+    """
+    if not rows:
+        return 0
+    now = _utc_now_iso()
+    changed = 0
+    with get_db() as db:
+        db.execute("BEGIN")
+        try:
+            for r in rows:
+                key = (r["vhost"], r["app"], r["stream"])
+                if not r["enabled"]:
+                    cur = db.execute(
+                        """
+                        UPDATE record_policy SET enabled=0, updated_at=?
+                        WHERE vhost=? AND app=? AND stream=?
+                        """,
+                        (now, *key),
+                    )
+                    changed += int(cur.rowcount or 0)
+                    continue
+                priority = r.get("priority")
+                priority = None if priority is None else int(priority)
+                cur = db.execute(
+                    """
+                    UPDATE record_policy
+                    SET retention_days=?, enabled=1, priority=COALESCE(?, priority), updated_at=?
+                    WHERE vhost=? AND app=? AND stream=?
+                    """,
+                    (int(r["retention_days"]), priority, now, *key),
+                )
+                if not cur.rowcount:
+                    db.execute(
+                        """
+                        INSERT INTO record_policy (vhost, app, stream, retention_days, enabled, priority, created_at, updated_at)
+                        VALUES (?, ?, ?, ?, 1, ?, ?, ?)
+                        """,
+                        (*key, int(r["retention_days"]), priority or 0, now, now),
+                    )
+                changed += 1
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    return changed
+
+
 def delete_record_policy(*, vhost: str, app: str, stream: str) -> int:
     with get_db() as db:
         cur = db.execute(
@@ -261,3 +886,489 @@ def delete_record_policy(*, vhost: str, app: str, stream: str) -> int:
             (vhost, app, stream),
         )
         return int(cur.rowcount or 0)
+
+
+def _upsert_record_segment(db: sqlite3.Connection, row: RecordSegmentRow) -> None:
+    cur = db.execute(
+        """
+        UPDATE record_segment
+        SET start_ts=?, duration=?, size=?, mtime=?, duration_source=?
+        WHERE app=? AND stream=? AND date=? AND filename=?
+        """,
+        (
+            float(row["start_ts"]),
+            float(row["duration"]),
+            int(row["size"]),
+            float(row["mtime"]),
+            row.get("duration_source") or "estimate",
+            row["app"],
+            row["stream"],
+            row["date"],
+            row["filename"],
+        ),
+    )
+    if cur.rowcount:
+        return
+    db.execute(
+        """
+        INSERT INTO record_segment
+            (app, stream, date, filename, start_ts, duration, size, mtime, duration_source)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            row["app"],
+            row["stream"],
+            row["date"],
+            row["filename"],
+            float(row["start_ts"]),
+            float(row["duration"]),
+            int(row["size"]),
+            float(row["mtime"]),
+            row.get("duration_source") or "estimate",
+        ),
+    )
+
+
+def upsert_record_segments(rows: list[RecordSegmentRow]) -> int:
+    if not rows:
+        return 0
+    with get_db() as db:
+        db.execute("BEGIN")
+        try:
+            for row in rows:
+                _upsert_record_segment(db, row)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    return len(rows)
+
+
+def delete_record_segments(
+    *,
+    app: str,
+    stream: str,
+    date: str | None = None,
+    filenames: list[str] | None = None,
+) -> int:
+    with get_db() as db:
+        db.execute("BEGIN")
+        try:
+            if filenames is not None:
+                deleted = 0
+                for filename in filenames:
+                    cur = db.execute(
+                        """
+                        DELETE FROM record_segment
+                        WHERE app=? AND stream=? AND date=? AND filename=?
+                        """,
+                        (app, stream, date, filename),
+                    )
+                    deleted += int(cur.rowcount or 0)
+                    db.execute(
+                        """
+                        DELETE FROM record_probe
+                        WHERE app=? AND stream=? AND date=? AND filename=?
+                        """,
+                        (app, stream, date, filename),
+                    )
+            elif date is not None:
+                cur = db.execute(
+                    "DELETE FROM record_segment WHERE app=? AND stream=? AND date=?",
+                    (app, stream, date),
+                )
+                deleted = int(cur.rowcount or 0)
+                db.execute(
+                    "DELETE FROM record_dir WHERE app=? AND stream=? AND date=?",
+                    (app, stream, date),
+                )
+                db.execute(
+                    "DELETE FROM record_probe WHERE app=? AND stream=? AND date=?",
+                    (app, stream, date),
+                )
+            else:
+                cur = db.execute(
+                    "DELETE FROM record_segment WHERE app=? AND stream=?",
+                    (app, stream),
+                )
+                deleted = int(cur.rowcount or 0)
+                db.execute(
+                    "DELETE FROM record_dir WHERE app=? AND stream=?",
+                    (app, stream),
+                )
+                db.execute(
+                    "DELETE FROM record_probe WHERE app=? AND stream=?",
+                    (app, stream),
+                )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    return deleted
+
+
+def list_record_segments(*, app: str, stream: str, date: str) -> list[RecordSegmentRow]:
+    with get_db() as db:
+        rows = db.execute(
+            """
+            SELECT app, stream, date, filename, start_ts, duration, size, mtime,
+                duration_source
+            FROM record_segment
+            WHERE app=? AND stream=? AND date=?
+            ORDER BY start_ts
+            """,
+            (app, stream, date),
+        ).fetchall()
+
+    return [dict(row) for row in rows]  # type: ignore[return-value]
+
+
+# 与 [start_ts, end_ts) 相交的片段：起始时间下界按该流最长的片段时长回推，
+# MAX(duration) 走 idx_record_segment_duration，范围扫描走 idx_record_segment_start
+_SEGMENT_WINDOW_WHERE = """
+    app=? AND stream=? AND start_ts<? AND start_ts + duration>?
+    AND start_ts>=? - (
+        SELECT IFNULL(MAX(duration), 0) FROM record_segment WHERE app=? AND stream=?
+    )
+"""
+
+
+def _segment_window_params(
+    app: str, stream: str, start_ts: float, end_ts: float
+) -> tuple:
+    return (app, stream, float(end_ts), float(start_ts), float(start_ts), app, stream)
+
+
+def list_record_ranges(
+    *, app: str, stream: str, start_ts: float, end_ts: float
+) -> list[tuple[float, float]]:
+    """
+    返回与 [start_ts, end_ts) 相交的片段 (起始, 结束)，按起始时间排序
+    """
+    with get_db() as db:
+        rows = db.execute(
+            f"""
+            SELECT start_ts, start_ts + duration
+            FROM record_segment
+            WHERE {_SEGMENT_WINDOW_WHERE}
+            ORDER BY start_ts
+            """,
+            _segment_window_params(app, stream, start_ts, end_ts),
+        ).fetchall()
+
+    return [(row[0], row[1]) for row in rows]
+
+
+def list_record_segments_between(
+    *, app: str, stream: str, start_ts: float, end_ts: float
+) -> list[RecordSegmentRow]:
+    """
+    返回与 [start_ts, end_ts) 相交的片段，按起始时间排序
+    """
+    with get_db() as db:
+        rows = db.execute(
+            f"""
+            SELECT app, stream, date, filename, start_ts, duration, size, mtime,
+                duration_source
+            FROM record_segment
+            WHERE {_SEGMENT_WINDOW_WHERE}
+            ORDER BY start_ts
+            """,
+            _segment_window_params(app, stream, start_ts, end_ts),
+        ).fetchall()
+
+    return [dict(row) for row in rows]  # type: ignore[misc]
+
+
+def list_oldest_record_segments(
+    *, app: str, stream: str, limit: int = 64
+) -> list[RecordSegmentRow]:
+    """
+    按起始时间升序返回某个流最早的若干片段
+    """
+    with get_db() as db:
+        rows = db.execute(
+            """
+            SELECT app, stream, date, filename, start_ts, duration, size, mtime,
+                duration_source
+            FROM record_segment
+            WHERE app=? AND stream=?
+            ORDER BY start_ts
+            LIMIT ?
+            """,
+            (app, stream, int(limit)),
+        ).fetchall()
+
+    return [dict(row) for row in rows]  # type: ignore[return-value]
+
+
+def list_estimated_record_segments(*, limit: int = 500) -> list[RecordSegmentRow]:
+    """
+    返回时长尚未确定（duration_source='estimate'）的片段，用于回填
+    """
+    with get_db() as db:
+        rows = db.execute(
+            """
+            SELECT app, stream, date, filename, start_ts, duration, size, mtime,
+                duration_source
+            FROM record_segment
+            WHERE duration_source='estimate'
+            LIMIT ?
+            """,
+            (int(limit),),
+        ).fetchall()
+
+    return [dict(row) for row in rows]  # type: ignore[return-value]
+
+
+def update_record_segment_durations(rows: list[RecordSegmentRow]) -> int:
+    """
+    只更新时长及来源；文件在此期间发生变化（size/mtime 不一致）的行不更新
+    """
+    if not rows:
+        return 0
+    updated = 0
+    with get_db() as db:
+        db.execute("BEGIN")
+        try:
+            for row in rows:
+                cur = db.execute(
+                    """
+                    UPDATE record_segment
+                    SET duration=?, duration_source=?
+                    WHERE app=? AND stream=? AND date=? AND filename=?
+                        AND size=? AND mtime=?
+                    """,
+                    (
+                        float(row["duration"]),
+                        row["duration_source"],
+                        row["app"],
+                        row["stream"],
+                        row["date"],
+                        row["filename"],
+                        int(row["size"]),
+                        float(row["mtime"]),
+                    ),
+                )
+                updated += int(cur.rowcount or 0)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    return updated
+
+
+def list_record_streams() -> list[tuple[str, str]]:
+    with get_db() as db:
+        rows = db.execute("SELECT DISTINCT app, stream FROM record_day").fetchall()
+    return [(row["app"], row["stream"]) for row in rows]
+
+
+def list_record_days(
+    *, app: str | None = None, stream: str | None = None
+) -> list[RecordDayRow]:
+    with get_db() as db:
+        if app is not None and stream is not None:
+            rows = db.execute(
+                """
+                SELECT app, stream, date, slice_num, total_size, total_duration
+                FROM record_day
+                WHERE app=? AND stream=?
+                ORDER BY date
+                """,
+                (app, stream),
+            ).fetchall()
+        else:
+            rows = db.execute(
+                """
+                SELECT app, stream, date, slice_num, total_size, total_duration
+                FROM record_day
+                ORDER BY app, stream, date
+                """
+            ).fetchall()
+
+    return [dict(row) for row in rows]  # type: ignore[return-value]
+
+
+def get_record_dir_mtimes() -> dict[tuple[str, str, str], float]:
+    with get_db() as db:
+        rows = db.execute("SELECT app, stream, date, mtime FROM record_dir").fetchall()
+    return {
+        (row["app"], row["stream"], row["date"]): float(row["mtime"]) for row in rows
+    }
+
+
+def sync_record_dir(
+    *,
+    app: str,
+    stream: str,
+    date: str,
+    mtime: float,
+    rows: list[RecordSegmentRow],
+) -> tuple[int, int]:
+    """
+    以磁盘上某个日期目录的实际内容为准，整体校准该目录在索引中的片段
+    返回 (新增或更新数, 删除数)
+    """
+    with get_db() as db:
+        db.execute("BEGIN")
+        try:
+            existing = {
+                r["filename"]: (int(r["size"]), float(r["mtime"]))
+                for r in db.execute(
+                    """
+                    SELECT filename, size, mtime FROM record_segment
+                    WHERE app=? AND stream=? AND date=?
+                    """,
+                    (app, stream, date),
+                ).fetchall()
+            }
+            on_disk = {row["filename"] for row in rows}
+            removed = [name for name in existing if name not in on_disk]
+            for name in removed:
+                db.execute(
+                    """
+                    DELETE FROM record_segment
+                    WHERE app=? AND stream=? AND date=? AND filename=?
+                    """,
+                    (app, stream, date, name),
+                )
+                db.execute(
+                    """
+                    DELETE FROM record_probe
+                    WHERE app=? AND stream=? AND date=? AND filename=?
+                    """,
+                    (app, stream, date, name),
+                )
+            changed = 0
+            for row in rows:
+                if existing.get(row["filename"]) == (
+                    int(row["size"]),
+                    float(row["mtime"]),
+                ):
+                    continue
+                _upsert_record_segment(db, row)
+                changed += 1
+            db.execute(
+                "DELETE FROM record_dir WHERE app=? AND stream=? AND date=?",
+                (app, stream, date),
+            )
+            db.execute(
+                "INSERT INTO record_dir (app, stream, date, mtime) VALUES (?, ?, ?, ?)",
+                (app, stream, date, float(mtime)),
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    return changed, len(removed)
+
+
+def get_record_probes(*, app: str, stream: str, date: str) -> dict[str, RecordProbeRow]:
+    with get_db() as db:
+        rows = db.execute(
+            """
+            SELECT app, stream, date, filename, size, mtime, start_ts, duration
+            FROM record_probe
+            WHERE app=? AND stream=? AND date=?
+            """,
+            (app, stream, date),
+        ).fetchall()
+    return {row["filename"]: dict(row) for row in rows}  # type: ignore[misc]
+
+
+def upsert_record_probes(rows: list[RecordProbeRow]) -> int:
+    if not rows:
+        return 0
+    with get_db() as db:
+        db.execute("BEGIN")
+        try:
+            db.executemany(
+                """
+                INSERT OR REPLACE INTO record_probe
+                    (app, stream, date, filename, size, mtime, start_ts, duration)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        row["app"],
+                        row["stream"],
+                        row["date"],
+                        row["filename"],
+                        int(row["size"]),
+                        float(row["mtime"]),
+                        row["start_ts"],
+                        row["duration"],
+                    )
+                    for row in rows
+                ],
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    return len(rows)
+
+
+def upsert_metric_rollups(
+    rows: list[MetricRollupRow], *, retention: dict[int, float] | None = None
+) -> int:
+    """
+    写入汇总桶；retention 为 分辨率 -> 保留秒数，同一事务内删除各分辨率超出保留期的旧桶
+    """
+    if not rows:
+        return 0
+    cutoffs: dict[int, float] = {}
+    for row in rows:
+        resolution = int(row["resolution"])
+        if retention and resolution in retention:
+            cutoff = row["ts"] - retention[resolution]
+            cutoffs[resolution] = max(cutoffs.get(resolution, cutoff), cutoff)
+    with get_db() as db:
+        db.execute("BEGIN")
+        try:
+            db.executemany(
+                "INSERT OR REPLACE INTO metric_rollup (resolution, ts, data) VALUES (?, ?, ?)",
+                [
+                    (
+                        int(row["resolution"]),
+                        int(row["ts"]),
+                        json.dumps(row["data"], separators=(",", ":")),
+                    )
+                    for row in rows
+                ],
+            )
+            for resolution, cutoff in cutoffs.items():
+                db.execute(
+                    "DELETE FROM metric_rollup WHERE resolution=? AND ts<?",
+                    (resolution, float(cutoff)),
+                )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    return len(rows)
+
+
+def list_metric_rollups(
+    *, resolution: int, start: float, end: float
+) -> list[MetricRollupRow]:
+    with get_db() as db:
+        rows = db.execute(
+            """
+            SELECT resolution, ts, data
+            FROM metric_rollup
+            WHERE resolution=? AND ts>=? AND ts<=?
+            ORDER BY ts
+            """,
+            (int(resolution), float(start), float(end)),
+        ).fetchall()
+
+    return [
+        {
+            "resolution": row["resolution"],
+            "ts": row["ts"],
+            "data": json.loads(row["data"]),
+        }
+        for row in rows
+    ]
@@ -0,0 +1,78 @@
+import asyncio
+import json
+from typing import Any
+from typing import AsyncIterator
+
+EVENT_TOPICS = (
+    "host-stats",
+    "zlm-statistic",
+    "work-threads-load",
+    "threads-load",
+    "stream-list",
+)
+
+
+def _encode(topic: str, data: Any) -> bytes:
+    payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return f"event: {topic}\ndata: {payload}\n\n".encode()
+
+
+class EventHub:
+    """
+    按主题向 SSE 订阅者扇出消息：每条消息只序列化一次，
+    每个订阅者一个有界队列，消费过慢时丢弃最旧的消息
+    """
+
+    def __init__(self, *, queue_size: int = 32) -> None:
+        self.queue_size = queue_size
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+        # 每个主题最近一条消息，新订阅者连上后立即收到
+        self._last: dict[str, bytes] = {}
+
+    def subscriber_count(self, topic: str | None = None) -> int:
+        if topic is not None:
+            return len(self._subscribers.get(topic, ()))
+        return len({q for qs in self._subscribers.values() for q in qs})
+
+    def has_message(self, topic: str) -> bool:
+        return topic in self._last
+
+    def publish(self, topic: str, data: Any) -> None:
+        message = _encode(topic, data)
+        self._last[topic] = message
+        for queue in self._subscribers.get(topic, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    def subscribe(self, topics: list[str]) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        for topic in topics:
+            self._subscribers.setdefault(topic, set()).add(queue)
+            message = self._last.get(topic)
+            if message is not None and not queue.full():
+                queue.put_nowait(message)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        for topic in list(self._subscribers):
+            self._subscribers[topic].discard(queue)
+            if not self._subscribers[topic]:
+                del self._subscribers[topic]
+
+    async def stream(
+        self, topics: list[str], *, keepalive: float = 15.0
+    ) -> AsyncIterator[bytes]:
+        """
+        SSE 响应体：客户端断开时由框架取消，随之退订
+        """
+        queue = self.subscribe(topics)
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+        finally:
+            self.unsubscribe(queue)
@@ -0,0 +1,270 @@
+import asyncio
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+from typing import AsyncIterator
+
+
+def _concat_line(path: Path) -> str:
+    # concat 列表中的路径用单引号包裹，内部的单引号需转义
+    return "file '" + str(path).replace("'", "'\\''") + "'"
+
+
+def build_concat_list(
+    files: list[tuple[Path, float, float]], *, start_ts: float, end_ts: float
+) -> tuple[str, float]:
+    """
+    files 为按时间排序的 (路径, 起始时间戳, 时长)，首尾文件用 inpoint/outpoint 裁剪。
+    返回 concat 列表内容和预计输出时长
+    """
+    lines: list[str] = []
+    total = 0.0
+    for path, file_start, duration in files:
+        inpoint = max(0.0, start_ts - file_start)
+        outpoint = min(duration, end_ts - file_start)
+        if outpoint <= inpoint:
+            continue
+        lines.append(_concat_line(path))
+        if inpoint > 0:
+            lines.append(f"inpoint {inpoint:.3f}")
+        if outpoint < duration:
+            lines.append(f"outpoint {outpoint:.3f}")
+        total += outpoint - inpoint
+    return "\n".join(lines) + "\n", total
+
+
+class ExportJob:
+    __slots__ = (
+        "id",
+        "app",
+        "stream",
+        "start",
+        "end",
+        "status",
+        "duration",
+        "out_time",
+        "error",
+        "path",
+        "created_at",
+        "finished_at",
+        "process",
+        "done",
+    )
+
+    def __init__(self, *, app: str, stream: str, start: int, end: int, path: Path):
+        self.id = uuid.uuid4().hex[:12]
+        self.app = app
+        self.stream = stream
+        self.start = start
+        self.end = end
+        # pending / running / done / failed / canceled
+        self.status = "pending"
+        self.duration = 0.0
+        self.out_time = 0.0
+        self.error: str | None = None
+        self.path = path
+        self.created_at = time.time()
+        self.finished_at: float | None = None
+        self.process: asyncio.subprocess.Process | None = None
+        self.done = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "canceled")
+
+    def to_dict(self) -> dict[str, Any]:
+        progress = 0.0
+        if self.status == "done":
+            progress = 1.0
+        elif self.duration > 0:
+            progress = min(self.out_time / self.duration, 0.99)
+        try:
+            size = self.path.stat().st_size
+        except OSError:
+            size = 0
+        return {
+            "job_id": self.id,
+            "app": self.app,
+            "stream": self.stream,
+            "start": self.start,
+            "end": self.end,
+            "status": self.status,
+            "progress": round(progress, 4),
+            "duration": round(self.duration, 3),
+            "size": size,
+            "error": self.error,
+            "created_at": datetime.fromtimestamp(self.created_at).isoformat(
+                timespec="seconds"
+            ),
+            "finished_at": (
+                datetime.fromtimestamp(self.finished_at).isoformat(timespec="seconds")
+                if self.finished_at
+                else None
+            ),
+        }
+
+
+class ExportManager:
+    """
+    录像导出任务：ffmpeg concat + 流复制（-c copy）拼接裁剪，不转码；
+    输出为分片 MP4，写入过程中即可边下载边播放
+    """
+
+    def __init__(
+        self, directory: Path, *, concurrency: int = 2, ttl: float = 86400
+    ) -> None:
+        self.directory = directory
+        self.ttl = ttl
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.jobs: dict[str, ExportJob] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def _purge(self) -> None:
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished and job.finished_at and now - job.finished_at > self.ttl:
+                job.path.unlink(missing_ok=True)
+                del self.jobs[job_id]
+
+    def submit(
+        self,
+        *,
+        app: str,
+        stream: str,
+        start: int,
+        end: int,
+        files: list[tuple[Path, float, float]],
+    ) -> ExportJob | None:
+        """
+        创建导出任务；时间范围内没有可导出的片段时返回 None
+        """
+        self._purge()
+        concat, duration = build_concat_list(
+            files, start_ts=start / 1000, end_ts=end / 1000
+        )
+        if duration <= 0:
+            return None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        job = ExportJob(
+            app=app,
+            stream=stream,
+            start=start,
+            end=end,
+            path=self.directory / f"{uuid.uuid4().hex}.mp4",
+        )
+        job.duration = duration
+        self.jobs[job.id] = job
+        task = asyncio.create_task(self._run(job, concat))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job: ExportJob, concat: str) -> None:
+        list_path = job.path.with_suffix(".txt")
+        try:
+            async with self._semaphore:
+                if job.status == "canceled":
+                    return
+                list_path.write_text(concat, encoding="utf-8")
+                job.status = "running"
+                job.process = await asyncio.create_subprocess_exec(
+                    "ffmpeg",
+                    "-hide_banner",
+                    "-nostdin",
+                    "-loglevel",
+                    "error",
+                    "-f",
+                    "concat",
+                    "-safe",
+                    "0",
+                    "-i",
+                    str(list_path),
+                    "-map",
+                    "0",
+                    "-c",
+                    "copy",
+                    "-avoid_negative_ts",
+                    "make_zero",
+                    "-movflags",
+                    "+frag_keyframe+empty_moov+default_base_moof",
+                    "-progress",
+                    "pipe:1",
+                    "-y",
+                    str(job.path),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                stderr_task = asyncio.create_task(job.process.stderr.read())
+                async for line in job.process.stdout:
+                    key, _, value = line.decode(errors="ignore").strip().partition("=")
+                    if key == "out_time_us" and value.isdigit():
+                        job.out_time = int(value) / 1_000_000
+                returncode = await job.process.wait()
+                stderr = (await stderr_task).decode(errors="ignore").strip()
+                if job.status == "canceled":
+                    return
+                if returncode != 0:
+                    job.status = "failed"
+                    job.error = stderr[-500:] or f"ffmpeg 退出码 {returncode}"
+                    return
+                job.status = "done"
+        except FileNotFoundError:
+            job.status = "failed"
+            job.error = "未找到 ffmpeg"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            list_path.unlink(missing_ok=True)
+            job.process = None
+            job.finished_at = time.time()
+            if job.status == "canceled":
+                job.path.unlink(missing_ok=True)
+            job.done.set()
+
+    def cancel(self, job_id: str) -> ExportJob | None:
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+        job.status = "canceled"
+        if job.process is not None and job.process.returncode is None:
+            job.process.terminate()
+        return job
+
+    def shutdown(self) -> None:
+        for job_id, job in list(self.jobs.items()):
+            if not job.finished:
+                self.cancel(job_id)
+        for task in list(self._tasks):
+            task.cancel()
+
+    async def follow(
+        self, job: ExportJob, *, chunk_size: int = 1 << 20
+    ) -> AsyncIterator[bytes]:
+        """
+        边生成边读取输出文件，任务结束且读完后停止；读取放在线程中，不阻塞事件循环
+        """
+        while not job.path.exists():
+            if job.finished:
+                return
+            await asyncio.sleep(0.2)
+        with open(job.path, "rb") as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, chunk_size)
+                if chunk:
+                    yield chunk
+                    continue
+                if job.status in ("failed", "canceled"):
+                    return
+                if job.finished:
+                    # 结束后再读一次，取走最后写入的数据
+                    chunk = await asyncio.to_thread(f.read)
+                    if chunk:
+                        yield chunk
+                    return
+                try:
+                    await asyncio.wait_for(job.done.wait(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    pass
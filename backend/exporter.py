@@ -0,0 +1,104 @@
+"""
+Prometheus 文本格式（0.0.4）输出，不依赖 prometheus_client。
+指标值由调用方从已缓存的数据组装，抓取本身不触发对 ZLM 的请求
+"""
+
+import math
+
+from .stats import Histogram
+
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _labels(labels: dict[str, object] | None) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return "{" + inner + "}"
+
+
+class MetricsWriter:
+    """
+    按指标族收集样本，同一指标族的样本在输出中连续排列（可按流交替写入不同指标）
+    """
+
+    def __init__(self, prefix: str = "") -> None:
+        self.prefix = prefix
+        self._families: dict[str, tuple[str, str, list[str]]] = {}
+
+    def _family(self, name: str, kind: str, help: str) -> list[str]:
+        name = self.prefix + name
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = (kind, help, [])
+        return family[2]
+
+    def _sample(
+        self,
+        name: str,
+        kind: str,
+        help: str,
+        value: float | None,
+        labels: dict[str, object] | None,
+    ) -> None:
+        lines = self._family(name, kind, help)
+        # 未知的值不输出样本，只保留 HELP/TYPE
+        if value is None:
+            return
+        lines.append(f"{self.prefix}{name}{_labels(labels)} {_format_value(value)}")
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        value: float | None,
+        labels: dict[str, object] | None = None,
+    ) -> None:
+        self._sample(name, "gauge", help, value, labels)
+
+    def counter(
+        self,
+        name: str,
+        help: str,
+        value: float | None,
+        labels: dict[str, object] | None = None,
+    ) -> None:
+        self._sample(name, "counter", help, value, labels)
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        hist: Histogram,
+        labels: dict[str, object] | None = None,
+    ) -> None:
+        lines = self._family(name, "histogram", help)
+        full = self.prefix + name
+        labels = dict(labels or {})
+        for bound, n in hist.cumulative():
+            le = "+Inf" if math.isinf(bound) else repr(float(bound))
+            lines.append(f"{full}_bucket{_labels({**labels, 'le': le})} {n}")
+        lines.append(f"{full}_sum{_labels(labels)} {_format_value(hist.sum)}")
+        lines.append(f"{full}_count{_labels(labels)} {hist.count}")
+
+    def render(self) -> str:
+        out: list[str] = []
+        for name, (kind, help, lines) in self._families.items():
+            out.append(f"# HELP {name} {help}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
@@ -1,13 +1,18 @@
 import os
 import re
+import csv
+import io
+import json
 import shutil
 import asyncio
+import random
 import time
 import mk_loader
+from collections import deque
+from urllib.parse import quote
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
-from zoneinfo import ZoneInfo
 
 import httpx
 import docker
@@ -17,20 +22,55 @@ from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 from fastapi import FastAPI, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from .db import close_db as db_close
+from .db import count_pull_proxies_by_node as db_count_pull_proxies_by_node
 from .db import delete_pull_proxy as db_delete_pull_proxy
 from .db import delete_record_policy as db_delete_record_policy
+from .db import delete_record_segments as db_delete_record_segments
+from .db import get_pull_proxy as db_get_pull_proxy
 from .db import get_record_policy as db_get_record_policy
 from .db import init_db as db_init
+from .db import iter_pull_proxies as db_iter_pull_proxies
+from .db import list_metric_rollups as db_list_metric_rollups
 from .db import list_pull_proxies as db_list_pull_proxies
+from .db import list_record_days as db_list_record_days
 from .db import list_record_policies as db_list_record_policies
+from .db import list_record_ranges as db_list_record_ranges
+from .db import list_record_segments as db_list_record_segments
+from .db import list_record_segments_between as db_list_record_segments_between
+from .db import query_pull_proxies as db_query_pull_proxies
+from .db import query_timings as db_query_timings
+from .db import run_db
+from .db import update_pull_proxy_nodes as db_update_pull_proxy_nodes
+from .db import upsert_metric_rollups as db_upsert_metric_rollups
+from .db import upsert_record_policies as db_upsert_record_policies
 from .db import upsert_record_policy as db_upsert_record_policy
+from .db import upsert_record_segments as db_upsert_record_segments
+from .db import upsert_pull_proxies as db_upsert_pull_proxies
 from .db import upsert_pull_proxy as db_upsert_pull_proxy
-from .scheduler import cleanup_old_videos
-from .utils import get_video_shanghai_time, get_zlm_secret
+from .cluster import NodePool, ZlmNode, parse_nodes
+from .events import EVENT_TOPICS, EventHub
+from .export import ExportManager
+from .exporter import MetricsWriter
+from .media import MediaRegistry, StreamListChanges, media_key
+from .metrics import ROLLUP_RESOLUTIONS, ROLLUP_RETENTION, MetricsStore
+from .mp4 import Mp4Error
+from .mp4 import load_index as load_mp4_index
+from . import scheduler as record_scheduler
+from .scheduler import cleanup_old_videos, evict_for_disk_pressure
+from .scheduler import reconcile_record_index
+from .snapshot import SnapshotCache
+from .thumbnails import ThumbnailGenerator, load_thumbnail_indexes, thumb_dir
+from .utils import TZ_SHANGHAI, get_zlm_secret, merge_time_ranges, run_bounded
+from .utils import summarize_existing_recordings
+from .zlm_client import ZlmClient
 
 # =========================================================
 # zlmediakit 地址
 ZLM_SERVER = "http://127.0.0.1:" + mk_loader.get_config('http.port')
+# zlmediakit RTSP 端口（截图时从本机拉流）
+ZLM_RTSP_PORT = mk_loader.get_config('rtsp.port')
 # zlmediakit 密钥
 ZLM_SECRET = mk_loader.get_config('api.secret')
 # zlmediakit 录像
@@ -38,95 +78,418 @@ RECORD_ROOT = Path(mk_loader.get_config('protocol.mp4_save_path'))
 # 容器
 ZLM_CONTAINER_NAME = os.getenv("ZLM_CONTAINER_NAME", "zlm-server")
 STREAMUI_CONTAINER_NAME = os.getenv("STREAMUI_CONTAINER_NAME", "streamui-web-server")
+# hook 回调地址前缀，启动时写入 ZLM 配置；置空则不自动配置 hook
+ZLM_HOOK_BASE_URL = os.getenv("ZLM_HOOK_BASE_URL", "http://127.0.0.1:10801")
+# getMediaList 快照缓存时间（秒）
+MEDIA_SNAPSHOT_TTL = float(os.getenv("MEDIA_SNAPSHOT_TTL", "2"))
+# 启动时恢复拉流代理的并发数与单个代理的重试次数
+PROXY_RESTORE_CONCURRENCY = int(os.getenv("PROXY_RESTORE_CONCURRENCY", "8"))
+PROXY_RESTORE_RETRIES = int(os.getenv("PROXY_RESTORE_RETRIES", "3"))
+# 录像盘使用率高水位/低水位（百分比）：超过高水位时淘汰最旧片段直到低于低水位
+DISK_HIGH_WATERMARK = float(os.getenv("DISK_HIGH_WATERMARK", "90"))
+DISK_LOW_WATERMARK = float(os.getenv("DISK_LOW_WATERMARK", "80"))
+# 性能指标采样间隔（秒）及内存中保留的原始采样数
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "1"))
+METRICS_RAW_CAPACITY = int(os.getenv("METRICS_RAW_CAPACITY", "3600"))
+# HLS 回放：目标分片时长（秒）及单个列表允许的最大时间跨度（小时）
+HLS_SEGMENT_SECONDS = float(os.getenv("HLS_SEGMENT_SECONDS", "4"))
+HLS_MAX_RANGE_HOURS = float(os.getenv("HLS_MAX_RANGE_HOURS", "24"))
+# 文件名无法解析时间的录像同时运行的 ffprobe 进程数
+PROBE_CONCURRENCY = int(os.getenv("PROBE_CONCURRENCY", "4"))
+# 录像导出：输出目录、同时运行的 ffmpeg 任务数、单次导出最大时间跨度（小时）及导出文件保留时长（秒）
+EXPORT_DIR = Path(os.getenv("EXPORT_DIR", str(RECORD_ROOT.parent / "export")))
+EXPORT_CONCURRENCY = int(os.getenv("EXPORT_CONCURRENCY", "2"))
+EXPORT_MAX_RANGE_HOURS = float(os.getenv("EXPORT_MAX_RANGE_HOURS", "6"))
+EXPORT_TTL = float(os.getenv("EXPORT_TTL", "86400"))
+# 录像缩略图：抽帧间隔（秒，0 为关闭）、单张尺寸、雪碧图列数及同时运行的 ffmpeg 任务数
+THUMB_INTERVAL = float(os.getenv("THUMB_INTERVAL", "10"))
+THUMB_WIDTH = int(os.getenv("THUMB_WIDTH", "160"))
+THUMB_HEIGHT = int(os.getenv("THUMB_HEIGHT", "90"))
+THUMB_COLUMNS = int(os.getenv("THUMB_COLUMNS", "10"))
+THUMB_CONCURRENCY = int(os.getenv("THUMB_CONCURRENCY", "1"))
+# 流截图：缓存时间（秒）、缓存的流数上限、同时进行的截图数、单次截图超时（秒），
+# 以及最近多少秒内被查看过的流由后台在过期前刷新
+SNAPSHOT_TTL = float(os.getenv("SNAPSHOT_TTL", "10"))
+SNAPSHOT_CAPACITY = int(os.getenv("SNAPSHOT_CAPACITY", "256"))
+SNAPSHOT_CONCURRENCY = int(os.getenv("SNAPSHOT_CONCURRENCY", "4"))
+SNAPSHOT_TIMEOUT = float(os.getenv("SNAPSHOT_TIMEOUT", "10"))
+SNAPSHOT_VIEW_WINDOW = float(os.getenv("SNAPSHOT_VIEW_WINDOW", "30"))
+# ZLM 集群节点：JSON 数组，每项含 id、url、secret，可选 rtsp_port、max_streams、
+# max_bandwidth_mbps；为空时只使用本机 ZLM。第一个节点为默认节点
+ZLM_NODES = os.getenv("ZLM_NODES", "")
+# 集群节点心跳及负载刷新间隔（秒）、心跳超时（秒）
+CLUSTER_LOAD_INTERVAL = float(os.getenv("CLUSTER_LOAD_INTERVAL", "2"))
+NODE_HEARTBEAT_TIMEOUT = float(os.getenv("NODE_HEARTBEAT_TIMEOUT", "2"))
+# 连续心跳失败多少次判定节点宕机、宕机后连续成功多少次判定恢复
+NODE_FAIL_THRESHOLD = int(os.getenv("NODE_FAIL_THRESHOLD", "3"))
+NODE_RECOVER_THRESHOLD = int(os.getenv("NODE_RECOVER_THRESHOLD", "3"))
+# 网络线程负载（%）达到该值视为过载：不再接收新代理，并逐步迁出
+NODE_OVERLOAD_LOAD = float(os.getenv("NODE_OVERLOAD_LOAD", "90"))
+# 故障转移每批迁移的代理数；节点恢复或过载时每个心跳周期最多迁移的代理数
+FAILOVER_BATCH_SIZE = int(os.getenv("FAILOVER_BATCH_SIZE", "50"))
+REBALANCE_BATCH_SIZE = int(os.getenv("REBALANCE_BATCH_SIZE", "10"))
+# ZLM HTTP 客户端：连接池大小（0 为按节点数与各项并发配置自动计算）、超时上限与下限（秒）。
+# 接口样本足够时超时取近期 p99 的 ZLM_TIMEOUT_FACTOR 倍，限制在上下限之间
+ZLM_MAX_CONNECTIONS = int(os.getenv("ZLM_MAX_CONNECTIONS", "0"))
+ZLM_TIMEOUT = float(os.getenv("ZLM_TIMEOUT", "5"))
+ZLM_MIN_TIMEOUT = float(os.getenv("ZLM_MIN_TIMEOUT", "0.5"))
+ZLM_TIMEOUT_FACTOR = float(os.getenv("ZLM_TIMEOUT_FACTOR", "3"))
+# 熔断：节点连续失败多少次后暂停请求、多少秒后放行试探请求；
+# 熔断或失败时只读接口可返回的旧数据最长保留时间（秒）
+ZLM_BREAKER_FAILURES = int(os.getenv("ZLM_BREAKER_FAILURES", "5"))
+ZLM_BREAKER_RESET = float(os.getenv("ZLM_BREAKER_RESET", "10"))
+ZLM_STALE_TTL = float(os.getenv("ZLM_STALE_TTL", "60"))
+# 批量控制：单次请求最多的条目数及同时进行的 ZLM 调用数
+BATCH_CONTROL_MAX_ITEMS = int(os.getenv("BATCH_CONTROL_MAX_ITEMS", "5000"))
+BATCH_CONTROL_CONCURRENCY = int(os.getenv("BATCH_CONTROL_CONCURRENCY", "32"))
+# /metrics：拉流代理重拉次数与录像盘使用量的缓存刷新间隔（秒），抓取时只读缓存
+EXPORTER_SCRAPE_INTERVAL = float(os.getenv("EXPORTER_SCRAPE_INTERVAL", "15"))
 # =========================================================
 
 _last_record_start_attempt: dict[tuple[str, str, str], float] = {}
+_last_proxy_restore_attempt: dict[tuple[str, str, str], float] = {}
+
+node_pool = NodePool(
+    parse_nodes(
+        ZLM_NODES,
+        default=ZlmNode(
+            id="local", url=ZLM_SERVER, secret=ZLM_SECRET, rtsp_port=ZLM_RTSP_PORT
+        ),
+    )
+)
 
 
-async def ensure_recording_from_policies() -> None:
-    try:
-        policies = db_list_record_policies(enabled_only=True) or []
-    except Exception:
+async def _zlm_get(
+    node: ZlmNode,
+    api: str,
+    params: dict | None = None,
+    *,
+    timeout: float | None = None,
+    stale: bool = False,
+    probe: bool = False,
+) -> httpx.Response:
+    """
+    timeout 不传时使用按接口耗时自适应的超时；stale 为 True 时只读接口在节点故障或熔断时
+    返回最近一次成功的结果；probe 为 True 的心跳请求不受熔断限制
+    """
+    query = {"secret": node.secret}
+    query.update(params or {})
+    return await zlm_client.get(
+        node.id,
+        node.api(api),
+        api,
+        query,
+        timeout=timeout,
+        stale=stale,
+        probe=probe,
+    )
+
+
+async def _fetch_node_media_list(node: ZlmNode) -> list | None:
+    response = await _zlm_get(node, "getMediaList")
+    raw = response.json()
+    if raw.get("code") != 0:
+        return None
+    media_list = raw.get("data", []) or []
+    for media in media_list:
+        if isinstance(media, dict):
+            media["node_id"] = node.id
+    return media_list
+
+
+async def _fetch_media_list() -> list | None:
+    """
+    合并各节点的在线流；全部节点都失败时返回 None，部分失败时该节点的流视为离线
+    """
+    if len(node_pool) == 1:
+        return await _fetch_node_media_list(node_pool.default)
+    results = await asyncio.gather(
+        *(_fetch_node_media_list(node) for node in node_pool), return_exceptions=True
+    )
+    lists = [r for r in results if isinstance(r, list)]
+    if not lists:
+        return None
+    return [media for media_list in lists for media in media_list]
+
+
+def _stream_node(key: tuple[str, str, str]) -> ZlmNode:
+    """
+    在线流所在的节点，不在线时为默认节点
+    """
+    info = media_registry.get(key)
+    return (node_pool.get(info.get("node_id")) if info else None) or node_pool.default
+
+
+async def _owner_node(key: tuple[str, str, str]) -> ZlmNode:
+    """
+    流的归属节点：在线时为所在节点，否则为拉流代理分配的节点，都没有时为默认节点
+    """
+    info = media_registry.get(key)
+    node = node_pool.get(info.get("node_id")) if info else None
+    if node is None and len(node_pool) > 1:
+        vhost, app, stream = key
+        row = await run_db(db_get_pull_proxy, vhost=vhost, app=app, stream=stream)
+        node = node_pool.get(row.get("node_id")) if row else None
+    return node or node_pool.default
+
+
+def _schedule_stream_online(key: tuple[str, str, str]) -> None:
+    asyncio.get_running_loop().create_task(_on_stream_online(key))
+
+
+_stream_list_publish: asyncio.TimerHandle | None = None
+
+
+def _publish_stream_list() -> None:
+    global _stream_list_publish
+    _stream_list_publish = None
+    event_hub.publish(
+        "stream-list", {"code": 0, "data": list(media_registry.streams().values())}
+    )
+
+
+def _schedule_stream_list_publish() -> None:
+    # 多个 hook 连续到达时合并为一次推送
+    global _stream_list_publish
+    if _stream_list_publish is None:
+        _stream_list_publish = asyncio.get_running_loop().call_later(
+            0.3, _publish_stream_list
+        )
+
+
+media_registry = MediaRegistry(
+    _fetch_media_list,
+    ttl=MEDIA_SNAPSHOT_TTL,
+    on_online=_schedule_stream_online,
+    on_change=_schedule_stream_list_publish,
+)
+stream_list_changes = StreamListChanges()
+_stream_list_revision = -1
+metrics_store = MetricsStore(capacity=METRICS_RAW_CAPACITY)
+event_hub = EventHub()
+export_manager = ExportManager(
+    EXPORT_DIR, concurrency=EXPORT_CONCURRENCY, ttl=EXPORT_TTL
+)
+
+
+async def _fetch_snapshot(key: tuple[str, str, str]) -> bytes | None:
+    vhost, app, stream = key
+    node = _stream_node(key)
+    # 由流所在节点从自身拉流截图
+    url = f"rtsp://127.0.0.1:{node.rtsp_port}/{app}/{stream}"
+    if vhost != "__defaultVhost__":
+        url += f"?vhost={vhost}"
+    response = await _zlm_get(
+        node,
+        "getSnap",
+        {
+            "url": url,
+            "timeout_sec": int(SNAPSHOT_TIMEOUT),
+            "expire_sec": int(SNAPSHOT_TTL),
+        },
+        timeout=SNAPSHOT_TIMEOUT + 5,
+    )
+    if response.status_code != 200:
+        return None
+    if not response.headers.get("content-type", "").startswith("image/"):
+        return None
+    return response.content
+
+
+snapshot_cache = SnapshotCache(
+    _fetch_snapshot,
+    capacity=SNAPSHOT_CAPACITY,
+    ttl=SNAPSHOT_TTL,
+    concurrency=SNAPSHOT_CONCURRENCY,
+)
+thumbnail_generator = ThumbnailGenerator(
+    interval=THUMB_INTERVAL,
+    width=THUMB_WIDTH,
+    height=THUMB_HEIGHT,
+    columns=THUMB_COLUMNS,
+    concurrency=THUMB_CONCURRENCY,
+)
+
+
+async def _start_record_if_needed(
+    key: tuple[str, str, str], *, min_interval: float = 60
+) -> None:
+    if not media_registry.is_online(key) or media_registry.is_recording(key):
         return
-    if not policies:
+
+    now = time.time()
+    last = _last_record_start_attempt.get(key, 0.0)
+    if now - last < min_interval:
         return
+    _last_record_start_attempt[key] = now
 
+    vhost, app, stream = key
     try:
-        response = await client.get(
-            f"{ZLM_SERVER}/index/api/getMediaList", params={"secret": ZLM_SECRET}
+        response = await _zlm_get(
+            _stream_node(key),
+            "startRecord",
+            {
+                "vhost": vhost,
+                "app": app,
+                "stream": stream,
+                "type": "1",
+                "max_second": "300",
+            },
         )
-        raw = response.json()
-        if raw.get("code") != 0:
-            return
+        if response.json().get("code") == 0:
+            media_registry.set_recording(key, True)
     except Exception:
         return
 
-    media_map: dict[tuple[str, str, str], dict] = {}
-    for media in raw.get("data", []) or []:
-        if not isinstance(media, dict):
-            continue
-        vhost = str(media.get("vhost") or "__defaultVhost__")
-        app = str(media.get("app") or "")
-        stream = str(media.get("stream") or "")
-        if not (app and stream):
-            continue
-        key = (vhost, app, stream)
-        agg = media_map.get(key) or {"isRecordingMP4": False}
-        if media.get("isRecordingMP4"):
-            agg["isRecordingMP4"] = True
-        media_map[key] = agg
 
-    now = time.time()
+async def ensure_recording_from_policies() -> None:
+    try:
+        policies = await run_db(db_list_record_policies, enabled_only=True) or []
+    except Exception:
+        return
+
+    # 兜底全量校准：hook 丢失或未配置时，在线流表最多滞后一个周期
+    if not await media_registry.refresh():
+        return
+    if not policies:
+        return
+
     for policy in policies:
         vhost = str(policy.get("vhost") or "__defaultVhost__")
         app = str(policy.get("app") or "")
         stream = str(policy.get("stream") or "")
         if not (app and stream):
             continue
-        key = (vhost, app, stream)
-        state = media_map.get(key)
-        if not state:
-            continue
-        if state.get("isRecordingMP4"):
-            continue
+        await _start_record_if_needed((vhost, app, stream))
 
-        last = _last_record_start_attempt.get(key, 0.0)
-        if now - last < 60:
-            continue
-        _last_record_start_attempt[key] = now
 
-        try:
-            await client.get(
-                f"{ZLM_SERVER}/index/api/startRecord",
-                params={
-                    "secret": ZLM_SECRET,
-                    "vhost": vhost,
-                    "app": app,
-                    "stream": stream,
-                    "type": "1",
-                    "max_second": "300",
-                },
-            )
-        except Exception:
-            continue
+async def _on_stream_online(key: tuple[str, str, str]) -> None:
+    """
+    流重新上线时立即按录像策略续录，无需等待下一次轮询
+    """
+    vhost, app, stream = key
+    try:
+        policy = await run_db(db_get_record_policy, vhost=vhost, app=app, stream=stream)
+    except Exception:
+        return
+    if not policy or int(policy.get("enabled", 0) or 0) != 1:
+        return
+    # 同一个流的多个协议会连续注册，短间隔内只尝试一次
+    await _start_record_if_needed(key, min_interval=3)
+
+
+async def _configure_node_hooks(node: ZlmNode, base: str) -> None:
+    # 回调地址带上节点 id，用于区分事件来自哪个节点
+    suffix = f"?node_id={quote(node.id)}"
+    query_params = {
+        "hook.enable": "1",
+        "hook.on_stream_changed": f"{base}/api/hook/on_stream_changed{suffix}",
+        "hook.on_stream_none_reader": f"{base}/api/hook/on_stream_none_reader{suffix}",
+        "hook.on_stream_not_found": f"{base}/api/hook/on_stream_not_found{suffix}",
+        "hook.on_record_mp4": f"{base}/api/hook/on_record_mp4{suffix}",
+    }
+    try:
+        await _zlm_get(node, "setServerConfig", query_params)
+    except Exception as e:
+        print(f"[Hook] ⚠️ 配置 ZLM hook 失败 {node.id}: {e}")
+
+
+async def configure_zlm_hooks() -> None:
+    """
+    将本服务的 hook 接收地址写入各节点的 ZLM 配置
+    """
+    if not ZLM_HOOK_BASE_URL:
+        return
+    base = ZLM_HOOK_BASE_URL.rstrip("/")
+    await asyncio.gather(*(_configure_node_hooks(node, base) for node in node_pool))
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     scheduler = AsyncIOScheduler()
 
-    db_init()
+    await run_db(db_init)
+    await configure_zlm_hooks()
+    await media_registry.refresh()
     asyncio.create_task(sync_pull_proxies_from_db())
 
-    # 添加任务：每小时整点执行
+    # 添加任务：每小时整点执行，在工作线程中运行，不阻塞事件循环
     scheduler.add_job(
-        cleanup_old_videos,
-        kwargs={"path": RECORD_ROOT},
+        asyncio.to_thread,
+        args=[cleanup_old_videos, RECORD_ROOT],
         trigger=CronTrigger(minute=0),
         id="cleanup_videos",
         name="清理旧视频片段",
         replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+    )
+    # 磁盘水位检查：每分钟一次，只读取索引中各流最早的片段
+    scheduler.add_job(
+        asyncio.to_thread,
+        args=[evict_for_disk_pressure, RECORD_ROOT],
+        kwargs={
+            "high_watermark": DISK_HIGH_WATERMARK,
+            "low_watermark": DISK_LOW_WATERMARK,
+        },
+        trigger=IntervalTrigger(minutes=1),
+        id="evict_for_disk_pressure",
+        name="磁盘水位淘汰录像",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+    )
+    # 录像片段索引校准：启动时立即执行一次，之后每 10 分钟一次
+    scheduler.add_job(
+        reconcile_record_index,
+        kwargs={"path": RECORD_ROOT, "probe_concurrency": PROBE_CONCURRENCY},
+        trigger=IntervalTrigger(minutes=10),
+        next_run_time=datetime.now(),
+        id="reconcile_record_index",
+        name="校准录像片段索引",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        collect_metrics,
+        trigger=IntervalTrigger(seconds=METRICS_INTERVAL),
+        id="collect_metrics",
+        name="采样性能指标",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        refresh_snapshots,
+        trigger=IntervalTrigger(seconds=max(1.0, SNAPSHOT_TTL / 2)),
+        id="refresh_snapshots",
+        name="刷新正在查看的流截图",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        refresh_exporter_cache,
+        trigger=IntervalTrigger(seconds=EXPORTER_SCRAPE_INTERVAL),
+        next_run_time=datetime.now(),
+        id="refresh_exporter_cache",
+        name="刷新 /metrics 缓存",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
     )
+    if len(node_pool) > 1:
+        scheduler.add_job(
+            refresh_node_loads,
+            trigger=IntervalTrigger(seconds=CLUSTER_LOAD_INTERVAL),
+            next_run_time=datetime.now(),
+            id="refresh_node_loads",
+            name="集群节点心跳与故障转移",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
     scheduler.add_job(
         ensure_recording_from_policies,
         trigger=IntervalTrigger(seconds=30),
@@ -144,7 +507,10 @@ async def lifespan(app: FastAPI):
     yield
 
     scheduler.shutdown()
-    await client.aclose()
+    export_manager.shutdown()
+    thumbnail_generator.shutdown()
+    await zlm_client.client.aclose()
+    db_close()
     print("[Scheduler] 🛑 定时任务已取消")
 
 
@@ -180,13 +546,35 @@ app.add_middleware(
 )
 
 
+# 每个节点：代理恢复/迁移并发 + 截图并发 + 心跳、指标与接口请求的余量
+_zlm_pool_size = ZLM_MAX_CONNECTIONS or len(node_pool) * (
+    PROXY_RESTORE_CONCURRENCY + SNAPSHOT_CONCURRENCY + 20
+)
 client = httpx.AsyncClient(
-    timeout=5.0,
+    timeout=ZLM_TIMEOUT,
     limits=httpx.Limits(
-        max_connections=10,
-        max_keepalive_connections=20,
+        max_connections=_zlm_pool_size,
+        max_keepalive_connections=_zlm_pool_size,
     ),
 )
+zlm_client = ZlmClient(
+    client,
+    max_connections=_zlm_pool_size,
+    timeout=ZLM_TIMEOUT,
+    min_timeout=ZLM_MIN_TIMEOUT,
+    timeout_factor=ZLM_TIMEOUT_FACTOR,
+    breaker_failures=ZLM_BREAKER_FAILURES,
+    breaker_reset=ZLM_BREAKER_RESET,
+    stale_ttl=ZLM_STALE_TTL,
+)
+
+
+@app.exception_handler(httpx.HTTPError)
+async def zlm_error_handler(request: Request, exc: httpx.HTTPError):
+    # ZLM 超时、熔断或连接池已满：快速返回 503，不让请求堆积
+    return JSONResponse(
+        status_code=503, content={"code": -1, "msg": f"ZLM 暂不可用: {exc}"}
+    )
 
 
 def _audio_type_to_zlm_params(audio_type: int | None) -> dict[str, str]:
@@ -205,14 +593,14 @@ def _stream_proxy_key(vhost: str, app: str, stream: str) -> str:
 
 async def _add_stream_proxy_to_zlm(
     *,
+    node: ZlmNode,
     vhost: str,
     app: str,
     stream: str,
     url: str,
     audio_type: int | None,
-) -> None:
+) -> bool:
     query_params = {
-        "secret": ZLM_SECRET,
         "vhost": vhost,
         "app": app,
         "stream": stream,
@@ -220,106 +608,713 @@ async def _add_stream_proxy_to_zlm(
     }
     query_params.update(_audio_type_to_zlm_params(audio_type))
     try:
-        await client.get(f"{ZLM_SERVER}/index/api/addStreamProxy", params=query_params)
+        # addStreamProxy 会等待 ZLM 连上源站后才返回，单独放宽超时
+        response = await _zlm_get(node, "addStreamProxy", query_params, timeout=20)
+        raw = response.json()
     except Exception:
-        return
+        return False
+    if raw.get("code") == 0:
+        return True
+    # 已存在视为成功
+    return "already exists" in str(raw.get("msg", ""))
 
 
-async def _del_stream_proxy_from_zlm(*, vhost: str, app: str, stream: str) -> None:
-    query_params = {"secret": ZLM_SECRET}
-    query_params["key"] = _stream_proxy_key(vhost, app, stream)
+async def _del_stream_proxy_from_zlm(
+    *, node: ZlmNode, vhost: str, app: str, stream: str
+) -> None:
+    query_params = {"key": _stream_proxy_key(vhost, app, stream)}
     try:
-        await client.get(f"{ZLM_SERVER}/index/api/delStreamProxy", params=query_params)
+        await _zlm_get(node, "delStreamProxy", query_params)
     except Exception:
         return
 
 
+async def _place_pull_proxies(rows: list[dict]) -> list[ZlmNode]:
+    """
+    为拉流代理选择节点：已分配且健康的节点保持不变，其余依次放到负载最低的健康节点，
+    分配变化在一个事务内写回数据库（rows 中的 node_id 同步更新）
+    """
+    nodes: list[ZlmNode] = []
+    changed: list[dict] = []
+    for row in rows:
+        node = node_pool.get(row.get("node_id"))
+        if node is None or not node.healthy:
+            node = node_pool.pick() or node or node_pool.default
+            node_pool.assign(node, row.get("node_id"))
+        if row.get("node_id") != node.id:
+            row["node_id"] = node.id
+            changed.append(
+                {
+                    "vhost": row["vhost"],
+                    "app": row["app"],
+                    "stream": row["stream"],
+                    "node_id": node.id,
+                }
+            )
+        nodes.append(node)
+    if changed:
+        await run_db(db_update_pull_proxy_nodes, changed)
+    return nodes
+
+
+async def _list_stream_proxies(*, stale: bool = False) -> list[tuple[ZlmNode, dict]]:
+    """
+    合并各节点的 listStreamProxy，返回 (节点, 代理信息)；请求失败的节点跳过
+    """
+
+    async def _fetch(node: ZlmNode) -> list[tuple[ZlmNode, dict]]:
+        response = await _zlm_get(node, "listStreamProxy", stale=stale)
+        raw = response.json()
+        if raw.get("code") != 0:
+            return []
+        return [(node, item) for item in raw.get("data", []) or [] if item]
+
+    results = await asyncio.gather(
+        *(_fetch(node) for node in node_pool), return_exceptions=True
+    )
+    return [pair for r in results if isinstance(r, list) for pair in r]
+
+
+def _stream_proxy_item_key(item: dict) -> str | None:
+    if item.get("key"):
+        return str(item["key"])
+    src = item.get("src") or {}
+    vhost = src.get("vhost")
+    app = src.get("app")
+    stream = src.get("stream")
+    if vhost and app and stream:
+        return _stream_proxy_key(vhost, app, stream)
+    return None
+
+
+def _record_segment_from_hook(body: dict) -> dict | None:
+    """
+    将 on_record_mp4 回调转换为录像索引行，
+    仅接受位于 RECORD_ROOT/app/stream/YYYY-MM-DD/ 下的片段
+    """
+    file_path = body.get("file_path")
+    if not file_path:
+        return None
+    path = Path(str(file_path))
+    try:
+        parts = path.relative_to(RECORD_ROOT).parts
+    except ValueError:
+        return None
+    if len(parts) != 4 or not re.match(r"^\d{4}-\d{2}-\d{2}$", parts[2]):
+        return None
+
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    try:
+        start_ts = float(body.get("start_time") or 0)
+        duration = float(body.get("time_len") or 0)
+    except (TypeError, ValueError):
+        return None
+    if start_ts <= 0:
+        return None
+
+    return {
+        "app": parts[0],
+        "stream": parts[1],
+        "date": parts[2],
+        "filename": parts[3],
+        "start_ts": start_ts,
+        "duration": duration,
+        "size": int(st.st_size),
+        "mtime": float(st.st_mtime),
+        # time_len 缺失时由索引校准任务从 MP4 头部回填
+        "duration_source": "hook" if duration > 0 else "estimate",
+    }
+
+
+_proxy_restore_state: dict = {
+    "running": False,
+    "total": 0,
+    "skipped": 0,
+    "restored": 0,
+    "pending": 0,
+    "failed": 0,
+    "failed_keys": [],
+    "started_at": None,
+    "finished_at": None,
+}
+
+
+async def _restore_pull_proxy(row: dict) -> bool:
+    state = _proxy_restore_state
+    for attempt in range(PROXY_RESTORE_RETRIES + 1):
+        if attempt:
+            # 指数退避：1s、2s、4s ... 最长 30s，并加少量抖动避免同时重试
+            delay = min(30.0, 2 ** (attempt - 1)) * random.uniform(0.8, 1.2)
+            await asyncio.sleep(delay)
+        ok = await _add_stream_proxy_to_zlm(
+            node=node_pool.get(row.get("node_id")) or node_pool.default,
+            vhost=row["vhost"],
+            app=row["app"],
+            stream=row["stream"],
+            url=row["url"],
+            audio_type=row.get("audio_type"),
+        )
+        if ok:
+            state["restored"] += 1
+            state["pending"] -= 1
+            return True
+
+    state["failed"] += 1
+    state["pending"] -= 1
+    state["failed_keys"].append(
+        _stream_proxy_key(row["vhost"], row["app"], row["stream"])
+    )
+    return False
+
+
+def _validate_pull_proxy(*, app: str, stream: str, url: str) -> str | None:
+    if not re.match(r"^[a-zA-Z0-9._-]+$", app):
+        return "app 只能包含字母、数字、下划线(_)、短横线(-) 或英文句点(.)"
+    if not re.match(r"^[a-zA-Z0-9._-]+$", stream):
+        return "stream 只能包含字母、数字、下划线(_)、短横线(-) 或英文句点(.)"
+
+    # 验证 url 前缀
+    if not any(
+        url.startswith(prefix)
+        for prefix in ["rtsp://", "rtmp://", "http://", "https://"]
+    ):
+        return "源流地址必须以 rtsp://、rtmp://、http:// 或 https:// 开头"
+    return None
+
+
 async def sync_pull_proxies_from_db() -> None:
-    rows = db_list_pull_proxies()
-    if not rows:
+    state = _proxy_restore_state
+    if state["running"]:
         return
 
-    existing_keys: set[str] = set()
+    state.update(
+        running=True,
+        total=0,
+        skipped=0,
+        restored=0,
+        pending=0,
+        failed=0,
+        failed_keys=[],
+        started_at=datetime.now().isoformat(timespec="seconds"),
+        finished_at=None,
+    )
     try:
-        query_params = {"secret": ZLM_SECRET}
-        response = await client.get(
-            f"{ZLM_SERVER}/index/api/listStreamProxy", params=query_params
+        rows = await run_db(db_list_pull_proxies)
+        state["total"] = len(rows)
+        if not rows:
+            return
+
+        # 代理 key -> 实际所在节点
+        existing: dict[str, str] = {}
+        for node, item in await _list_stream_proxies():
+            key = _stream_proxy_item_key(item)
+            if key:
+                existing.setdefault(key, node.id)
+
+        missing: list[dict] = []
+        adopted: list[dict] = []
+        for row in rows:
+            node_id = existing.get(
+                _stream_proxy_key(row["vhost"], row["app"], row["stream"])
+            )
+            if node_id is None:
+                missing.append(row)
+            elif row.get("node_id") != node_id:
+                # 已在某个节点上运行（例如分配前的旧数据），以实际所在节点为准
+                adopted.append({**row, "node_id": node_id})
+        if adopted:
+            await run_db(db_update_pull_proxy_nodes, adopted)
+        node_pool.set_proxy_counts(await run_db(db_count_pull_proxies_by_node))
+        await _place_pull_proxies(missing)
+        state["skipped"] = len(rows) - len(missing)
+        state["pending"] = len(missing)
+
+        await run_bounded(
+            missing, _restore_pull_proxy, concurrency=PROXY_RESTORE_CONCURRENCY
         )
-        raw_data = response.json()
-        if raw_data.get("code") == 0:
-            for item in raw_data.get("data", []) or []:
-                if isinstance(item, dict) and item.get("key"):
-                    existing_keys.add(str(item["key"]))
-                    continue
-                src = (item or {}).get("src") or {}
-                vhost = src.get("vhost")
-                app = src.get("app")
-                stream = src.get("stream")
-                if vhost and app and stream:
-                    existing_keys.add(_stream_proxy_key(vhost, app, stream))
+        print(
+            f"[Proxy] ✅ 拉流代理恢复完成：恢复 {state['restored']}，"
+            f"已存在 {state['skipped']}，失败 {state['failed']}"
+        )
+    finally:
+        state["running"] = False
+        state["finished_at"] = datetime.now().isoformat(timespec="seconds")
+
+
+# =============================================================================
+
+
+async def _fetch_zlm_json(
+    api: str, node: ZlmNode | None = None, **kwargs
+) -> dict | None:
+    try:
+        response = await _zlm_get(node or node_pool.default, api, **kwargs)
+        return response.json()
     except Exception:
-        existing_keys = set()
+        return None
+
+
+def _threads_load(raw: dict | None) -> float | None:
+    if not raw or raw.get("code") != 0:
+        return None
+    loads = [
+        float(item.get("load", 0) or 0)
+        for item in raw.get("data", []) or []
+        if isinstance(item, dict)
+    ]
+    return sum(loads) / len(loads) if loads else 0.0
+
+
+_failover_tasks: dict[str, asyncio.Task] = {}
+# 故障转移出去的代理 -> 原节点，原节点恢复后逐步迁回（仅保存在内存中）
+_failed_over: dict[tuple[str, str, str], str] = {}
+# 故障转移时没有可用节点或添加失败的代理 -> 宕机节点，由心跳周期重试
+_failover_retry: dict[tuple[str, str, str], str] = {}
+_failover_stats: dict = {
+    "total": 0,
+    "moved": 0,
+    "failed": 0,
+    "last": None,
+    "history": deque(maxlen=20),
+}
+
+
+async def refresh_node_loads() -> None:
+    """
+    集群心跳：刷新各节点的线程负载、在线流数与入流带宽，供拉流代理放置使用；
+    节点连续心跳失败时判定宕机并把其上的拉流代理迁到健康节点，
+    恢复后（以及节点过载时）每个周期迁移一小批，逐步回到均衡
+    """
+    loads, _, counts = await asyncio.gather(
+        asyncio.gather(
+            *(
+                _fetch_zlm_json(
+                    "getThreadsLoad",
+                    node,
+                    timeout=NODE_HEARTBEAT_TIMEOUT,
+                    probe=True,
+                )
+                for node in node_pool
+            )
+        ),
+        media_registry.refresh(max_age=CLUSTER_LOAD_INTERVAL),
+        run_db(db_count_pull_proxies_by_node),
+    )
+    streams: dict[str, int] = {}
+    bandwidth: dict[str, float] = {}
+    for info in media_registry.streams().values():
+        node_id = info.get("node_id") or node_pool.default.id
+        streams[node_id] = streams.get(node_id, 0) + 1
+        # 同一个流的各协议共享同一路输入，取最大值作为入流带宽
+        speed = max(
+            (float(s.get("bytesSpeed") or 0) for s in info["schemas"]), default=0.0
+        )
+        bandwidth[node_id] = bandwidth.get(node_id, 0.0) + speed
+    node_pool.set_proxy_counts(counts)
+    for node, raw in zip(node_pool, loads):
+        load = _threads_load(raw)
+        event = node_pool.heartbeat(
+            node.id,
+            ok=load is not None,
+            fail_threshold=NODE_FAIL_THRESHOLD,
+            recover_threshold=NODE_RECOVER_THRESHOLD,
+        )
+        if event == "down" and node.id not in _failover_tasks:
+            print(f"[Cluster] ❌ 节点 {node.id} 心跳失败，开始故障转移")
+            task = asyncio.create_task(failover_node(node))
+            _failover_tasks[node.id] = task
+            task.add_done_callback(lambda _, i=node.id: _failover_tasks.pop(i, None))
+        elif event == "up":
+            print(f"[Cluster] ✅ 节点 {node.id} 已恢复，逐步迁回拉流代理")
+            await _remove_stale_proxies(node)
+        if load is None:
+            continue
+        node_pool.update_load(
+            node.id,
+            threads_load=load,
+            streams=streams.get(node.id, 0),
+            bandwidth=bandwidth.get(node.id, 0.0),
+            overload_load=NODE_OVERLOAD_LOAD,
+        )
+    if not _failover_tasks:
+        await _retry_failover()
+        await _rebalance_step()
+
+
+async def failover_node(node: ZlmNode) -> None:
+    """
+    将宕机节点上的拉流代理分批放到健康节点，记录从最后一次心跳成功到全部迁完的耗时
+    """
+    started = time.monotonic()
+    down_since = node.down_since or started
+    rows, _ = await run_db(db_query_pull_proxies, node_id=node.id)
+    moved = failed = 0
+    for i in range(0, len(rows), FAILOVER_BATCH_SIZE):
+        if node.healthy:
+            # 迁移过程中节点已恢复，剩余代理留在原节点
+            break
+        batch_moved, batch_failed = await _failover_batch(
+            rows[i : i + FAILOVER_BATCH_SIZE], node
+        )
+        moved += batch_moved
+        failed += batch_failed
+    finished = time.monotonic()
+    record = {
+        "node_id": node.id,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "proxies": len(rows),
+        "moved": moved,
+        "failed": failed,
+        # 故障发生到判定宕机、判定宕机到迁移完成、总耗时（秒）
+        "detect_seconds": round(started - down_since, 3),
+        "migrate_seconds": round(finished - started, 3),
+        "failover_seconds": round(finished - down_since, 3),
+    }
+    _failover_stats["total"] += 1
+    _failover_stats["moved"] += moved
+    _failover_stats["failed"] += failed
+    _failover_stats["last"] = record
+    _failover_stats["history"].append(record)
+    print(
+        f"[Cluster] ✅ 节点 {node.id} 故障转移完成：迁移 {moved}，失败 {failed}，"
+        f"耗时 {record['failover_seconds']}s"
+    )
+
 
+async def _failover_batch(rows: list[dict], home: ZlmNode) -> tuple[int, int]:
+    """
+    把宕机节点 home 上的一批代理放到健康节点：先在目标节点添加代理，成功后才写回分配；
+    没有可用节点或添加失败的留在原分配并进入重试队列。返回 (迁移数, 失败数)
+    """
+    pairs: list[tuple[dict, ZlmNode]] = []
     for row in rows:
-        vhost = row["vhost"]
-        app = row["app"]
-        stream = row["stream"]
-        key = _stream_proxy_key(vhost, app, stream)
-        if key in existing_keys:
+        key = (row["vhost"], row["app"], row["stream"])
+        target = node_pool.pick()
+        if target is None:
+            _failover_retry[key] = home.id
             continue
+        # 先计入目标节点，连续放置时后续选择能看到前面的分配
+        node_pool.assign(target, home.id)
+        pairs.append((row, target))
+
+    async def _push(pair: tuple[dict, ZlmNode]) -> bool:
+        row, target = pair
+        return await _add_stream_proxy_to_zlm(
+            node=target,
+            vhost=row["vhost"],
+            app=row["app"],
+            stream=row["stream"],
+            url=row["url"],
+            audio_type=row.get("audio_type"),
+        )
 
-        query_params = {
-            "secret": ZLM_SECRET,
-            "vhost": vhost,
-            "app": app,
-            "stream": stream,
-            "url": row["url"],
+    results = await run_bounded(pairs, _push, concurrency=PROXY_RESTORE_CONCURRENCY)
+    moved: list[dict] = []
+    for (row, target), ok in zip(pairs, results):
+        key = (row["vhost"], row["app"], row["stream"])
+        if ok is True:
+            moved.append({**row, "node_id": target.id})
+            _failed_over[key] = home.id
+            _failover_retry.pop(key, None)
+        else:
+            node_pool.assign(home, target.id)
+            _failover_retry[key] = home.id
+    if moved:
+        await run_db(db_update_pull_proxy_nodes, moved)
+    return len(moved), len(rows) - len(moved)
+
+
+async def _retry_failover() -> None:
+    """
+    每个心跳周期重试一批故障转移失败的代理；原节点已恢复或代理已删除/改派的移出队列
+    """
+    batches: dict[str, list[dict]] = {}
+    for key, home_id in list(_failover_retry.items())[:FAILOVER_BATCH_SIZE]:
+        home = node_pool.get(home_id)
+        vhost, app, stream = key
+        row = await run_db(db_get_pull_proxy, vhost=vhost, app=app, stream=stream)
+        if home is None or home.healthy or row is None or row.get("node_id") != home_id:
+            _failover_retry.pop(key, None)
+            continue
+        batches.setdefault(home_id, []).append(row)
+    for home_id, rows in batches.items():
+        moved, _ = await _failover_batch(rows, node_pool.nodes[home_id])
+        _failover_stats["moved"] += moved
+
+
+async def _remove_stale_proxies(node: ZlmNode) -> None:
+    """
+    节点恢复时（例如只是网络中断，ZLM 未重启）整理其上仍在运行的代理：
+    故障转移出去、本应迁回的代理直接改回该节点并删除故障转移节点上的副本；
+    其余已分配到其他节点的代理删除，避免重复拉流
+    """
+    try:
+        response = await _zlm_get(node, "listStreamProxy")
+        raw = response.json()
+    except Exception:
+        return
+    if raw.get("code") != 0:
+        return
+    assigned = {
+        _stream_proxy_key(r["vhost"], r["app"], r["stream"])
+        for r in (await run_db(db_query_pull_proxies, node_id=node.id))[0]
+    }
+    reclaimed: list[dict] = []
+    stale: list[tuple[str, str, str]] = []
+    for item in raw.get("data", []) or []:
+        key = _stream_proxy_item_key(item or {})
+        if not key or key in assigned:
+            continue
+        vhost, app, stream = key.split("/", 2)
+        if _failed_over.get((vhost, app, stream)) == node.id:
+            row = await run_db(db_get_pull_proxy, vhost=vhost, app=app, stream=stream)
+            if row is not None:
+                reclaimed.append(row)
+                continue
+        stale.append((vhost, app, stream))
+
+    if reclaimed:
+        await run_db(
+            db_update_pull_proxy_nodes,
+            [{**row, "node_id": node.id} for row in reclaimed],
+        )
+        for row in reclaimed:
+            _failed_over.pop((row["vhost"], row["app"], row["stream"]), None)
+            node_pool.assign(node, row.get("node_id"))
+        print(
+            f"[Cluster] ✅ 节点 {node.id} 上仍在运行的 {len(reclaimed)} 个代理已直接迁回"
+        )
+
+    async def _delete(pair: tuple[ZlmNode | None, tuple[str, str, str]]) -> None:
+        target, (vhost, app, stream) = pair
+        if target is not None:
+            await _del_stream_proxy_from_zlm(
+                node=target, vhost=vhost, app=app, stream=stream
+            )
+
+    # 迁回的代理删除故障转移节点上的副本，其余删除恢复节点上的旧代理
+    deletes = [
+        (
+            node_pool.get(row.get("node_id")),
+            (row["vhost"], row["app"], row["stream"]),
+        )
+        for row in reclaimed
+        if row.get("node_id") != node.id
+    ]
+    deletes += [(node, key) for key in stale]
+    await run_bounded(deletes, _delete, concurrency=PROXY_RESTORE_CONCURRENCY)
+
+
+async def _rebalance_step() -> None:
+    """
+    每个心跳周期最多迁移 REBALANCE_BATCH_SIZE 个代理：
+    先把故障转移出去的代理迁回已恢复的原节点，再从过载节点迁出
+    """
+    back: list[tuple[dict, ZlmNode]] = []
+    for key, home_id in list(_failed_over.items()):
+        if len(back) >= REBALANCE_BATCH_SIZE:
+            break
+        home = node_pool.get(home_id)
+        if home is None or not home.healthy:
+            continue
+        if home.overloaded:
+            continue
+        vhost, app, stream = key
+        row = await run_db(db_get_pull_proxy, vhost=vhost, app=app, stream=stream)
+        if row is None or row.get("node_id") == home_id:
+            # 已删除或已经在原节点上
+            _failed_over.pop(key, None)
+            continue
+        back.append((row, home))
+    if back:
+
+        async def _back(pair: tuple[dict, ZlmNode]) -> bool:
+            row, home = pair
+            ok = await _move_pull_proxy(row, home)
+            if ok:
+                _failed_over.pop((row["vhost"], row["app"], row["stream"]), None)
+            return ok
+
+        await run_bounded(back, _back, concurrency=PROXY_RESTORE_CONCURRENCY)
+        return
+    if any(node.overloaded for node in node_pool.healthy()):
+        await _rebalance(max_moves=REBALANCE_BATCH_SIZE)
+
+
+async def collect_metrics() -> None:
+    """
+    定时采样主机与 ZLM 指标，所有页面共享同一份采样结果
+    """
+    host, statistic, work_threads, threads = await asyncio.gather(
+        asyncio.to_thread(_collect_host_stats),
+        _fetch_zlm_json("getStatistic"),
+        _fetch_zlm_json("getWorkThreadsLoad"),
+        _fetch_zlm_json("getThreadsLoad"),
+    )
+    rows = metrics_store.add(
+        {
+            "host": host,
+            "statistic": statistic,
+            "work_threads": work_threads,
+            "threads": threads,
         }
-        query_params.update(_audio_type_to_zlm_params(row.get("audio_type")))
+    )
+    event_hub.publish("host-stats", {"code": 0, "data": host})
+    for topic, raw in (
+        ("zlm-statistic", statistic),
+        ("work-threads-load", work_threads),
+        ("threads-load", threads),
+    ):
+        if raw is not None:
+            event_hub.publish(topic, raw)
+    if not rows:
+        return
+    try:
+        await run_db(db_upsert_metric_rollups, rows, retention=ROLLUP_RETENTION)
+    except Exception as e:
+        print(f"[Metrics] ⚠️ 写入指标汇总失败: {e}")
+
+
+async def refresh_snapshots() -> None:
+    """
+    最近有人查看的流在截图过期前刷新，查看时直接命中缓存
+    """
+    if not snapshot_cache.viewed(SNAPSHOT_VIEW_WINDOW):
+        return
+    await media_registry.refresh()
+    await snapshot_cache.refresh_viewed(
+        window=SNAPSHOT_VIEW_WINDOW, online=media_registry.is_online
+    )
+
+
+# /metrics 使用的缓存：拉流代理（代理 key -> 节点与重拉次数）与录像盘使用量
+_exporter_cache: dict = {
+    "scraped_at": None,
+    "duration": 0.0,
+    "proxies": {},
+    "disks": [],
+}
+
+
+def _record_disk_usage() -> list[dict]:
+    """
+    RECORD_ROOT 及挂载在其下的各文件系统的使用量，同一设备只统计一次
+    """
+    root = RECORD_ROOT.resolve()
+    paths = [root]
+    try:
+        for part in psutil.disk_partitions(all=True):
+            mountpoint = Path(part.mountpoint)
+            if root in mountpoint.parents:
+                paths.append(mountpoint)
+    except Exception:
+        pass
+    disks: list[dict] = []
+    seen_devices: set[int] = set()
+    for path in paths:
         try:
-            await client.get(
-                f"{ZLM_SERVER}/index/api/addStreamProxy", params=query_params
-            )
-        except Exception:
+            device = os.stat(path).st_dev
+            usage = shutil.disk_usage(path)
+        except OSError:
+            continue
+        if device in seen_devices:
+            continue
+        seen_devices.add(device)
+        disks.append(
+            {
+                "path": str(path),
+                "total": usage.total,
+                "used": usage.used,
+                "free": usage.free,
+            }
+        )
+    return disks
+
+
+async def refresh_exporter_cache() -> None:
+    """
+    定时刷新 /metrics 需要向 ZLM 和磁盘读取的数据，Prometheus 抓取时不再访问上游
+    """
+    started = time.monotonic()
+    proxies, disks, _ = await asyncio.gather(
+        _list_stream_proxies(stale=True),
+        asyncio.to_thread(_record_disk_usage),
+        media_registry.refresh(),
+    )
+    proxy_map: dict[str, dict] = {}
+    for node, item in proxies:
+        key = _stream_proxy_item_key(item)
+        if not key:
             continue
+        try:
+            repull = int(item.get("rePullCount", 0) or 0)
+        except (TypeError, ValueError):
+            repull = 0
+        proxy_map[key] = {"node_id": node.id, "repull": repull}
+    _exporter_cache.update(
+        scraped_at=time.time(),
+        duration=time.monotonic() - started,
+        proxies=proxy_map,
+        disks=disks,
+    )
 
 
-# =============================================================================
+def _cached_metric(name: str) -> dict | None:
+    sample = metrics_store.fresh(max_age=METRICS_INTERVAL * 3)
+    if sample is None:
+        return None
+    return sample.get(name)
 
 
 @app.get("/api/perf/statistic", summary="获取主要对象个数", tags=["性能"])
-async def get_statistic():
-    query_params = {"secret": ZLM_SECRET}
-    response = await client.get(
-        f"{ZLM_SERVER}/index/api/getStatistic", params=query_params
-    )
+async def get_statistic(
+    node_id: str | None = Query(None, description="ZLM 节点，不传为默认节点"),
+):
+    node = node_pool.get(node_id) if node_id else node_pool.default
+    if node is None:
+        return {"code": -1, "msg": f"节点不存在: {node_id}"}
+    if node is node_pool.default:
+        cached = _cached_metric("statistic")
+        if cached is not None:
+            return cached
+    response = await _zlm_get(node, "getStatistic", stale=True)
     return response.json()
 
 
 @app.get("/api/perf/work-threads-load", summary="获取后台线程负载", tags=["性能"])
-async def get_work_threads_load():
-    query_params = {"secret": ZLM_SECRET}
-    response = await client.get(
-        f"{ZLM_SERVER}/index/api/getWorkThreadsLoad", params=query_params
-    )
+async def get_work_threads_load(
+    node_id: str | None = Query(None, description="ZLM 节点，不传为默认节点"),
+):
+    node = node_pool.get(node_id) if node_id else node_pool.default
+    if node is None:
+        return {"code": -1, "msg": f"节点不存在: {node_id}"}
+    if node is node_pool.default:
+        cached = _cached_metric("work_threads")
+        if cached is not None:
+            return cached
+    response = await _zlm_get(node, "getWorkThreadsLoad", stale=True)
     return response.json()
 
 
 @app.get("/api/perf/threads-load", summary="获取网络线程负载", tags=["性能"])
-async def get_threads_load():
-    query_params = {"secret": ZLM_SECRET}
-    response = await client.get(
-        f"{ZLM_SERVER}/index/api/getThreadsLoad", params=query_params
-    )
+async def get_threads_load(
+    node_id: str | None = Query(None, description="ZLM 节点，不传为默认节点"),
+):
+    node = node_pool.get(node_id) if node_id else node_pool.default
+    if node is None:
+        return {"code": -1, "msg": f"节点不存在: {node_id}"}
+    if node is node_pool.default:
+        cached = _cached_metric("threads")
+        if cached is not None:
+            return cached
+    response = await _zlm_get(node, "getThreadsLoad", stale=True)
     return response.json()
 
 
-@app.get(
-    "/api/perf/host-stats",
-    summary="获取当前系统资源使用率",
-    tags=["性能"],
-)
-async def get_host_stats():
+def _collect_host_stats() -> dict:
     timestamp = datetime.now().strftime("%H:%M:%S")
 
     # CPU 使用率
@@ -385,59 +1380,357 @@ async def get_host_stats():
     }
 
     return {
-        "code": 0,
-        "data": {
-            "time": timestamp,
-            "ts_ms": int(datetime.now().timestamp() * 1000),
-            "cpu": round(cpu_percent, 2),
-            "memory": memory_info,
-            "disk": disk_info,
-            "disks": disks,
-            "net_io": net_io,
-        },
+        "time": timestamp,
+        "ts_ms": int(datetime.now().timestamp() * 1000),
+        "cpu": round(cpu_percent, 2),
+        "memory": memory_info,
+        "disk": disk_info,
+        "disks": disks,
+        "net_io": net_io,
     }
 
 
-# =============================================================================
-@app.post("/api/stream/pull-proxy", summary="添加拉流代理", tags=["流"])
-async def post_pull_proxy(
-    vhost: str = Query("__defaultVhost__", description="虚拟主机"),
-    app: str = Query(..., description="应用名"),
-    stream: str = Query(..., description="流ID"),
-    url: str = Query(..., description="源流地址"),
-    audio_type: int | None = Query(None, description="音频设置"),
-):
-    if not re.match(r"^[a-zA-Z0-9._-]+$", app):
-        return {
-            "code": -1,
-            "msg": "app 只能包含字母、数字、下划线(_)、短横线(-) 或英文句点(.)",
-        }
-    if not re.match(r"^[a-zA-Z0-9._-]+$", stream):
-        return {
-            "code": -1,
-            "msg": "stream 只能包含字母、数字、下划线(_)、短横线(-) 或英文句点(.)",
-        }
+@app.get(
+    "/api/perf/zlm-client", summary="获取 ZLM 接口耗时、熔断与连接池状态", tags=["性能"]
+)
+async def get_zlm_client_stats():
+    return {"code": 0, "data": zlm_client.stats()}
 
-    # 验证 url 前缀
-    if not any(
-        url.startswith(prefix)
-        for prefix in ["rtsp://", "rtmp://", "http://", "https://"]
-    ):
-        return {
-            "code": -1,
-            "msg": "源流地址必须以 rtsp://、rtmp://、http:// 或 https:// 开头",
+
+def _render_metrics() -> str:
+    w = MetricsWriter(prefix="streamui_")
+
+    w.gauge(
+        "exporter_last_refresh_timestamp_seconds",
+        "最近一次刷新 /metrics 缓存的时间",
+        _exporter_cache["scraped_at"],
+    )
+    w.gauge(
+        "exporter_refresh_duration_seconds",
+        "最近一次刷新 /metrics 缓存的耗时",
+        _exporter_cache["duration"],
+    )
+
+    # 在线流：来自 hook 增量维护的流表，不请求 ZLM
+    streams = media_registry.streams()
+    proxies: dict[str, dict] = _exporter_cache["proxies"]
+    w.gauge("streams_online", "在线流数量", len(streams))
+    for (vhost, app_name, stream), info in sorted(streams.items()):
+        labels = {
+            "vhost": vhost,
+            "app": app_name,
+            "stream": stream,
+            "node_id": info.get("node_id") or node_pool.default.id,
+            "origin": info.get("originTypeStr") or "",
         }
+        speeds = [
+            s.get("bytesSpeed")
+            for s in info.get("schemas") or []
+            if isinstance(s.get("bytesSpeed"), (int, float))
+        ]
+        w.gauge(
+            "stream_bytes_per_second",
+            "流的入流码率（字节/秒）",
+            max(speeds) if speeds else None,
+            labels,
+        )
+        w.gauge(
+            "stream_readers",
+            "流的观看人数（各协议合计）",
+            info.get("totalReaderCount") or 0,
+            labels,
+        )
+        w.gauge(
+            "stream_recording",
+            "流是否正在录制 MP4",
+            bool(info.get("isRecordingMP4")),
+            labels,
+        )
+    for key, proxy in sorted(proxies.items()):
+        vhost, app_name, stream = (key.split("/", 2) + ["", ""])[:3]
+        w.counter(
+            "pull_proxy_repull_total",
+            "拉流代理的重拉次数（ZLM rePullCount，代理重建后归零）",
+            proxy["repull"],
+            {
+                "vhost": vhost,
+                "app": app_name,
+                "stream": stream,
+                "node_id": proxy["node_id"],
+            },
+        )
+
+    for disk in _exporter_cache["disks"]:
+        labels = {"path": disk["path"]}
+        w.gauge("record_disk_total_bytes", "录像盘总容量", disk["total"], labels)
+        w.gauge("record_disk_used_bytes", "录像盘已用容量", disk["used"], labels)
+        w.gauge("record_disk_free_bytes", "录像盘可用容量", disk["free"], labels)
+
+    totals = record_scheduler.cleanup_totals
+    w.counter(
+        "record_cleanup_runs_total", "按保留期清理录像的次数", totals["cleanup_runs"]
+    )
+    w.counter(
+        "record_cleanup_dirs_deleted_total",
+        "按保留期删除的日期目录数",
+        totals["cleanup_dirs_deleted"],
+    )
+    w.counter(
+        "record_cleanup_files_deleted_total",
+        "按保留期删除的录像片段数",
+        totals["cleanup_files_deleted"],
+    )
+    w.counter(
+        "record_cleanup_bytes_freed_total",
+        "按保留期清理释放的字节数",
+        totals["cleanup_bytes_freed"],
+    )
+    w.counter(
+        "record_cleanup_seconds_total",
+        "按保留期清理的累计耗时",
+        totals["cleanup_seconds"],
+    )
+    w.counter(
+        "record_eviction_checks_total",
+        "磁盘水位检查次数",
+        totals["eviction_checks"],
+    )
+    w.counter(
+        "record_eviction_triggered_total",
+        "超过高水位触发淘汰的次数",
+        totals["eviction_triggered"],
+    )
+    w.counter(
+        "record_eviction_files_deleted_total",
+        "磁盘水位淘汰删除的录像片段数",
+        totals["eviction_files_deleted"],
+    )
+    w.counter(
+        "record_eviction_bytes_freed_total",
+        "磁盘水位淘汰释放的字节数",
+        totals["eviction_bytes_freed"],
+    )
+
+    for node in node_pool:
+        labels = {"node_id": node.id}
+        w.gauge("zlm_node_healthy", "ZLM 节点心跳是否正常", node.healthy, labels)
+        w.gauge("zlm_node_overloaded", "ZLM 节点是否过载", node.overloaded, labels)
+        w.gauge(
+            "zlm_node_threads_load",
+            "ZLM 节点网络线程平均负载",
+            node.threads_load,
+            labels,
+        )
+        w.gauge("zlm_node_proxies", "分配到节点的拉流代理数", node.proxies, labels)
+        w.gauge("zlm_node_score", "ZLM 节点负载得分", node.score, labels)
+
+    for (node_id, api), tracker in sorted(zlm_client.trackers().items()):
+        labels = {"node_id": node_id, "api": api}
+        w.histogram(
+            "zlm_api_request_duration_seconds",
+            "ZLM HTTP 接口成功请求的耗时",
+            tracker.histogram,
+            labels,
+        )
+        w.counter(
+            "zlm_api_errors_total", "ZLM HTTP 接口失败次数", tracker.errors, labels
+        )
+        w.counter(
+            "zlm_api_timeouts_total", "ZLM HTTP 接口超时次数", tracker.timeouts, labels
+        )
+        w.gauge(
+            "zlm_api_deadline_seconds",
+            "ZLM HTTP 接口当前的自适应超时",
+            zlm_client.deadline(node_id, api),
+            labels,
+        )
+    client_stats = zlm_client.stats()
+    pool = client_stats["pool"]
+    w.gauge("zlm_client_max_connections", "ZLM 连接池大小", pool["max_connections"])
+    w.gauge("zlm_client_in_flight", "进行中的 ZLM 请求数", pool["in_flight"])
+    w.gauge("zlm_client_waiting", "排队等待连接的 ZLM 请求数", pool["waiting"])
+    w.counter(
+        "zlm_client_shed_total",
+        "因熔断或连接池已满而未发出的请求数",
+        client_stats["shed"],
+    )
+    w.counter(
+        "zlm_client_stale_served_total",
+        "失败时返回旧数据的次数",
+        client_stats["stale_served"],
+    )
+    for node_id, breaker in client_stats["breakers"].items():
+        for state in ("closed", "open", "half_open"):
+            w.gauge(
+                "zlm_breaker_state",
+                "ZLM 节点熔断器状态（当前状态为 1）",
+                breaker["state"] == state,
+                {"node_id": node_id, "state": state},
+            )
+
+    w.counter("snapshot_cache_hits_total", "截图缓存命中次数", snapshot_cache.hits)
+    w.counter(
+        "snapshot_cache_misses_total", "截图缓存未命中次数", snapshot_cache.misses
+    )
+    w.counter(
+        "snapshot_cache_coalesced_total",
+        "合并到进行中截图请求的次数",
+        snapshot_cache.coalesced,
+    )
+    w.counter("snapshot_cache_failures_total", "截图失败次数", snapshot_cache.failures)
+    w.gauge("snapshot_cache_items", "缓存中的截图数量", len(snapshot_cache))
+
+    w.counter("failover_total", "节点故障转移次数", _failover_stats["total"])
+    w.counter(
+        "failover_moved_total", "故障转移迁出的拉流代理数", _failover_stats["moved"]
+    )
+    w.counter(
+        "failover_failed_total", "故障转移失败的拉流代理数", _failover_stats["failed"]
+    )
+
+    for name, (hist, errors) in sorted(db_query_timings().items()):
+        labels = {"function": name}
+        w.histogram(
+            "db_query_duration_seconds",
+            "经线程池执行的数据库函数耗时（不含排队）",
+            hist,
+            labels,
+        )
+        w.counter("db_query_errors_total", "数据库函数执行失败次数", errors, labels)
+
+    return w.render()
 
-    db_row = db_upsert_pull_proxy(
+
+@app.get("/metrics", summary="Prometheus 指标", tags=["性能"])
+async def get_metrics():
+    # 只读取内存中的缓存与计数器，抓取频率不影响 ZLM
+    return Response(
+        content=_render_metrics(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+@app.get(
+    "/api/perf/host-stats",
+    summary="获取当前系统资源使用率",
+    tags=["性能"],
+)
+async def get_host_stats():
+    cached = _cached_metric("host")
+    if cached is None:
+        cached = await asyncio.to_thread(_collect_host_stats)
+    return {"code": 0, "data": cached}
+
+
+@app.get("/api/events", summary="订阅实时推送（SSE）", tags=["性能"])
+async def get_events(
+    topics: str = Query(
+        ",".join(EVENT_TOPICS),
+        description="订阅主题，逗号分隔：" + "、".join(EVENT_TOPICS),
+    ),
+):
+    wanted = [t.strip() for t in topics.split(",") if t.strip()]
+    unknown = [t for t in wanted if t not in EVENT_TOPICS]
+    if unknown or not wanted:
+        return {"code": -1, "msg": f"未知主题: {','.join(unknown)}"}
+    if "stream-list" in wanted and not event_hub.has_message("stream-list"):
+        await media_registry.refresh()
+        _publish_stream_list()
+    return StreamingResponse(
+        event_hub.stream(wanted),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/perf/history", summary="获取性能指标历史", tags=["性能"])
+async def get_perf_history(
+    start: float | None = Query(None, description="起始时间（unix 秒）"),
+    end: float | None = Query(None, description="结束时间（unix 秒），默认当前"),
+    seconds: int = Query(
+        3600, ge=1, le=366 * 86400, description="未指定 start 时的时间跨度"
+    ),
+    resolution: str = Query("auto", description="粒度：auto、raw、1m、1h"),
+    names: str | None = Query(None, description="指标名，逗号分隔，默认全部"),
+):
+    end = time.time() if end is None else end
+    start = end - seconds if start is None else start
+    if start > end:
+        return {"code": -1, "msg": "start 不能大于 end"}
+    if resolution == "auto":
+        raw_since = metrics_store.raw_since
+        if raw_since is not None and start >= raw_since:
+            resolution = "raw"
+        elif end - start <= 2 * 86400:
+            resolution = "1m"
+        else:
+            resolution = "1h"
+    if resolution != "raw" and resolution not in ROLLUP_RESOLUTIONS:
+        return {"code": -1, "msg": "resolution 只能是 auto、raw、1m、1h"}
+    wanted = {n.strip() for n in names.split(",") if n.strip()} if names else None
+
+    def pick(values: dict) -> dict:
+        if wanted is None:
+            return values
+        return {k: v for k, v in values.items() if k in wanted}
+
+    points: list[dict] = []
+    if resolution == "raw":
+        step = METRICS_INTERVAL
+        for ts, values in metrics_store.raw(start, end):
+            points.append({"ts_ms": int(ts * 1000), "values": pick(values)})
+    else:
+        step = ROLLUP_RESOLUTIONS[resolution]
+        rows = await run_db(
+            db_list_metric_rollups, resolution=step, start=start - step, end=end
+        )
+        pending = metrics_store.pending(step)
+        if pending is not None and (not rows or rows[-1]["ts"] < pending["ts"]):
+            rows.append(pending)
+        for row in rows:
+            if row["ts"] + step < start or row["ts"] > end:
+                continue
+            data = pick(row["data"])
+            points.append(
+                {
+                    "ts_ms": int(row["ts"] * 1000),
+                    "values": {k: v[0] for k, v in data.items()},
+                    "min": {k: v[1] for k, v in data.items()},
+                    "max": {k: v[2] for k, v in data.items()},
+                }
+            )
+    return {
+        "code": 0,
+        "data": {"resolution": resolution, "step": step, "points": points},
+    }
+
+
+# =============================================================================
+@app.post("/api/stream/pull-proxy", summary="添加拉流代理", tags=["流"])
+async def post_pull_proxy(
+    vhost: str = Query("__defaultVhost__", description="虚拟主机"),
+    app: str = Query(..., description="应用名"),
+    stream: str = Query(..., description="流ID"),
+    url: str = Query(..., description="源流地址"),
+    audio_type: int | None = Query(None, description="音频设置"),
+):
+    error = _validate_pull_proxy(app=app, stream=stream, url=url)
+    if error:
+        return {"code": -1, "msg": error}
+
+    db_row = await run_db(
+        db_upsert_pull_proxy,
         vhost=vhost,
         app=app,
         stream=stream,
         url=url,
         audio_type=audio_type,
     )
+    (node,) = await _place_pull_proxies([db_row])
 
     asyncio.create_task(
         _add_stream_proxy_to_zlm(
+            node=node,
             vhost=vhost,
             app=app,
             stream=stream,
@@ -458,12 +1751,177 @@ async def delete_pull_proxy(
     app: str = Query(..., description="应用名"),
     stream: str = Query(..., description="流id"),
 ):
-    deleted = db_delete_pull_proxy(vhost=vhost, app=app, stream=stream)
-    db_delete_record_policy(vhost=vhost, app=app, stream=stream)
-    asyncio.create_task(_del_stream_proxy_from_zlm(vhost=vhost, app=app, stream=stream))
+    node = await _owner_node((vhost, app, stream))
+    deleted = await run_db(db_delete_pull_proxy, vhost=vhost, app=app, stream=stream)
+    await run_db(db_delete_record_policy, vhost=vhost, app=app, stream=stream)
+    asyncio.create_task(
+        _del_stream_proxy_from_zlm(node=node, vhost=vhost, app=app, stream=stream)
+    )
     return {"code": 0, "msg": "已删除，后台同步中", "db_deleted": deleted}
 
 
+PULL_PROXY_FIELDS = ["vhost", "app", "stream", "url", "audio_type"]
+
+
+def _parse_pull_proxy_import(body: bytes, content_type: str) -> list[dict]:
+    text = body.decode("utf-8-sig")
+    if "csv" in content_type:
+        return [dict(r) for r in csv.DictReader(io.StringIO(text))]
+    raw = json.loads(text)
+    if isinstance(raw, dict):
+        raw = raw.get("data", [])
+    if not isinstance(raw, list):
+        raise ValueError('JSON 需为数组或 {"data": [...]}')
+    return raw
+
+
+@app.post("/api/stream/pull-proxy/bulk", summary="批量导入拉流代理", tags=["流"])
+async def post_pull_proxy_bulk(request: Request):
+    """
+    请求体为 CSV（Content-Type: text/csv，首行为表头）或 JSON 数组，
+    字段：vhost（可选）、app、stream、url、audio_type（可选）。
+    全部行校验通过后在一个事务内写入，再以有限并发推送到 ZLM
+    """
+    try:
+        items = _parse_pull_proxy_import(
+            await request.body(), request.headers.get("content-type", "")
+        )
+    except Exception as e:
+        return {"code": -1, "msg": f"解析失败: {e}"}
+    if not items:
+        return {"code": -1, "msg": "没有可导入的数据"}
+
+    rows: list[dict] = []
+    errors: list[dict] = []
+    seen: set[tuple[str, str, str]] = set()
+    for line, item in enumerate(items, start=1):
+        if not isinstance(item, dict):
+            errors.append({"row": line, "msg": "格式错误"})
+            continue
+        vhost = str(item.get("vhost") or "__defaultVhost__").strip()
+        app_name = str(item.get("app") or "").strip()
+        stream_name = str(item.get("stream") or "").strip()
+        url = str(item.get("url") or "").strip()
+        audio_type = item.get("audio_type")
+        if audio_type in (None, ""):
+            audio_type = None
+        else:
+            try:
+                audio_type = int(audio_type)
+            except (TypeError, ValueError):
+                errors.append({"row": line, "msg": "audio_type 必须是整数"})
+                continue
+
+        error = _validate_pull_proxy(app=app_name, stream=stream_name, url=url)
+        if error:
+            errors.append({"row": line, "msg": error})
+            continue
+        key = (vhost, app_name, stream_name)
+        if key in seen:
+            errors.append({"row": line, "msg": f"重复的流: {'/'.join(key)}"})
+            continue
+        seen.add(key)
+        rows.append(
+            {
+                "vhost": vhost,
+                "app": app_name,
+                "stream": stream_name,
+                "url": url,
+                "audio_type": audio_type,
+            }
+        )
+
+    if errors:
+        return {
+            "code": -1,
+            "msg": f"{len(errors)} 行校验失败，未导入",
+            "errors": errors,
+        }
+
+    assigned = await run_db(db_upsert_pull_proxies, rows)
+    count = len(assigned)
+    # 已存在的代理保留原来的节点分配
+    for row in rows:
+        row["node_id"] = assigned.get((row["vhost"], row["app"], row["stream"]))
+    await _place_pull_proxies(rows)
+
+    async def _push(row: dict) -> bool:
+        return await _add_stream_proxy_to_zlm(
+            node=node_pool.get(row["node_id"]) or node_pool.default,
+            vhost=row["vhost"],
+            app=row["app"],
+            stream=row["stream"],
+            url=row["url"],
+            audio_type=row["audio_type"],
+        )
+
+    asyncio.create_task(run_bounded(rows, _push, concurrency=PROXY_RESTORE_CONCURRENCY))
+    return {"code": 0, "msg": f"已保存 {count} 条，后台连接中", "count": count}
+
+
+@app.get("/api/stream/pull-proxy/export", summary="导出拉流代理", tags=["流"])
+async def get_pull_proxy_export(
+    format: str = Query("csv", description="导出格式 csv/json"),
+):
+    if format == "json":
+
+        def _iter_json():
+            yield "["
+            for i, row in enumerate(db_iter_pull_proxies()):
+                item = {field: row.get(field) for field in PULL_PROXY_FIELDS}
+                yield ("," if i else "") + json.dumps(item, ensure_ascii=False)
+            yield "]"
+
+        return StreamingResponse(
+            _iter_json(),
+            media_type="application/json",
+            headers={"Content-Disposition": "attachment; filename=pull_proxy.json"},
+        )
+
+    def _iter_csv():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(PULL_PROXY_FIELDS)
+        for i, row in enumerate(db_iter_pull_proxies(), start=1):
+            writer.writerow(
+                ["" if row.get(f) is None else row.get(f) for f in PULL_PROXY_FIELDS]
+            )
+            if i % 500 == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    return StreamingResponse(
+        _iter_csv(),
+        media_type="text/csv",
+        headers={"Content-Disposition": "attachment; filename=pull_proxy.csv"},
+    )
+
+
+@app.get(
+    "/api/stream/pull-proxy-restore",
+    summary="获取拉流代理恢复进度",
+    tags=["流"],
+)
+async def get_pull_proxy_restore():
+    state = dict(_proxy_restore_state)
+    state["failed_keys"] = list(state["failed_keys"])
+    return {"code": 0, "data": state}
+
+
+@app.post(
+    "/api/stream/pull-proxy-restore",
+    summary="重新恢复数据库中缺失的拉流代理",
+    tags=["流"],
+)
+async def post_pull_proxy_restore():
+    if _proxy_restore_state["running"]:
+        return {"code": -1, "msg": "恢复任务正在进行中"}
+    asyncio.create_task(sync_pull_proxies_from_db())
+    return {"code": 0, "msg": "已开始恢复，后台进行中"}
+
+
 # @app.get("/api/stream/pull-proxy-list", summary="获取拉流代理列表", tags=["流"])
 # async def get_pull_proxy_list():
 #     rows = db_list_pull_proxies()
@@ -517,85 +1975,59 @@ async def delete_pull_proxy(
 )
 async def get_pull_proxy_table(
     vhost: str = Query("__defaultVhost__", description="筛选虚拟主机"),
-    app: str | None = Query(None, description="筛选应用名"),
-    stream: str | None = Query(None, description="筛选流id"),
+    app: str | None = Query(None, description="筛选应用名（前缀匹配）"),
+    stream: str | None = Query(None, description="筛选流id（前缀匹配）"),
+    status: str | None = Query(None, description="筛选在线状态 online/offline"),
+    node_id: str | None = Query(None, description="筛选 ZLM 节点"),
+    sort: str = Query("id", description="排序字段 id/app/stream/updated_at"),
+    order: str = Query("desc", description="排序方向 asc/desc"),
+    page: int = Query(1, ge=1, description="页码"),
+    limit: int | None = Query(
+        None, ge=1, le=1000, description="每页条数，不传返回全部"
+    ),
 ):
-    rows = db_list_pull_proxies()
-    if vhost:
-        rows = [r for r in rows if r.get("vhost") == vhost]
-    if app:
-        rows = [r for r in rows if app in str(r.get("app", ""))]
-    if stream:
-        rows = [r for r in rows if stream in str(r.get("stream", ""))]
-
     repull_count_map: dict[str, int] = {}
     active_stream_map: dict[str, dict] = {}
 
-    try:
-        list_params = {"secret": ZLM_SECRET}
-        media_params = {"secret": ZLM_SECRET, "vhost": vhost}
-        list_resp, media_resp = await asyncio.gather(
-            client.get(f"{ZLM_SERVER}/index/api/listStreamProxy", params=list_params),
-            client.get(f"{ZLM_SERVER}/index/api/getMediaList", params=media_params),
-        )
+    proxies, _ = await asyncio.gather(
+        _list_stream_proxies(stale=True),
+        media_registry.refresh(),
+    )
+    for _, item in proxies:
+        key = _stream_proxy_item_key(item)
+        if not key:
+            continue
+        try:
+            repull_count_map[key] = int(item.get("rePullCount", 0) or 0)
+        except Exception:
+            repull_count_map[key] = 0
 
-        list_raw = list_resp.json()
-        if list_raw.get("code") == 0:
-            for item in list_raw.get("data", []) or []:
-                src = (item or {}).get("src") or {}
-                src_vhost = src.get("vhost")
-                src_app = src.get("app")
-                src_stream = src.get("stream")
-                if not (src_vhost and src_app and src_stream):
-                    continue
-                key = _stream_proxy_key(src_vhost, src_app, src_stream)
-                try:
-                    repull_count_map[key] = int(item.get("rePullCount", 0) or 0)
-                except Exception:
-                    repull_count_map[key] = 0
-
-        media_raw = media_resp.json()
-        if media_raw.get("code") == 0:
-            for media in media_raw.get("data", []) or []:
-                if not isinstance(media, dict):
-                    continue
-                if media.get("originTypeStr") != "pull":
-                    continue
-
-                media_vhost = str(media.get("vhost", ""))
-                media_app = str(media.get("app", ""))
-                media_stream = str(media.get("stream", ""))
-                if not (media_vhost and media_app and media_stream):
-                    continue
-
-                key = _stream_proxy_key(media_vhost, media_app, media_stream)
-                if key not in active_stream_map:
-                    active_stream_map[key] = {
-                        "vhost": media_vhost,
-                        "app": media_app,
-                        "stream": media_stream,
-                        "originTypeStr": media.get("originTypeStr"),
-                        "originUrl": media.get("originUrl"),
-                        "originSock": media.get("originSock"),
-                        "aliveSecond": media.get("aliveSecond"),
-                        "isRecordingMP4": media.get("isRecordingMP4"),
-                        "isRecordingHLS": media.get("isRecordingHLS"),
-                        "totalReaderCount": media.get("totalReaderCount"),
-                        "schemas": [],
-                    }
-
-                active_stream_map[key]["schemas"].append(
-                    {
-                        "schema": media.get("schema"),
-                        "bytesSpeed": media.get("bytesSpeed"),
-                        "readerCount": media.get("readerCount"),
-                        "totalBytes": media.get("totalBytes"),
-                        "tracks": media.get("tracks", []),
-                    }
-                )
-    except Exception:
-        repull_count_map = {}
-        active_stream_map = {}
+    for stream_key, info in media_registry.streams().items():
+        if info.get("originTypeStr") != "pull":
+            continue
+        if vhost and stream_key[0] != vhost:
+            continue
+        active_stream_map[_stream_proxy_key(*stream_key)] = info
+
+    online: bool | None = None
+    if status == "online":
+        online = True
+    elif status == "offline":
+        online = False
+
+    rows, total = await run_db(
+        db_query_pull_proxies,
+        vhost=vhost,
+        app=app,
+        stream=stream,
+        online_keys=list(active_stream_map),
+        online=online,
+        node_id=node_id,
+        sort=sort,
+        order=order,
+        limit=limit,
+        offset=(page - 1) * limit if limit else 0,
+    )
 
     data: list[dict] = []
     for row in rows:
@@ -611,6 +2043,7 @@ async def get_pull_proxy_table(
                 "stream": row_stream,
                 "url": row.get("url"),
                 "audio_type": row.get("audio_type"),
+                "node_id": row.get("node_id"),
                 "rePullCount": repull_count_map.get(key, 0),
                 "isOnline": bool(active),
                 "totalReaderCount": active.get("totalReaderCount") if active else "-",
@@ -620,7 +2053,7 @@ async def get_pull_proxy_table(
             }
         )
 
-    return {"code": 0, "data": data}
+    return {"code": 0, "count": total, "data": data}
 
 
 @app.get(
@@ -634,60 +2067,68 @@ async def get_streamid_list(
     app: str | None = Query(None, description="筛选应用名"),
     stream: str | None = Query(None, description="筛选流id"),
 ):
-    query_params = {"secret": ZLM_SECRET}
+    if not await media_registry.refresh():
+        return {"code": -1, "msg": "获取在线流列表失败"}
 
-    if schema:
-        query_params["schema"] = schema
-    if vhost:
-        query_params["vhost"] = vhost
-    if app:
-        query_params["app"] = app
-    if stream:
-        query_params["stream"] = stream
+    streams = media_registry.streams()
+    result = []
+    for (media_vhost, media_app, media_stream), info in streams.items():
+        if vhost and media_vhost != vhost:
+            continue
+        if app and media_app != app:
+            continue
+        if stream and media_stream != stream:
+            continue
+        if schema:
+            schemas = [s for s in info["schemas"] if s.get("schema") == schema]
+            if not schemas:
+                continue
+            info = {**info, "schemas": schemas}
+        result.append(info)
 
-    response = await client.get(
-        f"{ZLM_SERVER}/index/api/getMediaList", params=query_params
-    )
-    raw_data = response.json()
+    return {"code": 0, "data": result}
 
-    if raw_data["code"] != 0:
-        return raw_data  # 错误直接返回
 
-    media_list = raw_data.get("data", [])
-    stream_map = {}
+@app.get("/api/stream/snapshot", summary="获取在线流截图（带缓存）", tags=["流"])
+async def get_stream_snapshot(
+    app: str = Query(..., description="应用名"),
+    stream: str = Query(..., description="流ID"),
+    vhost: str = Query("__defaultVhost__", description="虚拟主机"),
+):
+    key = (vhost, app, stream)
+    await media_registry.refresh()
+    if not media_registry.is_online(key):
+        return {"code": -1, "msg": "流不在线"}
+    item = await snapshot_cache.get(key)
+    if item is None:
+        return {"code": -1, "msg": "截图失败"}
+    return Response(
+        content=item.data,
+        media_type="image/jpeg",
+        headers={
+            "Cache-Control": f"private, max-age={max(0, int(SNAPSHOT_TTL - item.age))}",
+            "X-Snapshot-Time": str(int(item.ts * 1000)),
+        },
+    )
 
-    for media in media_list:
-        key = (media["vhost"], media["app"], media["stream"])
-        if key not in stream_map:
-            # 初始化主信息（这些字段在同一个流中应该一致）
-            stream_map[key] = {
-                "vhost": media["vhost"],
-                "app": media["app"],
-                "stream": media["stream"],
-                "originTypeStr": media["originTypeStr"],
-                "originUrl": media["originUrl"],
-                "originSock": media["originSock"],
-                "aliveSecond": media["aliveSecond"],
-                "isRecordingMP4": media["isRecordingMP4"],
-                "isRecordingHLS": media["isRecordingHLS"],
-                "totalReaderCount": media["totalReaderCount"],
-                "schemas": [],
-            }
 
-        # 添加当前 schema 的信息
-        stream_map[key]["schemas"].append(
-            {
-                "schema": media["schema"],
-                "bytesSpeed": media["bytesSpeed"],
-                "readerCount": media["readerCount"],
-                "totalBytes": media["totalBytes"],
-                "tracks": media.get("tracks", []),
-            }
-        )
+@app.get(
+    "/api/stream/streamid-list/delta",
+    summary="获取在线流列表的增量变化",
+    tags=["流"],
+)
+async def get_streamid_list_delta(
+    since: int | None = Query(None, description="客户端已知的版本号，不传返回全量"),
+    epoch: str | None = Query(None, description="版本号所属的 epoch"),
+):
+    global _stream_list_revision
 
-    # 转为列表返回
-    result = list(stream_map.values())
-    return {"code": 0, "data": result}
+    if not await media_registry.refresh():
+        return {"code": -1, "msg": "获取在线流列表失败"}
+    if media_registry.revision != _stream_list_revision:
+        _stream_list_revision = media_registry.revision
+        stream_list_changes.update(media_registry.streams())
+    return {"code": 0, "data": stream_list_changes.since(since, epoch)}
 
 
 @app.delete(
@@ -698,18 +2139,150 @@ async def delete_streamid(
     app: str = Query(..., description="应用名"),
     stream: str = Query(..., description="流ID"),
 ):
-    query_params = {"secret": ZLM_SECRET}
+    query_params = {}
     query_params["vhost"] = str(vhost)
     query_params["app"] = str(app)
     query_params["stream"] = str(stream)
     query_params["force"] = "1"
 
-    response = await client.get(
-        f"{ZLM_SERVER}/index/api/close_streams", params=query_params
-    )
+    await media_registry.refresh()
+    node = _stream_node((str(vhost), str(app), str(stream)))
+    response = await _zlm_get(node, "close_streams", query_params)
     return response.json()
 
 
+BATCH_CONTROL_ACTIONS = ("start_record", "stop_record", "close_stream")
+
+
+def _parse_batch_control_item(item: object) -> dict | str:
+    """
+    校验一条批量控制请求，返回规范化后的条目或错误信息
+    """
+    if not isinstance(item, dict):
+        return "格式错误"
+    vhost = str(item.get("vhost") or "__defaultVhost__").strip()
+    app_name = str(item.get("app") or "").strip()
+    stream_name = str(item.get("stream") or "").strip()
+    action = str(item.get("action") or "").strip()
+    if not (app_name and stream_name):
+        return "app 和 stream 不能为空"
+    if action not in BATCH_CONTROL_ACTIONS:
+        return f"action 只能是 {'/'.join(BATCH_CONTROL_ACTIONS)}"
+    parsed = {"vhost": vhost, "app": app_name, "stream": stream_name, "action": action}
+    if action == "start_record":
+        try:
+            retention_days = int(item.get("record_days"))
+            priority = item.get("priority")
+            priority = None if priority in (None, "") else int(priority)
+        except (TypeError, ValueError):
+            return "record_days、priority 必须是整数"
+        if retention_days <= 0 or retention_days > 30:
+            return "录像天数范围建议 1-30 天"
+        parsed["retention_days"] = retention_days
+        parsed["priority"] = priority
+    return parsed
+
+
+async def _apply_batch_control(item: dict) -> tuple[bool, str]:
+    key = (item["vhost"], item["app"], item["stream"])
+    query = {"vhost": key[0], "app": key[1], "stream": key[2]}
+    action = item["action"]
+    if action == "start_record":
+        if not media_registry.is_online(key):
+            # 策略已保存，流上线时由 _on_stream_online 自动开始录制
+            return True, "流不在线，上线后自动录制"
+        if media_registry.is_recording(key):
+            return True, "已在录制"
+        query.update(type="1", max_second="300")
+        raw = (await _zlm_get(_stream_node(key), "startRecord", query)).json()
+        if raw.get("code") == 0:
+            media_registry.set_recording(key, True)
+    elif action == "stop_record":
+        if not media_registry.is_online(key):
+            return True, "流不在线"
+        query["type"] = "1"
+        raw = (await _zlm_get(_stream_node(key), "stopRecord", query)).json()
+        if raw.get("code") == 0:
+            media_registry.set_recording(key, False)
+    else:
+        if not media_registry.is_online(key):
+            return True, "流不在线"
+        query["force"] = "1"
+        raw = (await _zlm_get(_stream_node(key), "close_streams", query)).json()
+    return raw.get("code") == 0, str(raw.get("msg") or "success")
+
+
+@app.post(
+    "/api/stream/batch-control", summary="批量控制流（录制/停止录制/关闭）", tags=["流"]
+)
+async def post_batch_control(request: Request):
+    """
+    请求体为 JSON 数组或 {"data": [...]}，每项字段：vhost（可选）、app、stream、
+    action（start_record/stop_record/close_stream），start_record 另需 record_days、可选 priority。
+    录像策略在一个事务内写入，ZLM 调用以有限并发执行，返回每一项的结果。
+    无效项逐项跳过并在结果中说明，其余项照常执行；同一个流出现多次时只执行第一次，
+    之后的重复项同样视为无效（并发执行时无法保证先后顺序）
+    """
+    try:
+        raw = json.loads(await request.body() or b"null")
+    except Exception as e:
+        return {"code": -1, "msg": f"解析失败: {e}"}
+    if isinstance(raw, dict):
+        raw = raw.get("data")
+    if not isinstance(raw, list) or not raw:
+        return {"code": -1, "msg": '请求体需为非空数组或 {"data": [...]}'}
+    if len(raw) > BATCH_CONTROL_MAX_ITEMS:
+        return {"code": -1, "msg": f"单次最多 {BATCH_CONTROL_MAX_ITEMS} 项"}
+
+    results: list[dict] = []
+    valid: list[tuple[int, dict]] = []
+    seen: set[tuple[str, str, str]] = set()
+    for index, item in enumerate(raw):
+        parsed = _parse_batch_control_item(item)
+        if isinstance(parsed, str):
+            results.append({"index": index, "ok": False, "msg": parsed})
+            continue
+        key = (parsed["vhost"], parsed["app"], parsed["stream"])
+        fields = ("vhost", "app", "stream", "action")
+        result = {"index": index, **{f: parsed[f] for f in fields}, "ok": False}
+        if key in seen:
+            results.append({**result, "msg": f"重复的流，已跳过: {'/'.join(key)}"})
+            continue
+        seen.add(key)
+        results.append({**result, "msg": ""})
+        valid.append((index, parsed))
+
+    policies = [
+        {
+            **item,
+            "enabled": item["action"] == "start_record",
+            "retention_days": item.get("retention_days"),
+        }
+        for _, item in valid
+        if item["action"] in ("start_record", "stop_record")
+    ]
+    await run_db(db_upsert_record_policies, policies)
+    await media_registry.refresh()
+
+    async def _run(pair: tuple[int, dict]) -> tuple[bool, str]:
+        return await _apply_batch_control(pair[1])
+
+    outcomes = await run_bounded(valid, _run, concurrency=BATCH_CONTROL_CONCURRENCY)
+    for (index, _), outcome in zip(valid, outcomes):
+        result = results[index]
+        if isinstance(outcome, Exception):
+            result["msg"] = f"ZLM 请求失败: {outcome}"
+            continue
+        result["ok"], result["msg"] = outcome
+
+    succeeded = sum(1 for r in results if r["ok"])
+    return {
+        "code": 0,
+        "msg": f"成功 {succeeded}，失败 {len(results) - succeeded}",
+        "data": results,
+    }
+
+
 # =============================================================================
 @app.get("/api/playback/start-record", summary="开启录制", tags=["录制"])
 async def get_start_record(
@@ -717,10 +2290,11 @@ async def get_start_record(
     app: str = Query(..., description="应用名"),
     stream: str = Query(..., description="流ID"),
     record_days: str = Query(..., description="录制天数"),
+    priority: int | None = Query(
+        None, description="保留优先级，磁盘空间不足时优先级高的流保留更久"
+    ),
 ):
-    url = f"{ZLM_SERVER}/index/api/startRecord"
-
-    query = {"secret": ZLM_SECRET}
+    query = {}
     query["vhost"] = str(vhost)
     query["app"] = str(app)
     query["stream"] = str(stream)
@@ -732,17 +2306,22 @@ async def get_start_record(
     if retention_days <= 0 or retention_days > 30:
         return {"code": -1, "msg": "录像天数范围建议 1-30 天"}
 
-    db_row = db_upsert_record_policy(
+    db_row = await run_db(
+        db_upsert_record_policy,
         vhost=str(vhost),
         app=str(app),
         stream=str(stream),
         retention_days=retention_days,
         enabled=True,
+        priority=priority,
     )
     query["max_second"] = "300"
 
-    response = await client.get(url, params=query)
+    key = (str(vhost), str(app), str(stream))
+    response = await _zlm_get(await _owner_node(key), "startRecord", query)
     raw = response.json()
+    if raw.get("code") == 0:
+        media_registry.set_recording(key, True)
     raw["record_policy"] = db_row
     return raw
 
@@ -753,23 +2332,27 @@ async def get_stop_record(
     app: str = Query(..., description="应用名"),
     stream: str = Query(..., description="流ID"),
 ):
-    url = f"{ZLM_SERVER}/index/api/stopRecord"
-
-    query = {"secret": ZLM_SECRET}
+    query = {}
     query["vhost"] = str(vhost)
     query["app"] = str(app)
     query["stream"] = str(stream)
     query["type"] = "1"
 
-    response = await client.get(url, params=query)
+    key = (str(vhost), str(app), str(stream))
+    response = await _zlm_get(await _owner_node(key), "stopRecord", query)
     raw = response.json()
-    existing = db_get_record_policy(vhost=str(vhost), app=str(app), stream=str(stream))
+    if raw.get("code") == 0:
+        media_registry.set_recording(key, False)
+    existing = await run_db(
+        db_get_record_policy, vhost=str(vhost), app=str(app), stream=str(stream)
+    )
     if existing:
         try:
             retention_days = int(existing.get("retention_days", 0) or 0)
         except Exception:
             retention_days = 0
-        db_upsert_record_policy(
+        await run_db(
+            db_upsert_record_policy,
             vhost=str(vhost),
             app=str(app),
             stream=str(stream),
@@ -788,9 +2371,7 @@ async def get_event_record(
     back_ms: str = Query(..., description="回溯录制时长"),
     forward_ms: str = Query(..., description="后续录制时长"),
 ):
-    url = f"{ZLM_SERVER}/index/api/startRecordTask"
-
-    query = {"secret": ZLM_SECRET}
+    query = {}
     query["vhost"] = str(vhost)
     query["app"] = str(app)
     query["stream"] = str(stream)
@@ -798,10 +2379,27 @@ async def get_event_record(
     query["back_ms"] = back_ms
     query["forward_ms"] = forward_ms
 
-    response = await client.get(url, params=query)
+    node = await _owner_node((str(vhost), str(app), str(stream)))
+    response = await _zlm_get(node, "startRecordTask", query)
     return response.json()
 
 
+@app.get(
+    "/api/playback/cleanup-stats", summary="获取最近一次录像清理统计", tags=["录制"]
+)
+async def get_cleanup_stats():
+    return {"code": 0, "data": record_scheduler.last_cleanup_stats or None}
+
+
+@app.get(
+    "/api/playback/disk-pressure-stats",
+    summary="获取最近一次磁盘水位检查统计",
+    tags=["录制"],
+)
+async def get_disk_pressure_stats():
+    return {"code": 0, "data": record_scheduler.last_disk_pressure_stats or None}
+
+
 @app.get(
     "/api/playback/streamid-record-list",
     summary="获取本地所有流ID的录制信息",
@@ -813,12 +2411,11 @@ async def get_streamid_record_list():
     if not RECORD_ROOT.exists() or not RECORD_ROOT.is_dir():
         return {"code": -1, "msg": f"{RECORD_ROOT} 目录不存在或不是目录"}
 
-    # 正则匹配 YYYY-MM-DD 格式
-    date_pattern = re.compile(r"^(\d{4})-(\d{2})-(\d{2})$")
+    await media_registry.refresh()
 
     policy_map: dict[tuple[str, str, str], dict] = {}
     try:
-        for row in db_list_record_policies(enabled_only=False) or []:
+        for row in await run_db(db_list_record_policies, enabled_only=False) or []:
             vhost = str(row.get("vhost") or "__defaultVhost__")
             app_name = str(row.get("app") or "")
             stream_name = str(row.get("stream") or "")
@@ -828,131 +2425,53 @@ async def get_streamid_record_list():
     except Exception:
         policy_map = {}
 
-    active_keys: set[tuple[str, str, str]] = set()
-    recording_map: dict[tuple[str, str, str], bool] = {}
     try:
-        query_params = {"secret": ZLM_SECRET, "vhost": "__defaultVhost__"}
-        response = await client.get(
-            f"{ZLM_SERVER}/index/api/getMediaList", params=query_params
-        )
-        raw = response.json()
-        if raw.get("code") == 0:
-            for media in raw.get("data", []) or []:
-                if not isinstance(media, dict):
-                    continue
-                vhost = str(media.get("vhost") or "__defaultVhost__")
-                app_name = str(media.get("app") or "")
-                stream_name = str(media.get("stream") or "")
-                if not (app_name and stream_name):
-                    continue
-                key = (vhost, app_name, stream_name)
-                active_keys.add(key)
-                try:
-                    is_recording = bool(media.get("isRecordingMP4"))
-                except Exception:
-                    is_recording = False
-                if is_recording:
-                    recording_map[key] = True
-                else:
-                    recording_map.setdefault(key, False)
-    except Exception:
-        active_keys = set()
-        recording_map = {}
-
-    try:
-        for app_name in os.listdir(RECORD_ROOT):
-            app_path = RECORD_ROOT / app_name
-            if not app_path.is_dir():
-                continue
+        day_rows = await run_db(db_list_record_days)
+    except Exception as e:
+        return {"code": -1, "msg": f"读取录像索引异常 {e}"}
+
+    # 按 app/stream 汇总每日统计
+    stream_map: dict[tuple[str, str], dict] = {}
+    for row in day_rows:
+        app_name = row["app"]
+        stream_name = row["stream"]
+        agg = stream_map.get((app_name, stream_name))
+        if agg is None:
+            agg = {"slice_num": 0, "total_size": 0, "dates": []}
+            stream_map[(app_name, stream_name)] = agg
+        agg["slice_num"] += int(row["slice_num"])
+        agg["total_size"] += int(row["total_size"])
+        agg["dates"].append(row["date"])
+
+    for (app_name, stream_name), agg in stream_map.items():
+        if agg["slice_num"] <= 0:
+            continue
 
-            for stream_name in os.listdir(app_path):
-                stream_path = app_path / stream_name
-                if not stream_path.is_dir():
-                    continue
-
-                total_slices = 0
-                total_size_bytes = 0
-                dates = set()
-
-                # 遍历 stream_path 下所有子项
-                for item in os.listdir(stream_path):
-                    item_path = stream_path / item
-
-                    if not item_path.is_dir():
-                        continue
-
-                    # 使用正则匹配 YYYY-MM-DD
-                    match = date_pattern.match(item)
-                    if not match:
-                        continue  # 不符合格式
-
-                    # 检查该日期目录下是否有 .mp4 文件
-                    try:
-                        mp4_files = [
-                            f
-                            for f in os.listdir(item_path)
-                            if f.lower().endswith(".mp4")
-                        ]
-                    except Exception:
-                        continue
-
-                    if not mp4_files:
-                        # 空目录：删除
-                        try:
-                            shutil.rmtree(item_path)
-                            print(f"已删除空录像目录: {item_path}")
-                        except Exception as e:
-                            print(f"删除空目录失败 {item_path}: {e}")
-                        continue
-
-                    # 统计文件数量和大小
-                    for fname in mp4_files:
-                        file_path = item_path / fname
-                        if not file_path.is_file():
-                            continue
-                        try:
-                            size = file_path.stat().st_size
-                            total_size_bytes += size
-                            total_slices += 1
-                        except OSError as e:
-                            print(f"读取文件大小失败 {file_path}: {e}")
-
-                    # 添加有效日期
-                    dates.add(item)
-
-                # 只有存在录像片段才加入结果
-                if total_slices == 0:
-                    continue
-
-                policy = (
-                    policy_map.get(("__defaultVhost__", app_name, stream_name)) or {}
-                )
-                try:
-                    enabled = int(policy.get("enabled", 0) or 0)
-                except Exception:
-                    enabled = 0
-                record_days = policy.get("retention_days", "-") if enabled == 1 else "-"
-
-                result.append(
-                    {
-                        "app": app_name,
-                        "stream": stream_name,
-                        "slice_num": total_slices,
-                        "total_storage_gb": round(total_size_bytes / (1024**3), 2),
-                        "dates": sorted(dates),
-                        "record_days": record_days,
-                        "isOnline": ("__defaultVhost__", app_name, stream_name)
-                        in active_keys,
-                        "isRecordingMP4": recording_map.get(
-                            ("__defaultVhost__", app_name, stream_name), False
-                        ),
-                    }
-                )
+        policy = policy_map.get(("__defaultVhost__", app_name, stream_name)) or {}
+        try:
+            enabled = int(policy.get("enabled", 0) or 0)
+        except Exception:
+            enabled = 0
+        record_days = policy.get("retention_days", "-") if enabled == 1 else "-"
 
-        return {"code": 0, "data": result}
+        result.append(
+            {
+                "app": app_name,
+                "stream": stream_name,
+                "slice_num": agg["slice_num"],
+                "total_storage_gb": round(agg["total_size"] / (1024**3), 2),
+                "dates": sorted(agg["dates"]),
+                "record_days": record_days,
+                "isOnline": media_registry.is_online(
+                    ("__defaultVhost__", app_name, stream_name)
+                ),
+                "isRecordingMP4": media_registry.is_recording(
+                    ("__defaultVhost__", app_name, stream_name)
+                ),
+            }
+        )
 
-    except Exception as e:
-        return {"code": -1, "msg": f"目录遍历异常 {e}"}
+    return {"code": 0, "data": result}
 
 
 @app.get(
@@ -963,84 +2482,391 @@ async def get_streamid_record(
     stream: str = Query(..., description="流ID"),
     date: str = Query(..., description="日期格式 YYYY-MM-DD"),
 ):
-    target_dir = RECORD_ROOT / app / stream / date
-
-    if not target_dir.exists():
-        return {"code": 1, "msg": f"目录不存在: {target_dir}"}
-
-    if not target_dir.is_dir():
-        return {"code": 1, "msg": f"路径不是目录: {target_dir}"}
-
-    tz_shanghai = ZoneInfo("Asia/Shanghai")
-    parsed: list[tuple[Path, datetime]] = []
-    fallback_files: list[Path] = []
+    rows = await run_db(db_list_record_segments, app=app, stream=stream, date=date)
 
-    for file_path in target_dir.iterdir():
-        if not file_path.is_file():
-            continue
-        if file_path.suffix.lower() != ".mp4":
-            continue
-        if file_path.name.startswith("."):
-            continue
+    if not rows:
+        target_dir = RECORD_ROOT / app / stream / date
 
-        m = re.match(
-            r"(\d{4})-(\d{1,2})-(\d{1,2})-(\d{1,2})-(\d{1,2})-(\d{1,2})",
-            file_path.name,
-        )
-        if not m:
-            fallback_files.append(file_path)
-            continue
-        year, month, day, hour, minute, second = map(int, m.groups())
-        try:
-            start_dt = datetime(
-                year, month, day, hour, minute, second, tzinfo=tz_shanghai
-            )
-        except ValueError:
-            fallback_files.append(file_path)
-            continue
-        parsed.append((file_path, start_dt))
+        if not target_dir.exists():
+            return {"code": 1, "msg": f"目录不存在: {target_dir}"}
 
-    parsed.sort(key=lambda x: x[1])
+        if not target_dir.is_dir():
+            return {"code": 1, "msg": f"路径不是目录: {target_dir}"}
 
     results: list[dict] = []
-    default_duration = 300.0
-    for i, (file_path, start_dt) in enumerate(parsed):
-        duration = default_duration
-        if i + 1 < len(parsed):
-            next_start = parsed[i + 1][1]
-            delta = (next_start - start_dt).total_seconds()
-            if 1 <= delta <= 600:
-                duration = float(delta)
+    for row in rows:
+        start_dt = datetime.fromtimestamp(float(row["start_ts"]), tz=TZ_SHANGHAI)
+        duration = float(row["duration"])
         end_dt = start_dt + timedelta(seconds=duration)
-
-        try:
-            rel_path = file_path.relative_to(RECORD_ROOT)
-        except ValueError:
-            continue
-
         results.append(
             {
-                "filename": str(rel_path),
+                "filename": f"{app}/{stream}/{date}/{row['filename']}",
                 "duration": round(duration, 3),
                 "start": start_dt.isoformat(),
                 "end": end_dt.isoformat(),
+                "duration_source": row["duration_source"],
             }
         )
 
-    for file_path in fallback_files:
-        data = get_video_shanghai_time(file_path)
-        if not data:
+    return {"code": 0, "data": results}
+
+
+@app.get(
+    "/api/playback/timeline",
+    summary="获取录像时间轴（合并后的连续区间与缺口）",
+    tags=["录制"],
+)
+async def get_playback_timeline(
+    app: str = Query(..., description="应用名"),
+    stream: str = Query(..., description="流ID"),
+    date: str = Query(..., description="日期格式 YYYY-MM-DD"),
+    span: str = Query(
+        "day", description="范围：day 当天、week 所在周（周一开始）、month 所在月"
+    ),
+    tolerance: float = Query(
+        2, ge=0, le=600, description="片段间隔不超过该秒数时视为连续"
+    ),
+):
+    try:
+        day = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=TZ_SHANGHAI)
+    except ValueError:
+        return {"code": -1, "msg": "date 格式应为 YYYY-MM-DD"}
+    if span == "day":
+        start_dt = day
+        end_dt = day + timedelta(days=1)
+    elif span == "week":
+        start_dt = day - timedelta(days=day.weekday())
+        end_dt = start_dt + timedelta(days=7)
+    elif span == "month":
+        start_dt = day.replace(day=1)
+        end_dt = (start_dt + timedelta(days=32)).replace(day=1)
+    else:
+        return {"code": -1, "msg": "span 只能是 day、week、month"}
+
+    start_ts = start_dt.timestamp()
+    end_ts = end_dt.timestamp()
+    segments = await run_db(
+        db_list_record_ranges, app=app, stream=stream, start_ts=start_ts, end_ts=end_ts
+    )
+    ranges = merge_time_ranges(
+        ((max(s, start_ts), min(e, end_ts)) for s, e in segments),
+        tolerance=tolerance,
+    )
+
+    # 缺口只统计到当前时间，未来的时间不算缺口
+    gaps: list[list[float]] = []
+    cursor = start_ts
+    gap_end = min(end_ts, time.time())
+    for s, e in ranges:
+        if s > cursor and cursor < gap_end:
+            gaps.append([cursor, min(s, gap_end)])
+        cursor = max(cursor, e)
+    if cursor < gap_end:
+        gaps.append([cursor, gap_end])
+
+    def to_ms(items: list[list[float]]) -> list[list[int]]:
+        return [[int(s * 1000), int(e * 1000)] for s, e in items]
+
+    return {
+        "code": 0,
+        "data": {
+            "start": int(start_ts * 1000),
+            "end": int(end_ts * 1000),
+            "ranges": to_ms(ranges),
+            "gaps": to_ms(gaps),
+            "covered": int(sum(e - s for s, e in ranges) * 1000),
+        },
+    }
+
+
+def _record_file(path: str) -> Path | None:
+    """
+    将相对录像根目录的路径解析为文件，拒绝越出录像目录的路径
+    """
+    root = RECORD_ROOT.resolve()
+    try:
+        target = (root / path).resolve()
+        target.relative_to(root)
+    except (ValueError, OSError):
+        return None
+    if target.suffix.lower() != ".mp4" or not target.is_file():
+        return None
+    return target
+
+
+def _hls_part(path: Path, seq: int | None) -> bytes:
+    index = load_mp4_index(path, segment_seconds=HLS_SEGMENT_SECONDS)
+    return index.init_segment() if seq is None else index.media_segment(seq)
+
+
+@app.get(
+    "/api/playback/hls/index.m3u8",
+    summary="生成指定时间范围的 HLS 回放列表（fMP4，不转码）",
+    tags=["录制"],
+)
+async def get_playback_hls_playlist(
+    app: str = Query(..., description="应用名"),
+    stream: str = Query(..., description="流ID"),
+    start: int = Query(..., description="起始时间（毫秒时间戳）"),
+    end: int = Query(..., description="结束时间（毫秒时间戳）"),
+):
+    if end <= start:
+        return {"code": -1, "msg": "end 必须大于 start"}
+    if end - start > HLS_MAX_RANGE_HOURS * 3600 * 1000:
+        return {"code": -1, "msg": f"时间跨度不能超过 {HLS_MAX_RANGE_HOURS:g} 小时"}
+    start_ts = start / 1000
+    end_ts = end / 1000
+    rows = await run_db(
+        db_list_record_segments_between,
+        app=app,
+        stream=stream,
+        start_ts=start_ts,
+        end_ts=end_ts,
+    )
+
+    async def load(row: dict):
+        rel = f"{app}/{stream}/{row['date']}/{row['filename']}"
+        path = _record_file(rel)
+        if path is None:
+            return None
+        index = await asyncio.to_thread(
+            load_mp4_index, path, segment_seconds=HLS_SEGMENT_SECONDS
+        )
+        return rel, float(row["start_ts"]), index
+
+    body: list[str] = []
+    target_duration = 1.0
+    for result in await run_bounded(rows, load, concurrency=4):
+        # 正在写入、已删除或无法解析的文件跳过
+        if not isinstance(result, tuple):
             continue
-        try:
-            rel_path = file_path.relative_to(RECORD_ROOT)
-            data["filename"] = str(rel_path)
-        except ValueError:
+        rel, file_start, index = result
+        entries = [
+            (seq, s, e)
+            for seq, (s, e) in enumerate(index.segment_times())
+            if file_start + e > start_ts and file_start + s < end_ts
+        ]
+        if not entries:
             continue
-        results.append(data)
+        # 每个文件的时间戳从 0 开始，文件之间用 DISCONTINUITY 衔接
+        if body:
+            body.append("#EXT-X-DISCONTINUITY")
+        q = quote(rel)
+        body.append(f'#EXT-X-MAP:URI="init.mp4?path={q}"')
+        program_time = datetime.fromtimestamp(file_start + entries[0][1], TZ_SHANGHAI)
+        body.append(
+            f"#EXT-X-PROGRAM-DATE-TIME:{program_time.isoformat(timespec='milliseconds')}"
+        )
+        for seq, s, e in entries:
+            target_duration = max(target_duration, e - s)
+            body.append(f"#EXTINF:{e - s:.3f},")
+            body.append(f"segment.m4s?path={q}&seq={seq}")
+    if not body:
+        return {"code": -1, "msg": "该时间范围内没有可回放的录像"}
+
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:7",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+        "#EXT-X-INDEPENDENT-SEGMENTS",
+        f"#EXT-X-TARGETDURATION:{int(target_duration + 0.999)}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        *body,
+        "#EXT-X-ENDLIST",
+    ]
+    return Response(
+        content="\n".join(lines) + "\n", media_type="application/vnd.apple.mpegurl"
+    )
 
-    results.sort(key=lambda x: x["start"])
 
-    return {"code": 0, "data": results}
+@app.get("/api/playback/hls/init.mp4", summary="HLS 回放初始化分片", tags=["录制"])
+async def get_playback_hls_init(
+    path: str = Query(..., description="录像相对路径 app/stream/date/file.mp4"),
+):
+    target = _record_file(path)
+    if target is None:
+        return {"code": -1, "msg": "录像文件不存在"}
+    try:
+        data = await asyncio.to_thread(_hls_part, target, None)
+    except Mp4Error as e:
+        return {"code": -1, "msg": f"解析录像失败: {e}"}
+    return Response(
+        content=data,
+        media_type="video/mp4",
+        headers={"Cache-Control": "public, max-age=259200"},
+    )
+
+
+@app.get("/api/playback/hls/segment.m4s", summary="HLS 回放媒体分片", tags=["录制"])
+async def get_playback_hls_segment(
+    path: str = Query(..., description="录像相对路径 app/stream/date/file.mp4"),
+    seq: int = Query(..., ge=0, description="分片序号"),
+):
+    target = _record_file(path)
+    if target is None:
+        return {"code": -1, "msg": "录像文件不存在"}
+    try:
+        data = await asyncio.to_thread(_hls_part, target, seq)
+    except Mp4Error as e:
+        return {"code": -1, "msg": f"解析录像失败: {e}"}
+    return Response(
+        content=data,
+        media_type="video/iso.segment",
+        headers={"Cache-Control": "public, max-age=259200"},
+    )
+
+
+def _record_date_dir(app: str, stream: str, date: str) -> Path | None:
+    if not re.match(r"^\d{4}-\d{2}-\d{2}$", date):
+        return None
+    root = RECORD_ROOT.resolve()
+    try:
+        target = (root / app / stream / date).resolve()
+        target.relative_to(root)
+    except (ValueError, OSError):
+        return None
+    return target
+
+
+@app.get(
+    "/api/playback/thumbnails",
+    summary="获取指定日期各小时的缩略图索引",
+    tags=["录制"],
+)
+async def get_playback_thumbnails(
+    app: str = Query(..., description="应用名"),
+    stream: str = Query(..., description="流ID"),
+    date: str = Query(..., description="日期格式 YYYY-MM-DD"),
+):
+    date_path = _record_date_dir(app, stream, date)
+    if date_path is None:
+        return {"code": -1, "msg": "参数错误"}
+    indexes = await asyncio.to_thread(load_thumbnail_indexes, date_path)
+    for index in indexes:
+        index["sprite"] = (
+            f"/api/playback/thumbnails/sprite.jpg?app={quote(app)}&stream={quote(stream)}"
+            f"&date={date}&hour={index['hour']}&v={index['version']}"
+        )
+    return {"code": 0, "data": indexes}
+
+
+@app.get(
+    "/api/playback/thumbnails/sprite.jpg",
+    summary="获取某小时的缩略图雪碧图",
+    tags=["录制"],
+)
+async def get_playback_thumbnail_sprite(
+    app: str = Query(..., description="应用名"),
+    stream: str = Query(..., description="流ID"),
+    date: str = Query(..., description="日期格式 YYYY-MM-DD"),
+    hour: str = Query(..., pattern=r"^[0-2][0-9]$", description="小时 HH"),
+):
+    date_path = _record_date_dir(app, stream, date)
+    if date_path is None:
+        return {"code": -1, "msg": "参数错误"}
+    try:
+        data = await asyncio.to_thread(
+            (thumb_dir(date_path) / f"{hour}.jpg").read_bytes
+        )
+    except OSError:
+        return {"code": -1, "msg": "缩略图不存在"}
+    # 雪碧图重建后 URL 中的版本号随之变化，可以长期缓存
+    return Response(
+        content=data,
+        media_type="image/jpeg",
+        headers={"Cache-Control": "public, max-age=86400"},
+    )
+
+
+@app.post(
+    "/api/playback/export",
+    summary="导出指定时间范围的录像（流复制拼接，不转码）",
+    tags=["录制"],
+)
+async def post_playback_export(
+    app: str = Query(..., description="应用名"),
+    stream: str = Query(..., description="流ID"),
+    start: int = Query(..., description="起始时间（毫秒时间戳）"),
+    end: int = Query(..., description="结束时间（毫秒时间戳）"),
+):
+    if end <= start:
+        return {"code": -1, "msg": "end 必须大于 start"}
+    if end - start > EXPORT_MAX_RANGE_HOURS * 3600 * 1000:
+        return {
+            "code": -1,
+            "msg": f"时间跨度不能超过 {EXPORT_MAX_RANGE_HOURS:g} 小时",
+        }
+    rows = await run_db(
+        db_list_record_segments_between,
+        app=app,
+        stream=stream,
+        start_ts=start / 1000,
+        end_ts=end / 1000,
+    )
+    files: list[tuple[Path, float, float]] = []
+    for row in rows:
+        path = _record_file(f"{app}/{stream}/{row['date']}/{row['filename']}")
+        if path is not None:
+            files.append((path, float(row["start_ts"]), float(row["duration"])))
+    job = export_manager.submit(
+        app=app, stream=stream, start=start, end=end, files=files
+    )
+    if job is None:
+        return {"code": -1, "msg": "该时间范围内没有可导出的录像"}
+    return {"code": 0, "msg": "导出任务已创建", "data": job.to_dict()}
+
+
+@app.get("/api/playback/export", summary="查询录像导出任务", tags=["录制"])
+async def get_playback_export(
+    job_id: str | None = Query(None, description="任务ID，不传则返回全部任务"),
+):
+    if job_id is None:
+        jobs = sorted(
+            export_manager.jobs.values(), key=lambda j: j.created_at, reverse=True
+        )
+        return {"code": 0, "msg": "success", "data": [j.to_dict() for j in jobs]}
+    job = export_manager.jobs.get(job_id)
+    if job is None:
+        return {"code": -1, "msg": "导出任务不存在"}
+    return {"code": 0, "msg": "success", "data": job.to_dict()}
+
+
+@app.delete("/api/playback/export", summary="取消录像导出任务", tags=["录制"])
+async def delete_playback_export(
+    job_id: str = Query(..., description="任务ID"),
+):
+    job = export_manager.cancel(job_id)
+    if job is None:
+        return {"code": -1, "msg": "导出任务不存在"}
+    return {"code": 0, "msg": "success", "data": job.to_dict()}
+
+
+@app.get(
+    "/api/playback/export/download",
+    summary="下载导出的录像（任务进行中也可边生成边下载）",
+    tags=["录制"],
+)
+async def get_playback_export_download(
+    job_id: str = Query(..., description="任务ID"),
+):
+    job = export_manager.jobs.get(job_id)
+    if job is None:
+        return {"code": -1, "msg": "导出任务不存在"}
+    if job.status in ("failed", "canceled"):
+        return {
+            "code": -1,
+            "msg": f"导出任务已{'失败' if job.status == 'failed' else '取消'}",
+        }
+    begin = datetime.fromtimestamp(job.start / 1000, TZ_SHANGHAI)
+    filename = f"{job.app}_{job.stream}_{begin:%Y%m%d%H%M%S}.mp4"
+    return StreamingResponse(
+        export_manager.follow(job),
+        media_type="video/mp4",
+        headers={
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}",
+            "Cache-Control": "no-store",
+        },
+    )
 
 
 @app.delete(
@@ -1068,29 +2894,221 @@ async def delete_streamid_record(
             shutil.rmtree(item)
             deleted_count += 1
 
+    await run_db(db_delete_record_segments, app=app, stream=stream)
+
     return {"code": 0, "msg": f"已删除 {deleted_count} 个录像目录"}
 
 
 # =============================================================================
+def _hook_node_id(request: Request) -> str:
+    # 回调地址中的 node_id 由 configure_zlm_hooks 写入，没有时视为默认节点
+    node = node_pool.get(request.query_params.get("node_id"))
+    return (node or node_pool.default).id
 
 
-@app.get("/api/server/config", summary="获取服务器配置", tags=["配置"])
-async def get_server_config():
-    query_params = {"secret": ZLM_SECRET}
-    response = await client.get(
-        f"{ZLM_SERVER}/index/api/getServerConfig", params=query_params
+@app.post("/api/hook/on_record_mp4", summary="ZLM 录像切片完成回调", tags=["回调"])
+async def post_hook_on_record_mp4(request: Request):
+    try:
+        body = await request.json()
+    except Exception:
+        return {"code": 0, "msg": "success"}
+
+    body = body if isinstance(body, dict) else {}
+    key = media_key(body)
+    if key is not None:
+        media_registry.set_recording(key, True)
+
+    row = _record_segment_from_hook(body)
+    if row:
+        try:
+            await run_db(db_upsert_record_segments, [row])
+        except Exception as e:
+            print(f"写入录像索引失败 {row['filename']}: {e}")
+        thumbnail_generator.submit(
+            RECORD_ROOT / row["app"] / row["stream"] / row["date"] / row["filename"],
+            row["start_ts"],
+        )
+    return {"code": 0, "msg": "success"}
+
+
+@app.post("/api/hook/on_stream_changed", summary="ZLM 流注册/注销回调", tags=["回调"])
+async def post_hook_on_stream_changed(request: Request):
+    try:
+        body = await request.json()
+    except Exception:
+        return {"code": 0, "msg": "success"}
+    if not isinstance(body, dict):
+        return {"code": 0, "msg": "success"}
+
+    body["node_id"] = _hook_node_id(request)
+    media_registry.apply_stream_changed(body)
+    return {"code": 0, "msg": "success"}
+
+
+@app.post(
+    "/api/hook/on_stream_none_reader", summary="ZLM 流无人观看回调", tags=["回调"]
+)
+async def post_hook_on_stream_none_reader(request: Request):
+    try:
+        body = await request.json()
+    except Exception:
+        body = {}
+    key = media_key(body) if isinstance(body, dict) else None
+    if key is not None:
+        media_registry.set_reader_count(key, 0)
+    # 拉流代理与录像依赖流常驻，不因无人观看而关闭
+    return {"code": 0, "close": False}
+
+
+@app.post("/api/hook/on_stream_not_found", summary="ZLM 流未找到回调", tags=["回调"])
+async def post_hook_on_stream_not_found(request: Request):
+    try:
+        body = await request.json()
+    except Exception:
+        return {"code": 0, "msg": "success"}
+    key = media_key(body) if isinstance(body, dict) else None
+    if key is None or media_registry.is_online(key):
+        return {"code": 0, "msg": "success"}
+
+    # 数据库中存在的拉流代理被请求但不在 ZLM 中，立即重新添加
+    now = time.time()
+    if now - _last_proxy_restore_attempt.get(key, 0.0) < 10:
+        return {"code": 0, "msg": "success"}
+    _last_proxy_restore_attempt[key] = now
+
+    vhost, app_name, stream_name = key
+    row = await run_db(db_get_pull_proxy, vhost=vhost, app=app_name, stream=stream_name)
+    if row:
+        (node,) = await _place_pull_proxies([row])
+        asyncio.create_task(
+            _add_stream_proxy_to_zlm(
+                node=node,
+                vhost=vhost,
+                app=app_name,
+                stream=stream_name,
+                url=row["url"],
+                audio_type=row.get("audio_type"),
+            )
+        )
+    return {"code": 0, "msg": "success"}
+
+
+# =============================================================================
+
+
+async def _move_pull_proxy(row: dict, target: ZlmNode) -> bool:
+    """
+    先在目标节点上添加代理，成功后再更新分配并从原节点删除，迁移期间流不中断
+    """
+    source = node_pool.get(row.get("node_id"))
+    ok = await _add_stream_proxy_to_zlm(
+        node=target,
+        vhost=row["vhost"],
+        app=row["app"],
+        stream=row["stream"],
+        url=row["url"],
+        audio_type=row.get("audio_type"),
+    )
+    if not ok:
+        return False
+    await run_db(db_update_pull_proxy_nodes, [{**row, "node_id": target.id}])
+    node_pool.assign(target, row.get("node_id"))
+    row["node_id"] = target.id
+    if source is not None and source is not target:
+        await _del_stream_proxy_from_zlm(
+            node=source, vhost=row["vhost"], app=row["app"], stream=row["stream"]
+        )
+    return True
+
+
+@app.get("/api/cluster/nodes", summary="获取 ZLM 集群节点及负载", tags=["集群"])
+async def get_cluster_nodes():
+    return {"code": 0, "data": [node.to_dict() for node in node_pool]}
+
+
+async def _rebalance(
+    *, max_moves: int, tolerance: float = 0.1, dry_run: bool = False
+) -> list[dict]:
+    rows = {
+        (r["vhost"], r["app"], r["stream"]): r
+        for r in await run_db(db_list_pull_proxies)
+    }
+    assignments: dict[str, list[tuple[str, str, str]]] = {}
+    for key, row in rows.items():
+        if row.get("node_id"):
+            assignments.setdefault(row["node_id"], []).append(key)
+    plan = node_pool.plan_rebalance(
+        assignments, tolerance=tolerance, max_moves=max_moves
     )
+    moves = [
+        {"key": _stream_proxy_key(*key), "from": src, "to": dst}
+        for key, src, dst in plan
+    ]
+    if dry_run or not plan:
+        return moves
+
+    async def _move(move: tuple[tuple[str, str, str], str, str]) -> bool:
+        key, _, dst = move
+        return await _move_pull_proxy(rows[key], node_pool.nodes[dst])
+
+    results = await run_bounded(plan, _move, concurrency=PROXY_RESTORE_CONCURRENCY)
+    for move, ok in zip(moves, results):
+        move["ok"] = ok is True
+    return moves
+
+
+@app.post("/api/cluster/rebalance", summary="在集群节点间均衡拉流代理", tags=["集群"])
+async def post_cluster_rebalance(
+    max_moves: int = Query(20, ge=1, le=500, description="本次最多迁移的代理数"),
+    tolerance: float = Query(0.1, ge=0, description="节点负载得分允许的差值"),
+    dry_run: bool = Query(False, description="只返回迁移计划，不执行"),
+):
+    if len(node_pool) < 2:
+        return {"code": -1, "msg": "只有一个 ZLM 节点，无需均衡"}
+    await refresh_node_loads()
+    moves = await _rebalance(max_moves=max_moves, tolerance=tolerance, dry_run=dry_run)
+    if dry_run or not moves:
+        return {"code": 0, "data": {"moves": moves}}
+    return {
+        "code": 0,
+        "msg": f"已迁移 {sum(1 for m in moves if m['ok'])}/{len(moves)} 个拉流代理",
+        "data": {"moves": moves},
+    }
+
+
+@app.get("/api/cluster/failover", summary="获取故障转移统计", tags=["集群"])
+async def get_cluster_failover():
+    data = dict(_failover_stats)
+    data["history"] = list(data["history"])
+    data["running"] = sorted(_failover_tasks)
+    data["pending_failback"] = len(_failed_over)
+    data["pending_retry"] = len(_failover_retry)
+    return {"code": 0, "data": data}
+
+
+@app.get("/api/server/config", summary="获取服务器配置", tags=["配置"])
+async def get_server_config(
+    node_id: str | None = Query(None, description="ZLM 节点，不传为默认节点"),
+):
+    node = node_pool.get(node_id) if node_id else node_pool.default
+    if node is None:
+        return {"code": -1, "msg": f"节点不存在: {node_id}"}
+    response = await _zlm_get(node, "getServerConfig", stale=True)
     return response.json()
 
 
 @app.put("/api/server/config", summary="修改服务器配置", tags=["配置"])
 async def put_server_config(request: Request):
+    """
+    查询参数为要修改的配置项；node_id 指定节点，不传为默认节点
+    """
     query_params = dict(request.query_params)
-    query_params["secret"] = ZLM_SECRET
+    node_id = query_params.pop("node_id", None)
+    node = node_pool.get(node_id) if node_id else node_pool.default
+    if node is None:
+        return {"code": -1, "msg": f"节点不存在: {node_id}"}
 
-    response = await client.get(
-        f"{ZLM_SERVER}/index/api/setServerConfig", params=query_params
-    )
+    response = await _zlm_get(node, "setServerConfig", query_params)
     return response.json()
 
 
@@ -0,0 +1,382 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+
+MediaKey = tuple[str, str, str]
+
+
+def media_key(media: dict) -> MediaKey | None:
+    vhost = str(media.get("vhost") or "__defaultVhost__")
+    app = str(media.get("app") or "")
+    stream = str(media.get("stream") or "")
+    if not (app and stream):
+        return None
+    return (vhost, app, stream)
+
+
+def _schema_info(media: dict) -> dict:
+    return {
+        "schema": media.get("schema"),
+        "bytesSpeed": media.get("bytesSpeed"),
+        "readerCount": media.get("readerCount"),
+        "totalBytes": media.get("totalBytes"),
+        "tracks": media.get("tracks", []),
+    }
+
+
+def _stream_info(key: MediaKey, media: dict) -> dict:
+    vhost, app, stream = key
+    return {
+        "vhost": vhost,
+        "app": app,
+        "stream": stream,
+        "originTypeStr": media.get("originTypeStr"),
+        "originUrl": media.get("originUrl"),
+        "originSock": media.get("originSock"),
+        "aliveSecond": media.get("aliveSecond"),
+        "isRecordingMP4": media.get("isRecordingMP4"),
+        "isRecordingHLS": media.get("isRecordingHLS"),
+        "totalReaderCount": media.get("totalReaderCount"),
+        # 多节点时流所在的 ZLM 节点
+        "node_id": media.get("node_id"),
+        "schemas": [],
+    }
+
+
+def aggregate_media_list(media_list: list) -> dict[MediaKey, dict]:
+    """
+    将 getMediaList 返回的按协议平铺的列表，聚合为 (vhost, app, stream) -> 流信息，
+    同一个流的各协议信息放在 schemas 中
+    """
+    stream_map: dict[MediaKey, dict] = {}
+    for media in media_list or []:
+        if not isinstance(media, dict):
+            continue
+        key = media_key(media)
+        if key is None:
+            continue
+        if key not in stream_map:
+            stream_map[key] = _stream_info(key, media)
+        if media.get("isRecordingMP4"):
+            stream_map[key]["isRecordingMP4"] = True
+        stream_map[key]["schemas"].append(_schema_info(media))
+    return stream_map
+
+
+def _signature(streams: dict[MediaKey, dict]) -> dict:
+    # 用于判断全量刷新后流表是否有实质变化（忽略 aliveSecond、码率等持续变化的字段）
+    return {
+        key: (
+            bool(info.get("isRecordingMP4")),
+            info.get("totalReaderCount"),
+            tuple(sorted(str(s.get("schema")) for s in info["schemas"])),
+        )
+        for key, info in streams.items()
+    }
+
+
+class MediaRegistry:
+    """
+    内存中的在线流表，由 ZLM 的 web hook 事件增量维护；
+    getMediaList 全量快照按 ttl 缓存，并发的刷新请求合并为同一次上游调用
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[], Awaitable[list | None]],
+        *,
+        ttl: float = 2.0,
+        on_online: Callable[[MediaKey], None] | None = None,
+        on_change: Callable[[], None] | None = None,
+    ) -> None:
+        self._fetch = fetch
+        self.ttl = ttl
+        self._on_online = on_online
+        self._on_change = on_change
+        self._streams: dict[MediaKey, dict] = {}
+        # 每个流最近一次被全量或 hook 刷新的时间，用于推算 aliveSecond
+        self._seen_at: dict[MediaKey, float] = {}
+        self._inflight: asyncio.Future | None = None
+        self.synced_at = 0.0
+        # 流表每次变化（包括码率等字段）递增
+        self.revision = 0
+
+    @property
+    def synced(self) -> bool:
+        return self.synced_at > 0
+
+    async def refresh(self, *, max_age: float | None = None) -> bool:
+        """
+        快照超过 max_age（默认 ttl）时重新拉取，返回当前是否有可用快照
+        """
+        max_age = self.ttl if max_age is None else max_age
+        if self.synced and time.monotonic() - self.synced_at < max_age:
+            return True
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._refresh())
+        # shield：单个调用方被取消时不影响其他等待同一次拉取的调用方
+        return await asyncio.shield(self._inflight)
+
+    async def _refresh(self) -> bool:
+        try:
+            media_list = await self._fetch()
+        except Exception:
+            media_list = None
+        finally:
+            self._inflight = None
+        if media_list is None:
+            return self.synced
+        self.replace(media_list)
+        return True
+
+    def replace(self, media_list: list) -> None:
+        now = time.monotonic()
+        previous = self._streams
+        self._streams = aggregate_media_list(media_list)
+        self._seen_at = {key: now for key in self._streams}
+        self.synced_at = now
+        self.revision += 1
+        for key in self._streams.keys() - previous.keys():
+            self._notify_online(key)
+        if _signature(previous) != _signature(self._streams):
+            self._notify_change()
+
+    def _notify_online(self, key: MediaKey) -> None:
+        if self._on_online is not None:
+            self._on_online(key)
+
+    def _notify_change(self) -> None:
+        self.revision += 1
+        if self._on_change is not None:
+            self._on_change()
+
+    def apply_stream_changed(self, body: dict) -> None:
+        """
+        处理 on_stream_changed 事件，流的第一个协议注册时视为上线
+        """
+        key = media_key(body)
+        if key is None:
+            return
+        schema = body.get("schema")
+
+        if not body.get("regist"):
+            info = self._streams.get(key)
+            if not info:
+                return
+            info["schemas"] = [s for s in info["schemas"] if s.get("schema") != schema]
+            if not info["schemas"]:
+                self._streams.pop(key, None)
+                self._seen_at.pop(key, None)
+            self._notify_change()
+            return
+
+        info = self._streams.get(key)
+        came_online = info is None
+        if info is None:
+            info = _stream_info(key, body)
+            if info["aliveSecond"] is None:
+                info["aliveSecond"] = 0
+            if info["totalReaderCount"] is None:
+                info["totalReaderCount"] = 0
+            self._streams[key] = info
+            self._seen_at[key] = time.monotonic()
+        else:
+            for field in ("originTypeStr", "originUrl", "originSock"):
+                if body.get(field) is not None:
+                    info[field] = body.get(field)
+            if body.get("isRecordingMP4"):
+                info["isRecordingMP4"] = True
+        info["schemas"] = [s for s in info["schemas"] if s.get("schema") != schema]
+        info["schemas"].append(_schema_info(body))
+        if came_online:
+            self._notify_online(key)
+        self._notify_change()
+
+    def set_recording(self, key: MediaKey, recording: bool) -> None:
+        info = self._streams.get(key)
+        if info is not None and info.get("isRecordingMP4") != recording:
+            info["isRecordingMP4"] = recording
+            self._notify_change()
+
+    def set_reader_count(self, key: MediaKey, count: int) -> None:
+        info = self._streams.get(key)
+        if info is None:
+            return
+        info["totalReaderCount"] = count
+        for schema in info["schemas"]:
+            schema["readerCount"] = count
+        self._notify_change()
+
+    def is_online(self, key: MediaKey) -> bool:
+        return key in self._streams
+
+    def is_recording(self, key: MediaKey) -> bool:
+        info = self._streams.get(key)
+        return bool(info and info.get("isRecordingMP4"))
+
+    def _view(self, key: MediaKey, info: dict) -> dict[str, Any]:
+        view = dict(info)
+        alive = info.get("aliveSecond")
+        if isinstance(alive, (int, float)):
+            elapsed = time.monotonic() - self._seen_at.get(key, time.monotonic())
+            view["aliveSecond"] = int(alive + elapsed)
+        return view
+
+    def get(self, key: MediaKey) -> dict | None:
+        info = self._streams.get(key)
+        return self._view(key, info) if info is not None else None
+
+    def streams(self) -> dict[MediaKey, dict]:
+        return {key: self._view(key, info) for key, info in self._streams.items()}
+
+
+def stream_list_key(key: MediaKey) -> str:
+    return "/".join(key)
+
+
+def _diff_fields(old: dict, new: dict, skip: tuple[str, ...]) -> set[str]:
+    return {
+        k for k in old.keys() | new.keys() if k not in skip and old.get(k) != new.get(k)
+    }
+
+
+class _Change:
+    __slots__ = ("replace", "fields", "schemas")
+
+    def __init__(self, replace: bool) -> None:
+        # replace：流新增或删除，客户端需整体替换
+        self.replace = replace
+        self.fields: set[str] = set()
+        # 协议名 -> 变化的字段；None 表示该协议新增或删除
+        self.schemas: dict[str, set[str] | None] = {}
+
+
+class StreamListChanges:
+    """
+    在线流列表的版本号与变更日志：客户端带上已知版本号，只返回之后新增、删除和变化的流
+    （只含变化字段）；版本过旧、来自上一次进程（epoch 不同）时返回全量。
+    aliveSecond 随时间持续变化，不参与比较，只在全量/新增时返回
+    """
+
+    _VOLATILE = ("aliveSecond", "schemas")
+
+    def __init__(self, *, history: int = 256) -> None:
+        self.epoch = f"{int(time.time() * 1000):x}"
+        self.version = 0
+        self._streams: dict[str, dict] = {}
+        self._schemas: dict[str, dict[str, dict]] = {}
+        # (版本号, 该版本的变更)
+        self._log: deque[tuple[int, dict[str, _Change]]] = deque(maxlen=history)
+
+    def update(self, streams: dict[MediaKey, dict]) -> int:
+        """
+        与上一次的流表比较，有变化时版本号加一并记录变更
+        """
+        current = {stream_list_key(k): v for k, v in streams.items()}
+        current_schemas = {
+            k: {str(s.get("schema")): s for s in v.get("schemas") or []}
+            for k, v in current.items()
+        }
+        changes: dict[str, _Change] = {}
+        for key in self._streams.keys() - current.keys():
+            changes[key] = _Change(True)
+        for key, info in current.items():
+            old = self._streams.get(key)
+            if old is None:
+                changes[key] = _Change(True)
+                continue
+            fields = _diff_fields(old, info, self._VOLATILE)
+            old_schemas = self._schemas[key]
+            new_schemas = current_schemas[key]
+            schemas: dict[str, set[str] | None] = {}
+            for name in old_schemas.keys() ^ new_schemas.keys():
+                schemas[name] = None
+            for name in old_schemas.keys() & new_schemas.keys():
+                changed = _diff_fields(old_schemas[name], new_schemas[name], ())
+                if changed:
+                    schemas[name] = changed
+            if fields or schemas:
+                change = changes[key] = _Change(False)
+                change.fields = fields
+                change.schemas = schemas
+
+        self._streams = current
+        self._schemas = current_schemas
+        if changes:
+            self.version += 1
+            self._log.append((self.version, changes))
+        return self.version
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "epoch": self.epoch,
+            "version": self.version,
+            "full": True,
+            "streams": list(self._streams.values()),
+        }
+
+    def since(self, version: int | None, epoch: str | None = None) -> dict[str, Any]:
+        if version is None or epoch != self.epoch or version > self.version:
+            return self.snapshot()
+        if version < self.version and (not self._log or self._log[0][0] > version + 1):
+            # 变更日志已经不覆盖客户端的版本
+            return self.snapshot()
+
+        merged: dict[str, _Change] = {}
+        for v, changes in self._log:
+            if v <= version:
+                continue
+            for key, change in changes.items():
+                target = merged.get(key)
+                if target is None:
+                    target = merged[key] = _Change(change.replace)
+                target.replace = target.replace or change.replace
+                target.fields |= change.fields
+                for name, fields in change.schemas.items():
+                    if name in target.schemas and target.schemas[name] is None:
+                        continue
+                    if fields is None:
+                        target.schemas[name] = None
+                    else:
+                        target.schemas[name] = (
+                            target.schemas.get(name) or set()
+                        ) | fields
+
+        added: list[dict] = []
+        removed: list[str] = []
+        changed: list[dict] = []
+        for key, change in merged.items():
+            info = self._streams.get(key)
+            if info is None:
+                removed.append(key)
+                continue
+            if change.replace:
+                added.append(info)
+                continue
+            schemas = self._schemas[key]
+            item: dict[str, Any] = {
+                "key": key,
+                "fields": {f: info.get(f) for f in change.fields},
+            }
+            if change.schemas:
+                item["schemas"] = {
+                    name: (
+                        schemas.get(name)
+                        if fields is None
+                        else {f: schemas[name].get(f) for f in fields}
+                    )
+                    for name, fields in change.schemas.items()
+                }
+            changed.append(item)
+
+        return {
+            "epoch": self.epoch,
+            "version": self.version,
+            "full": False,
+            "added": added,
+            "removed": removed,
+            "changed": changed,
+        }
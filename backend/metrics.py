@@ -0,0 +1,147 @@
+import time
+from collections import deque
+from typing import Any
+
+# 汇总粒度（秒）及保留时长（秒）
+ROLLUP_RESOLUTIONS = {"1m": 60, "1h": 3600}
+ROLLUP_RETENTION = {60: 7 * 86400, 3600: 365 * 86400}
+
+
+def _thread_stats(prefix: str, raw: dict | None) -> dict[str, float]:
+    items = [i for i in (raw or {}).get("data") or [] if isinstance(i, dict)]
+    if not items:
+        return {}
+    loads = [float(i.get("load") or 0) for i in items]
+    delays = [float(i.get("delay") or 0) for i in items]
+    return {
+        f"{prefix}_load_avg": round(sum(loads) / len(loads), 2),
+        f"{prefix}_load_max": max(loads),
+        f"{prefix}_delay_max": max(delays),
+    }
+
+
+def flatten_sample(sample: dict) -> dict[str, float]:
+    """
+    将一次采样展开为 指标名 -> 数值，用于环形缓冲和汇总
+    """
+    values: dict[str, float] = {}
+    host = sample.get("host") or {}
+    if host:
+        values["cpu"] = float(host.get("cpu") or 0)
+        for name in ("memory", "disk"):
+            info = host.get(name) or {}
+            values[f"{name}_used"] = float(info.get("used") or 0)
+            values[f"{name}_total"] = float(info.get("total") or 0)
+        net = host.get("net_io") or {}
+        values["net_sent"] = float(net.get("sent") or 0)
+        values["net_recv"] = float(net.get("recv") or 0)
+
+    statistic = (sample.get("statistic") or {}).get("data") or {}
+    if isinstance(statistic, dict):
+        for key, value in statistic.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                values[f"statistic.{key}"] = float(value)
+
+    values.update(_thread_stats("work_threads", sample.get("work_threads")))
+    values.update(_thread_stats("threads", sample.get("threads")))
+    return values
+
+
+class _Bucket:
+    __slots__ = ("start", "stats")
+
+    def __init__(self, start: int) -> None:
+        self.start = start
+        # 指标名 -> [sum, count, min, max]
+        self.stats: dict[str, list[float]] = {}
+
+    def add(self, values: dict[str, float]) -> None:
+        for name, value in values.items():
+            stat = self.stats.get(name)
+            if stat is None:
+                self.stats[name] = [value, 1, value, value]
+                continue
+            stat[0] += value
+            stat[1] += 1
+            if value < stat[2]:
+                stat[2] = value
+            if value > stat[3]:
+                stat[3] = value
+
+    def row(self, resolution: int) -> dict[str, Any]:
+        return {
+            "resolution": resolution,
+            "ts": self.start,
+            "data": {
+                name: [round(s / c, 4), lo, hi]
+                for name, (s, c, lo, hi) in self.stats.items()
+            },
+        }
+
+
+class MetricsStore:
+    """
+    采样结果存储：最近 capacity 次原始采样放在内存环形缓冲中，
+    同时按 1m/1h 汇总，整桶结束时交由调用方写入数据库
+    """
+
+    def __init__(self, *, capacity: int = 3600) -> None:
+        # 原始采样只保留数值，(ts, {指标名: 值})
+        self._raw: deque[tuple[float, dict[str, float]]] = deque(maxlen=capacity)
+        self._buckets: dict[int, _Bucket] = {}
+        self._prev: tuple[float, dict[str, float]] | None = None
+        self.latest: dict | None = None
+        self.latest_at = 0.0
+
+    def add(self, sample: dict, *, ts: float | None = None) -> list[dict[str, Any]]:
+        """
+        记录一次采样，返回已结束的汇总桶（可能为空）
+        """
+        ts = time.time() if ts is None else ts
+        values = flatten_sample(sample)
+        # 网络计数器换算为速率（字节/秒）
+        if self._prev is not None and "net_sent" in values:
+            prev_ts, prev = self._prev
+            elapsed = ts - prev_ts
+            if elapsed > 0 and "net_sent" in prev:
+                for name in ("net_sent", "net_recv"):
+                    delta = values[name] - prev[name]
+                    values[f"{name}_rate"] = round(max(delta, 0) / elapsed, 2)
+        self._prev = (ts, values)
+        self._raw.append((ts, values))
+        self.latest = sample
+        self.latest_at = time.monotonic()
+
+        finished: list[dict[str, Any]] = []
+        for resolution in ROLLUP_RESOLUTIONS.values():
+            start = int(ts // resolution * resolution)
+            bucket = self._buckets.get(resolution)
+            if bucket is not None and bucket.start != start:
+                finished.append(bucket.row(resolution))
+                bucket = None
+            if bucket is None:
+                bucket = self._buckets[resolution] = _Bucket(start)
+            bucket.add(values)
+        return finished
+
+    def fresh(self, max_age: float) -> dict | None:
+        """
+        最近一次采样未超过 max_age 秒时返回，否则返回 None
+        """
+        if self.latest is None or time.monotonic() - self.latest_at > max_age:
+            return None
+        return self.latest
+
+    @property
+    def raw_since(self) -> float | None:
+        return self._raw[0][0] if self._raw else None
+
+    def raw(self, start: float, end: float) -> list[tuple[float, dict[str, float]]]:
+        return [(ts, values) for ts, values in self._raw if start <= ts <= end]
+
+    def pending(self, resolution: int) -> dict[str, Any] | None:
+        """
+        当前尚未结束的汇总桶，查询时与数据库中的汇总合并
+        """
+        bucket = self._buckets.get(resolution)
+        return bucket.row(resolution) if bucket is not None else None
@@ -0,0 +1,456 @@
+"""
+MP4 -> fMP4 重新封装：只解析 moov 中的样本表，按关键帧切分片段，
+片段数据按字节范围直接从原文件读取，不转码、不整体加载文件
+"""
+
+import os
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import accumulate
+from pathlib import Path
+from typing import Iterator
+
+_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"dinf"}
+# 重建 init 段时需要清空的样本表
+_SAMPLE_TABLES = {
+    b"stts",
+    b"ctts",
+    b"stss",
+    b"stsc",
+    b"stsz",
+    b"stz2",
+    b"stco",
+    b"co64",
+}
+
+_SYNC_FLAGS = 0x02000000
+_NON_SYNC_FLAGS = 0x01010000
+
+
+class Mp4Error(Exception):
+    pass
+
+
+def iter_boxes(
+    src: bytes | memoryview | int, start: int = 0, end: int | None = None
+) -> Iterator[tuple[bytes, int, int, int]]:
+    """
+    遍历 [start, end) 内的同级 box，返回 (类型, box 起点, 内容起点, box 终点)。
+    src 为内存中的数据，或文件描述符（只用 pread 读取 box 头，end 默认为文件大小）
+    """
+    if isinstance(src, int):
+        end = os.fstat(src).st_size if end is None else end
+        fd = src
+
+        def read_header(pos: int) -> bytes:
+            return os.pread(fd, 16, pos)
+
+    else:
+        end = len(src) if end is None else end
+        data = src
+
+        def read_header(pos: int) -> bytes:
+            return data[pos : pos + 16]
+
+    pos = start
+    while pos + 8 <= end:
+        header = read_header(pos)
+        size, box_type = struct.unpack_from(">I4s", header)
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                raise Mp4Error(f"box {box_type!r} 长度异常")
+            (size,) = struct.unpack_from(">Q", header, 8)
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size or pos + size > end:
+            raise Mp4Error(f"box {box_type!r} 长度异常，文件可能仍在写入")
+        yield box_type, pos, pos + header_size, pos + size
+        pos += size
+
+
+def _child(data: bytes, start: int, end: int, box_type: bytes) -> tuple[int, int]:
+    for t, _, payload, box_end in iter_boxes(data, start, end):
+        if t == box_type:
+            return payload, box_end
+    raise Mp4Error(f"缺少 {box_type.decode()} box")
+
+
+def _read_moov(path: Path) -> bytes:
+    with open(path, "rb") as f:
+        fd = f.fileno()
+        for box_type, pos, _, end in iter_boxes(fd):
+            if box_type == b"moov":
+                return os.pread(fd, end - pos, pos)
+    raise Mp4Error("未找到 moov，文件可能仍在写入")
+
+
+def _box(box_type: bytes, *payload: bytes) -> bytes:
+    body = b"".join(payload)
+    return struct.pack(">I4s", 8 + len(body), box_type) + body
+
+
+def _full_box(box_type: bytes, version: int, flags: int, *payload: bytes) -> bytes:
+    return _box(box_type, struct.pack(">I", (version << 24) | flags), *payload)
+
+
+class Track:
+    __slots__ = (
+        "track_id",
+        "handler",
+        "timescale",
+        "trak",
+        "dts",
+        "durations",
+        "cto",
+        "sizes",
+        "offsets",
+        "sync",
+    )
+
+    def __init__(self) -> None:
+        self.track_id = 0
+        self.handler = b""
+        self.timescale = 0
+        self.trak = b""
+        # 样本表用紧凑数组保存（每个样本约 29 字节），索引缓存可容纳更多文件
+        self.dts = array("Q")
+        self.durations = array("I")
+        self.cto: array | None = None
+        self.sizes = array("I")
+        self.offsets = array("Q")
+        # 每个样本一个字节，非 0 为关键帧；None 表示所有样本都是关键帧
+        self.sync: bytearray | None = None
+
+    @property
+    def duration(self) -> int:
+        return self.dts[-1] + self.durations[-1] if self.dts else 0
+
+
+def _parse_stbl(track: Track, data: bytes, start: int, end: int) -> None:
+    boxes = {t: (p, e) for t, _, p, e in iter_boxes(data, start, end)}
+
+    p, e = boxes[b"stts"]
+    (n,) = struct.unpack_from(">I", data, p + 4)
+    durations = array("I")
+    for count, delta in struct.iter_unpack(">II", data[p + 8 : p + 8 + 8 * n]):
+        durations += array("I", [delta]) * count
+    dts = array("Q", accumulate(durations, initial=0))
+    del dts[-1]
+
+    p, e = boxes.get(b"stsz") or (None, None)
+    if p is None:
+        raise Mp4Error("不支持 stz2 样本表")
+    sample_size, count = struct.unpack_from(">II", data, p + 4)
+    if sample_size:
+        sizes = array("I", [sample_size]) * count
+    else:
+        sizes = array("I", struct.unpack_from(f">{count}I", data, p + 12))
+    if len(durations) != count:
+        count = min(len(durations), count)
+        del durations[count:], dts[count:], sizes[count:]
+
+    if b"stco" in boxes:
+        p, e = boxes[b"stco"]
+        (n,) = struct.unpack_from(">I", data, p + 4)
+        chunk_offsets = struct.unpack_from(f">{n}I", data, p + 8)
+    else:
+        p, e = boxes[b"co64"]
+        (n,) = struct.unpack_from(">I", data, p + 4)
+        chunk_offsets = struct.unpack_from(f">{n}Q", data, p + 8)
+
+    p, e = boxes[b"stsc"]
+    (n,) = struct.unpack_from(">I", data, p + 4)
+    stsc = list(struct.iter_unpack(">III", data[p + 8 : p + 8 + 12 * n]))
+    offsets = array("Q")
+    for i, (first_chunk, per_chunk, _) in enumerate(stsc):
+        last_chunk = stsc[i + 1][0] - 1 if i + 1 < len(stsc) else len(chunk_offsets)
+        for chunk in range(first_chunk - 1, last_chunk):
+            offset = chunk_offsets[chunk]
+            for _ in range(per_chunk):
+                if len(offsets) >= count:
+                    break
+                offsets.append(offset)
+                offset += sizes[len(offsets) - 1]
+    if len(offsets) < count:
+        raise Mp4Error("样本表不完整")
+
+    cto = None
+    if b"ctts" in boxes:
+        p, e = boxes[b"ctts"]
+        version = data[p]
+        (n,) = struct.unpack_from(">I", data, p + 4)
+        fmt = ">Ii" if version == 1 else ">II"
+        cto = array("i")
+        for c, off in struct.iter_unpack(fmt, data[p + 8 : p + 8 + 8 * n]):
+            if version == 0 and off >= 0x80000000:
+                off -= 0x100000000
+            cto += array("i", [off]) * c
+        if len(cto) < count:
+            cto += array("i", [0]) * (count - len(cto))
+        del cto[count:]
+
+    sync = None
+    if b"stss" in boxes:
+        p, e = boxes[b"stss"]
+        (n,) = struct.unpack_from(">I", data, p + 4)
+        sync = bytearray(count)
+        for number in struct.unpack_from(f">{n}I", data, p + 8):
+            if 0 < number <= count:
+                sync[number - 1] = 1
+
+    track.durations = durations
+    track.dts = dts
+    track.sizes = sizes
+    del offsets[count:]
+    track.offsets = offsets
+    track.cto = cto
+    track.sync = sync
+
+
+def _rebuild_trak(data: bytes, start: int, end: int) -> bytes:
+    """
+    复制 trak，去掉 edts，样本表清空（保留 stsd），用于 fMP4 init 段
+    """
+    out: list[bytes] = []
+    for t, box_start, payload, box_end in iter_boxes(data, start, end):
+        if t == b"edts":
+            continue
+        if t in _CONTAINERS:
+            out.append(_box(t, _rebuild_trak(data, payload, box_end)))
+        elif t in _SAMPLE_TABLES:
+            continue
+        else:
+            out.append(bytes(data[box_start:box_end]))
+        if t == b"stsd":
+            zero = struct.pack(">I", 0)
+            out.append(_full_box(b"stts", 0, 0, zero))
+            out.append(_full_box(b"stsc", 0, 0, zero))
+            out.append(_full_box(b"stsz", 0, 0, zero, zero))
+            out.append(_full_box(b"stco", 0, 0, zero))
+    return b"".join(out)
+
+
+class Mp4Index:
+    """
+    一个 MP4 文件的样本索引与片段划分
+    """
+
+    def __init__(self, path: Path, *, segment_seconds: float = 4.0) -> None:
+        self.path = path
+        moov = _read_moov(path)
+        _, _, moov_payload, moov_end = next(iter_boxes(moov))
+        mvhd_payload, mvhd_end = _child(moov, moov_payload, moov_end, b"mvhd")
+        self.mvhd = moov[mvhd_payload - 8 : mvhd_end]
+
+        self.tracks: list[Track] = []
+        for t, _, payload, box_end in iter_boxes(moov, moov_payload, moov_end):
+            if t != b"trak":
+                continue
+            track = Track()
+            tkhd, _ = _child(moov, payload, box_end, b"tkhd")
+            track.track_id = struct.unpack_from(
+                ">I", moov, tkhd + (20 if moov[tkhd] == 1 else 12)
+            )[0]
+            mdia, mdia_end = _child(moov, payload, box_end, b"mdia")
+            mdhd, _ = _child(moov, mdia, mdia_end, b"mdhd")
+            track.timescale = struct.unpack_from(
+                ">I", moov, mdhd + (20 if moov[mdhd] == 1 else 12)
+            )[0]
+            hdlr, _ = _child(moov, mdia, mdia_end, b"hdlr")
+            track.handler = bytes(moov[hdlr + 8 : hdlr + 12])
+            if track.handler not in (b"vide", b"soun") or not track.timescale:
+                continue
+            minf, minf_end = _child(moov, mdia, mdia_end, b"minf")
+            stbl, stbl_end = _child(moov, minf, minf_end, b"stbl")
+            _parse_stbl(track, moov, stbl, stbl_end)
+            if not track.dts:
+                continue
+            track.trak = _box(b"trak", _rebuild_trak(moov, payload, box_end))
+            self.tracks.append(track)
+        if not self.tracks:
+            raise Mp4Error("没有可用的音视频轨道（可能是 fMP4 或空文件）")
+
+        # 以视频轨道为参考，在关键帧处切分片段
+        self.ref = next(
+            (t for t in self.tracks if t.handler == b"vide"), self.tracks[0]
+        )
+        self.segments: list[tuple[int, int]] = []
+        target = int(segment_seconds * self.ref.timescale)
+        seg_start = 0
+        for i in range(1, len(self.ref.dts)):
+            if self.ref.sync is not None and not self.ref.sync[i]:
+                continue
+            if self.ref.dts[i] - self.ref.dts[seg_start] >= target:
+                self.segments.append((seg_start, i))
+                seg_start = i
+        self.segments.append((seg_start, len(self.ref.dts)))
+
+    @property
+    def duration(self) -> float:
+        return self.ref.duration / self.ref.timescale
+
+    @property
+    def samples(self) -> int:
+        return sum(len(t.dts) for t in self.tracks)
+
+    def segment_times(self) -> list[tuple[float, float]]:
+        """
+        每个片段相对文件起点的 (起始秒, 结束秒)
+        """
+        ref = self.ref
+        result = []
+        for a, b in self.segments:
+            end = ref.dts[b] if b < len(ref.dts) else ref.duration
+            result.append((ref.dts[a] / ref.timescale, end / ref.timescale))
+        return result
+
+    def init_segment(self) -> bytes:
+        ftyp = _box(b"ftyp", b"iso6", struct.pack(">I", 0x200), b"iso6isommp41")
+        trex = [
+            _full_box(b"trex", 0, 0, struct.pack(">IIIII", t.track_id, 1, 0, 0, 0))
+            for t in self.tracks
+        ]
+        moov = _box(
+            b"moov", self.mvhd, *(t.trak for t in self.tracks), _box(b"mvex", *trex)
+        )
+        return ftyp + moov
+
+    def _sample_range(self, track: Track, seq: int) -> tuple[int, int]:
+        a, b = self.segments[seq]
+        if track is self.ref:
+            return a, b
+        ref = self.ref
+
+        def to_track(ref_time: int) -> int:
+            return -(-ref_time * track.timescale // ref.timescale)
+
+        lo = 0 if seq == 0 else bisect_left(track.dts, to_track(ref.dts[a]))
+        if b >= len(ref.dts):
+            return lo, len(track.dts)
+        return lo, bisect_left(track.dts, to_track(ref.dts[b]))
+
+    def media_segment(self, seq: int) -> bytes:
+        """
+        第 seq 个片段的 moof + mdat，样本数据按连续字节范围从原文件读取
+        """
+        if not 0 <= seq < len(self.segments):
+            raise Mp4Error("片段序号超出范围")
+
+        ranges = [(t, *self._sample_range(t, seq)) for t in self.tracks]
+        ranges = [(t, a, b) for t, a, b in ranges if b > a]
+
+        # (轨道, 起始样本, 结束样本, trun 版本, trun flags, 样本条目)
+        trafs: list[tuple[Track, int, int, int, int, bytes]] = []
+        for track, a, b in ranges:
+            version = 1 if track.cto is not None and min(track.cto[a:b]) < 0 else 0
+            flags = 0x000001 | 0x000100 | 0x000200 | 0x000400
+            if track.cto is not None:
+                flags |= 0x000800
+            entries = bytearray()
+            for i in range(a, b):
+                sync = track.sync is None or track.sync[i]
+                entries += struct.pack(
+                    ">III",
+                    track.durations[i],
+                    track.sizes[i],
+                    _SYNC_FLAGS if sync else _NON_SYNC_FLAGS,
+                )
+                if track.cto is not None:
+                    entries += struct.pack(">i" if version else ">I", track.cto[i])
+            trafs.append((track, a, b, version, flags, bytes(entries)))
+
+        def build_moof(data_offsets: list[int]) -> bytes:
+            boxes = [_full_box(b"mfhd", 0, 0, struct.pack(">I", seq + 1))]
+            for traf, data_offset in zip(trafs, data_offsets):
+                track, a, b, version, flags, entries = traf
+                boxes.append(
+                    _box(
+                        b"traf",
+                        _full_box(
+                            b"tfhd", 0, 0x020000, struct.pack(">I", track.track_id)
+                        ),
+                        _full_box(b"tfdt", 1, 0, struct.pack(">Q", track.dts[a])),
+                        _full_box(
+                            b"trun",
+                            version,
+                            flags,
+                            struct.pack(">Ii", b - a, data_offset),
+                            entries,
+                        ),
+                    )
+                )
+            return _box(b"moof", *boxes)
+
+        moof_size = len(build_moof([0] * len(trafs)))
+        data_offsets = []
+        offset = moof_size + 8
+        for track, a, b, *_ in trafs:
+            data_offsets.append(offset)
+            offset += sum(track.sizes[a:b])
+        moof = build_moof(data_offsets)
+
+        chunks: list[bytes] = []
+        with open(self.path, "rb") as f:
+            fd = f.fileno()
+            for track, a, b, *_ in trafs:
+                # 合并连续的样本，减少读取次数
+                run_start = track.offsets[a]
+                run_end = run_start
+                for i in range(a, b):
+                    if track.offsets[i] != run_end:
+                        chunks.append(os.pread(fd, run_end - run_start, run_start))
+                        run_start = track.offsets[i]
+                        run_end = run_start
+                    run_end += track.sizes[i]
+                chunks.append(os.pread(fd, run_end - run_start, run_start))
+        mdat_size = 8 + sum(len(c) for c in chunks)
+        return moof + struct.pack(">I4s", mdat_size, b"mdat") + b"".join(chunks)
+
+
+_cache: OrderedDict[tuple[str, int, float, float], Mp4Index] = OrderedDict()
+_cache_lock = threading.Lock()
+# 按样本总数限制缓存（约 90MB）；5 分钟 25fps 的片段含音频约 2 万个样本
+_CACHE_MAX_SAMPLES = 3_000_000
+_cache_samples = 0
+
+
+def clear_cache() -> None:
+    global _cache_samples
+    with _cache_lock:
+        _cache.clear()
+        _cache_samples = 0
+
+
+def load_index(path: Path, *, segment_seconds: float = 4.0) -> Mp4Index:
+    """
+    按 (路径, 大小, mtime) 缓存解析结果，文件变化后自动失效
+    """
+    global _cache_samples
+
+    st = path.stat()
+    key = (str(path), st.st_size, st.st_mtime, segment_seconds)
+    with _cache_lock:
+        index = _cache.get(key)
+        if index is not None:
+            _cache.move_to_end(key)
+            return index
+    try:
+        index = Mp4Index(path, segment_seconds=segment_seconds)
+    except (struct.error, KeyError, IndexError, StopIteration) as e:
+        raise Mp4Error(f"MP4 结构异常: {e!r}") from e
+    with _cache_lock:
+        old = _cache.pop(key, None)
+        if old is not None:
+            _cache_samples -= old.samples
+        _cache[key] = index
+        _cache_samples += index.samples
+        # 至少保留刚加入的一项
+        while _cache_samples > _CACHE_MAX_SAMPLES and len(_cache) > 1:
+            _, evicted = _cache.popitem(last=False)
+            _cache_samples -= evicted.samples
+    return index
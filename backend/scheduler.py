@@ -1,8 +1,25 @@
+import heapq
+import os
 import re
-from datetime import datetime
+import shutil
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
 
+from .db import delete_record_segments
+from .db import get_record_dir_mtimes
+from .db import get_record_probes
+from .db import list_oldest_record_segments
+from .db import list_estimated_record_segments
+from .db import list_record_days
 from .db import list_record_policies
+from .db import list_record_segments
+from .db import list_record_streams
+from .db import sync_record_dir
+from .db import update_record_segment_durations
+from .db import upsert_record_probes
+from .thumbnails import THUMB_DIR_NAME, thumb_dir
+from .utils import TZ_SHANGHAI, probe_videos, read_mp4_duration
 
 
 def parse_filename_time(filename: str) -> datetime:
@@ -22,34 +39,111 @@ def parse_filename_time(filename: str) -> datetime:
     return datetime.min
 
 
-def cleanup_old_videos(path: Path):
+# 最近一次清理的统计，供接口查询
+last_cleanup_stats: dict = {}
+last_disk_pressure_stats: dict = {}
+# 进程启动以来的累计值，供 /metrics 以计数器输出
+cleanup_totals: dict[str, float] = {
+    "cleanup_runs": 0,
+    "cleanup_dirs_deleted": 0,
+    "cleanup_files_deleted": 0,
+    "cleanup_bytes_freed": 0,
+    "cleanup_seconds": 0.0,
+    "eviction_checks": 0,
+    "eviction_triggered": 0,
+    "eviction_files_deleted": 0,
+    "eviction_bytes_freed": 0,
+}
+
+
+def _accumulate(prefix: str, stats: dict, *fields: str) -> None:
+    for field in fields:
+        cleanup_totals[f"{prefix}_{field}"] += stats.get(field) or 0
+
+
+def _cleanup_boundary_day(
+    *,
+    app: str,
+    stream: str,
+    date: str,
+    date_path: Path,
+    cutoff_ts: float,
+    stats: dict,
+) -> list[str]:
     """
-    扫描 path 下所有 app/stream，按数据库中配置的保留天数删除旧的 .mp4 片段
+    处理保留期边界当天的目录：按索引中的 start_ts + duration 判断片段是否过期，
+    当天尚未建立索引时回退到目录扫描（文件名时间 / mtime）。返回已删除的文件名
     """
-    print(
-        f"[Scheduler {datetime.now()}] 开始扫描 {path} 下所有 app/stream 的视频片段..."
-    )
+    expired: list[tuple[str, int]] = []
+    segments = list_record_segments(app=app, stream=stream, date=date)
+    if segments:
+        stats["files_scanned"] += len(segments)
+        for seg in segments:
+            if float(seg["start_ts"]) + float(seg["duration"]) <= cutoff_ts:
+                expired.append((seg["filename"], int(seg["size"])))
+    else:
+        for entry in _scandir(date_path):
+            if entry.name.startswith(".") or not entry.name.lower().endswith(".mp4"):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            stats["files_scanned"] += 1
+            start_dt = parse_filename_time(entry.name)
+            if start_dt == datetime.min:
+                end_ts = st.st_mtime
+            else:
+                end_ts = max(
+                    start_dt.replace(tzinfo=TZ_SHANGHAI).timestamp(), st.st_mtime
+                )
+            if end_ts <= cutoff_ts:
+                expired.append((entry.name, int(st.st_size)))
 
-    if not path.exists():
-        print(f"[Scheduler Error] ❌ 录像根目录不存在: {path}")
-        return
+    deleted: list[str] = []
+    for filename, size in expired:
+        try:
+            (date_path / filename).unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[Scheduler Error] ❌ 删除失败 {date_path / filename}: {e}")
+            continue
+        deleted.append(filename)
+        stats["files_deleted"] += 1
+        stats["bytes_freed"] += size
+    return deleted
 
-    if not path.is_dir():
-        print(f"[Scheduler Error] ❌ 路径不是目录: {path}")
-        return
+
+def cleanup_old_videos(path: Path) -> dict:
+    """
+    按数据库中配置的保留天数清理录像：早于边界日期的日期目录整体删除，
+    只对边界当天逐个片段判断。统计信息写入 last_cleanup_stats 并返回
+    """
+    global last_cleanup_stats
+
+    started = time.monotonic()
+    stats = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "streams": 0,
+        "dirs_deleted": 0,
+        "files_scanned": 0,
+        "files_deleted": 0,
+        "bytes_freed": 0,
+        "duration": 0.0,
+    }
+
+    if not path.exists() or not path.is_dir():
+        print(f"[Scheduler Error] ❌ 录像根目录不存在或不是目录: {path}")
+        return stats
 
     try:
         rows = list_record_policies(enabled_only=True)
     except Exception:
         rows = []
-    if not rows:
-        print(f"[Scheduler {datetime.now()}] 未发现启用的录像保留策略，跳过清理。")
-        return
-
-    total_deleted = 0
 
-    date_pattern = re.compile(r"^\d{4}-\d{2}-\d{2}$")  # 正则匹配
-    safe_seconds = 15 * 60
+    date_pattern = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+    now = datetime.now(TZ_SHANGHAI)
 
     for row in rows:
         app_name = str(row.get("app", "")).strip()
@@ -64,57 +158,508 @@ def cleanup_old_videos(path: Path):
         if retention_days <= 0:
             continue
 
-        keep_videos = retention_days * 24 * 12
         stream_path = path / app_name / stream_name
-        if not stream_path.exists() or not stream_path.is_dir():
+        if not stream_path.is_dir():
             continue
+        stats["streams"] += 1
+
+        cutoff = now - timedelta(days=retention_days)
+        cutoff_date = cutoff.strftime("%Y-%m-%d")
+        try:
+            indexed_days = {
+                day["date"]: day
+                for day in list_record_days(app=app_name, stream=stream_name)
+            }
+        except Exception:
+            indexed_days = {}
 
-        video_files: list[Path] = []
-        now_ts = datetime.now().timestamp()
-        for p in stream_path.rglob("*.mp4"):
-            if not p.is_file():
+        for entry in _scandir(stream_path):
+            date = entry.name
+            if not date_pattern.match(date) or date > cutoff_date:
                 continue
-            if p.name.startswith("."):
+            if not entry.is_dir():
                 continue
-            try:
-                if now_ts - p.stat().st_mtime < safe_seconds:
+            date_path = Path(entry.path)
+
+            if date < cutoff_date:
+                # 整个日期目录已过期：直接删除，文件数和大小取自索引汇总
+                try:
+                    shutil.rmtree(date_path)
+                except Exception as e:
+                    print(f"[Scheduler Error] ❌ 删除失败 {date_path}: {e}")
                     continue
-            except Exception:
-                continue
-            if parse_filename_time(p.name) == datetime.min:
+                day = indexed_days.get(date)
+                stats["dirs_deleted"] += 1
+                if day:
+                    stats["files_deleted"] += int(day["slice_num"])
+                    stats["bytes_freed"] += int(day["total_size"])
+                try:
+                    delete_record_segments(app=app_name, stream=stream_name, date=date)
+                except Exception:
+                    pass
+                print(
+                    f"[Scheduler {datetime.now()}] 🗑️ 删除过期录像目录: {date_path.relative_to(path)}"
+                )
                 continue
-            video_files.append(p)
-        if len(video_files) <= keep_videos:
-            continue
 
-        sorted_files = sorted(
-            video_files,
-            key=lambda f: parse_filename_time(f.name),
-            reverse=True,
-        )
-        for file_path in sorted_files[keep_videos:]:
             try:
-                file_path.unlink()
-                relative_path = file_path.relative_to(path)
-                print(f"[Scheduler {datetime.now()}] 🗑️ 删除旧片段: {relative_path}")
-                total_deleted += 1
+                deleted = _cleanup_boundary_day(
+                    app=app_name,
+                    stream=stream_name,
+                    date=date,
+                    date_path=date_path,
+                    cutoff_ts=cutoff.timestamp(),
+                    stats=stats,
+                )
             except Exception as e:
-                print(f"[Scheduler Error] ❌ 删除失败 {file_path}: {e}")
-
-        for item in stream_path.iterdir():
-            if not item.is_dir():
+                print(f"[Scheduler Error] ❌ 清理失败 {date_path}: {e}")
                 continue
-            if not date_pattern.match(item.name):
+            if not deleted:
                 continue
             try:
-                has_mp4 = any(
-                    p.is_file() and p.suffix.lower() == ".mp4" for p in item.iterdir()
+                delete_record_segments(
+                    app=app_name, stream=stream_name, date=date, filenames=deleted
                 )
-                if not has_mp4:
-                    item.rmdir()
             except Exception:
-                continue
+                pass
+            if _remove_empty_date_dir(date_path):
+                stats["dirs_deleted"] += 1
+                try:
+                    delete_record_segments(app=app_name, stream=stream_name, date=date)
+                except Exception:
+                    pass
 
+    stats["duration"] = round(time.monotonic() - started, 3)
+    last_cleanup_stats = stats
+    cleanup_totals["cleanup_runs"] += 1
+    cleanup_totals["cleanup_seconds"] += stats["duration"]
+    _accumulate("cleanup", stats, "dirs_deleted", "files_deleted", "bytes_freed")
     print(
-        f"[Scheduler {datetime.now()}] ✅ 扫描与清理完成，共删除 {total_deleted} 个旧视频片段。"
+        f"[Scheduler {datetime.now()}] ✅ 录像清理完成：删除 {stats['dirs_deleted']} 个目录、"
+        f"{stats['files_deleted']} 个片段，释放 {stats['bytes_freed']} 字节，"
+        f"检查 {stats['files_scanned']} 个片段，耗时 {stats['duration']} 秒。"
     )
+    return stats
+
+
+def evict_for_disk_pressure(
+    path: Path, *, high_watermark: float, low_watermark: float
+) -> dict:
+    """
+    录像盘使用率超过 high_watermark（百分比）时，跨所有流按片段结束时间从旧到新删除，
+    直到使用率降到 low_watermark 以下。流的优先级每高 1 级，其片段的“年龄”按一半计算，
+    即保留约两倍时长。各流只按索引读取最早的一小批片段，用堆做多路归并
+    """
+    global last_disk_pressure_stats
+
+    started = time.monotonic()
+    stats = {
+        "checked_at": datetime.now().isoformat(timespec="seconds"),
+        "triggered": False,
+        "high_watermark": high_watermark,
+        "low_watermark": low_watermark,
+        "used_percent": 0.0,
+        "files_deleted": 0,
+        "bytes_freed": 0,
+        "duration": 0.0,
+    }
+    if not path.is_dir():
+        return stats
+
+    try:
+        usage = shutil.disk_usage(path)
+    except OSError as e:
+        print(f"[Scheduler Error] ❌ 读取磁盘使用率失败 {path}: {e}")
+        return stats
+    stats["used_percent"] = round(usage.used * 100 / usage.total, 2)
+    cleanup_totals["eviction_checks"] += 1
+    if usage.total <= 0 or stats["used_percent"] < high_watermark:
+        last_disk_pressure_stats = stats
+        return stats
+    stats["triggered"] = True
+    cleanup_totals["eviction_triggered"] += 1
+    bytes_to_free = usage.used - usage.total * low_watermark / 100
+
+    priorities: dict[tuple[str, str], int] = {}
+    try:
+        for row in list_record_policies(enabled_only=False):
+            key = (str(row.get("app") or ""), str(row.get("stream") or ""))
+            priority = int(row.get("priority", 0) or 0)
+            priorities[key] = max(priorities.get(key, priority), priority)
+        streams = list_record_streams()
+    except Exception as e:
+        print(f"[Scheduler Error] ❌ 读取录像索引失败: {e}")
+        return stats
+
+    now_ts = time.time()
+    # 正在写入或刚写完的片段不动
+    safe_ts = now_ts - 15 * 60
+    batch_size = 64
+    pending: dict[tuple[str, str], list[dict]] = {}
+    deleted: dict[tuple[str, str], dict[str, list[str]]] = {}
+    heap: list[tuple[float, str, str]] = []
+
+    def weight(key: tuple[str, str]) -> float:
+        return 2.0 ** max(-10, min(10, priorities.get(key, 0)))
+
+    def flush(key: tuple[str, str]) -> None:
+        for date, filenames in deleted.pop(key, {}).items():
+            try:
+                delete_record_segments(
+                    app=key[0], stream=key[1], date=date, filenames=filenames
+                )
+            except Exception:
+                pass
+            if _remove_empty_date_dir(path / key[0] / key[1] / date):
+                try:
+                    delete_record_segments(app=key[0], stream=key[1], date=date)
+                except Exception:
+                    pass
+
+    def push(key: tuple[str, str]) -> None:
+        if not pending.get(key):
+            flush(key)
+            try:
+                pending[key] = list_oldest_record_segments(
+                    app=key[0], stream=key[1], limit=batch_size
+                )
+            except Exception:
+                pending[key] = []
+        if not pending[key]:
+            return
+        seg = pending[key][0]
+        end_ts = float(seg["start_ts"]) + float(seg["duration"])
+        if end_ts > safe_ts:
+            return
+        heapq.heappush(heap, (-(now_ts - end_ts) / weight(key), key[0], key[1]))
+
+    for key in streams:
+        push(key)
+
+    while heap and stats["bytes_freed"] < bytes_to_free:
+        _, app_name, stream_name = heapq.heappop(heap)
+        key = (app_name, stream_name)
+        seg = pending[key].pop(0)
+        file_path = path / app_name / stream_name / seg["date"] / seg["filename"]
+        try:
+            file_path.unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            # 删除失败的流不再参与本轮淘汰，避免反复取到同一片段
+            print(f"[Scheduler Error] ❌ 删除失败 {file_path}: {e}")
+            pending[key] = []
+            flush(key)
+            continue
+        else:
+            stats["files_deleted"] += 1
+            stats["bytes_freed"] += int(seg["size"])
+        deleted.setdefault(key, {}).setdefault(seg["date"], []).append(seg["filename"])
+        push(key)
+
+    for key in list(deleted):
+        flush(key)
+
+    try:
+        usage = shutil.disk_usage(path)
+        stats["used_percent"] = round(usage.used * 100 / usage.total, 2)
+    except OSError:
+        pass
+    stats["duration"] = round(time.monotonic() - started, 3)
+    last_disk_pressure_stats = stats
+    _accumulate("eviction", stats, "files_deleted", "bytes_freed")
+    print(
+        f"[Scheduler {datetime.now()}] 💾 磁盘空间不足，已淘汰 {stats['files_deleted']} 个片段，"
+        f"释放 {stats['bytes_freed']} 字节，当前使用率 {stats['used_percent']}%。"
+    )
+    return stats
+
+
+def _probe_segment_rows(
+    *,
+    app: str,
+    stream: str,
+    date: str,
+    date_path: Path,
+    files: dict[str, os.stat_result],
+    concurrency: int,
+) -> list[dict]:
+    """
+    文件名无法解析时间的片段通过 ffprobe 获取起始时间和时长：
+    结果持久化缓存，(size, mtime) 未变化的文件不再探测，未命中的一批并发探测
+    """
+    cached = get_record_probes(app=app, stream=stream, date=date)
+    probes: list[dict] = []
+    missing: list[str] = []
+    for name, st in files.items():
+        row = cached.get(name)
+        if (
+            row is not None
+            and int(row["size"]) == int(st.st_size)
+            and float(row["mtime"]) == float(st.st_mtime)
+        ):
+            probes.append(row)
+        else:
+            missing.append(name)
+
+    if missing:
+        fresh: list[dict] = []
+        results = probe_videos(
+            [date_path / name for name in missing], concurrency=concurrency
+        )
+        for name, data in zip(missing, results):
+            st = files[name]
+            fresh.append(
+                {
+                    "app": app,
+                    "stream": stream,
+                    "date": date,
+                    "filename": name,
+                    "size": int(st.st_size),
+                    "mtime": float(st.st_mtime),
+                    "start_ts": (
+                        datetime.fromisoformat(data["start"]).timestamp()
+                        if data
+                        else None
+                    ),
+                    "duration": float(data["duration"]) if data else None,
+                }
+            )
+        try:
+            upsert_record_probes(fresh)  # type: ignore[arg-type]
+        except Exception as e:
+            print(f"[Scheduler Error] ❌ 写入探测缓存失败 {date_path}: {e}")
+        probes.extend(fresh)
+
+    return [
+        {
+            "app": app,
+            "stream": stream,
+            "date": date,
+            "filename": row["filename"],
+            "start_ts": float(row["start_ts"]),
+            "duration": float(row["duration"]),
+            "size": int(row["size"]),
+            "mtime": float(row["mtime"]),
+            "duration_source": "probe",
+        }
+        for row in probes
+        if row["start_ts"] is not None and row["duration"] is not None
+    ]
+
+
+def _segment_rows_from_files(
+    *,
+    app: str,
+    stream: str,
+    date: str,
+    date_path: Path,
+    files: dict[str, os.stat_result],
+    probe_concurrency: int = 4,
+) -> list[dict]:
+    """
+    为新出现或有变化的片段确定起始时间和时长：
+    文件名可解析的从文件名取起始时间、从 MP4 头部读取时长，读取失败的时长记为 0
+    并标记为 estimate，由 backfill_segment_durations 之后回填；
+    其余通过 get_video_shanghai_time 获取起始时间和时长
+    """
+    rows: list[dict] = []
+    unparsed: dict[str, os.stat_result] = {}
+    for name, st in files.items():
+        start_dt = parse_filename_time(name)
+        if start_dt == datetime.min:
+            unparsed[name] = st
+            continue
+        duration = read_mp4_duration(date_path / name)
+        rows.append(
+            {
+                "app": app,
+                "stream": stream,
+                "date": date,
+                "filename": name,
+                "start_ts": start_dt.replace(tzinfo=TZ_SHANGHAI).timestamp(),
+                "duration": duration or 0.0,
+                "size": int(st.st_size),
+                "mtime": float(st.st_mtime),
+                "duration_source": "header" if duration else "estimate",
+            }
+        )
+
+    if unparsed:
+        rows += _probe_segment_rows(
+            app=app,
+            stream=stream,
+            date=date,
+            date_path=date_path,
+            files=unparsed,
+            concurrency=probe_concurrency,
+        )
+    return rows
+
+
+def backfill_segment_durations(path: Path, *, limit: int = 500) -> int:
+    """
+    为时长来源为 estimate 的片段（旧数据或当时无法读取的文件）重新读取 MP4 头部，
+    读取成功的写回实际时长
+    """
+    try:
+        rows = list_estimated_record_segments(limit=limit)
+    except Exception as e:
+        print(f"[Scheduler Error] ❌ 读取待回填片段失败: {e}")
+        return 0
+    updates: list[dict] = []
+    for row in rows:
+        duration = read_mp4_duration(
+            path / row["app"] / row["stream"] / row["date"] / row["filename"]
+        )
+        if duration:
+            updates.append({**row, "duration": duration, "duration_source": "header"})
+    try:
+        return update_record_segment_durations(updates)  # type: ignore[arg-type]
+    except Exception as e:
+        print(f"[Scheduler Error] ❌ 回填片段时长失败: {e}")
+        return 0
+
+
+def _scandir(path: str | Path) -> list[os.DirEntry]:
+    try:
+        with os.scandir(path) as it:
+            return list(it)
+    except OSError:
+        return []
+
+
+def _remove_empty_date_dir(date_path: Path) -> bool:
+    """
+    删除没有录像的日期目录：除缩略图目录外不能有任何条目（包括正在写入的隐藏片段），
+    缩略图目录随之删除。目录非空或删除失败时返回 False
+    """
+    entries = _scandir(date_path)
+    if any(entry.name != THUMB_DIR_NAME for entry in entries):
+        return False
+    if entries:
+        shutil.rmtree(thumb_dir(date_path), ignore_errors=True)
+    try:
+        os.rmdir(date_path)
+    except OSError:
+        return False
+    return True
+
+
+def reconcile_record_index(path: Path, *, probe_concurrency: int = 4):
+    """
+    将录像片段索引与磁盘校准：目录 mtime 未变化的日期目录直接跳过，
+    只对新增/变化的日期目录逐个文件 stat，空日期目录顺带删除
+    """
+    if not path.exists() or not path.is_dir():
+        return
+
+    date_pattern = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+    try:
+        dir_mtimes = get_record_dir_mtimes()
+        indexed_dates = {
+            (row["app"], row["stream"], row["date"]) for row in list_record_days()
+        }
+    except Exception as e:
+        print(f"[Scheduler Error] ❌ 读取录像索引失败: {e}")
+        return
+
+    seen: set[tuple[str, str, str]] = set()
+    total_changed = 0
+    total_removed = 0
+
+    for app_entry in _scandir(path):
+        if not app_entry.is_dir():
+            continue
+        for stream_entry in _scandir(app_entry.path):
+            if not stream_entry.is_dir():
+                continue
+            for date_entry in _scandir(stream_entry.path):
+                if not date_entry.is_dir() or not date_pattern.match(date_entry.name):
+                    continue
+                key = (app_entry.name, stream_entry.name, date_entry.name)
+                try:
+                    dir_mtime = date_entry.stat().st_mtime
+                except OSError:
+                    continue
+                seen.add(key)
+                if dir_mtimes.get(key) == dir_mtime:
+                    continue
+
+                date_path = Path(date_entry.path)
+                files: dict[str, os.stat_result] = {}
+                try:
+                    for f in _scandir(date_path):
+                        if f.name.startswith(".") or not f.name.lower().endswith(
+                            ".mp4"
+                        ):
+                            continue
+                        if not f.is_file():
+                            continue
+                        files[f.name] = f.stat()
+                except OSError:
+                    continue
+
+                if not files:
+                    # 没有已完成的片段：正在写入的隐藏片段等其他内容会让目录保留
+                    if _remove_empty_date_dir(date_path):
+                        print(f"已删除空录像目录: {date_path}")
+                    seen.discard(key)
+                    continue
+
+                app_name, stream_name, date = key
+                existing = {
+                    row["filename"]: row
+                    for row in list_record_segments(
+                        app=app_name, stream=stream_name, date=date
+                    )
+                }
+                unchanged = [
+                    existing[name]
+                    for name, st in files.items()
+                    if name in existing
+                    and int(existing[name]["size"]) == int(st.st_size)
+                    and float(existing[name]["mtime"]) == float(st.st_mtime)
+                ]
+                unchanged_names = {row["filename"] for row in unchanged}
+                fresh = _segment_rows_from_files(
+                    app=app_name,
+                    stream=stream_name,
+                    date=date,
+                    date_path=date_path,
+                    probe_concurrency=probe_concurrency,
+                    files={
+                        name: st
+                        for name, st in files.items()
+                        if name not in unchanged_names
+                    },
+                )
+                try:
+                    changed, removed = sync_record_dir(
+                        app=app_name,
+                        stream=stream_name,
+                        date=date,
+                        mtime=dir_mtime,
+                        rows=unchanged + fresh,  # type: ignore[arg-type]
+                    )
+                except Exception as e:
+                    print(f"[Scheduler Error] ❌ 更新录像索引失败 {date_path}: {e}")
+                    continue
+                total_changed += changed
+                total_removed += removed
+
+    for app_name, stream_name, date in (indexed_dates | set(dir_mtimes)) - seen:
+        try:
+            total_removed += delete_record_segments(
+                app=app_name, stream=stream_name, date=date
+            )
+        except Exception:
+            continue
+
+    total_backfilled = backfill_segment_durations(path)
+
+    if total_changed or total_removed or total_backfilled:
+        print(
+            f"[Scheduler {datetime.now()}] 🔄 录像索引已校准，更新 {total_changed} 个片段，移除 {total_removed} 个片段，"
+            f"回填 {total_backfilled} 个片段时长。"
+        )
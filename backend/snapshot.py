@@ -0,0 +1,121 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable
+from typing import Callable
+
+from .media import MediaKey
+
+
+class Snapshot:
+    __slots__ = ("data", "fetched_at", "ts")
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self.fetched_at = time.monotonic()
+        # 截图时间（秒级时间戳），用于响应头
+        self.ts = time.time()
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+
+class SnapshotCache:
+    """
+    按流缓存截图（LRU + TTL）：同一个流同时只有一次截图请求，其他调用方等待同一结果；
+    截图失败时返回仍在缓存中的旧图。最近被查看过的流由 refresh_viewed 在过期前刷新
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[MediaKey], Awaitable[bytes | None]],
+        *,
+        capacity: int = 256,
+        ttl: float = 10,
+        concurrency: int = 4,
+    ) -> None:
+        self._fetch = fetch
+        self.capacity = capacity
+        self.ttl = ttl
+        self._items: OrderedDict[MediaKey, Snapshot] = OrderedDict()
+        self._inflight: dict[MediaKey, asyncio.Future] = {}
+        self._viewed: dict[MediaKey, float] = {}
+        # 截图会占用 ZLM 的 HTTP 连接和 ffmpeg 进程，限制同时进行的数量
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.failures = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    async def get(self, key: MediaKey) -> Snapshot | None:
+        self._viewed[key] = time.monotonic()
+        item = self._items.get(key)
+        if item is not None and item.age < self.ttl:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item
+        self.misses += 1
+        return await self._load(key) or item
+
+    async def _load(self, key: MediaKey) -> Snapshot | None:
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch_and_store(key))
+            self._inflight[key] = future
+        else:
+            self.coalesced += 1
+        # shield：单个调用方断开时不取消其他调用方等待的截图
+        return await asyncio.shield(future)
+
+    async def _fetch_and_store(self, key: MediaKey) -> Snapshot | None:
+        try:
+            async with self._semaphore:
+                data = await self._fetch(key)
+        except Exception:
+            data = None
+        finally:
+            self._inflight.pop(key, None)
+        if not data:
+            self.failures += 1
+            return None
+        item = Snapshot(data)
+        self._items[key] = item
+        self._items.move_to_end(key)
+        while len(self._items) > self.capacity:
+            self._items.popitem(last=False)
+        return item
+
+    def discard(self, key: MediaKey) -> None:
+        self._items.pop(key, None)
+        self._viewed.pop(key, None)
+
+    def viewed(self, window: float) -> list[MediaKey]:
+        """
+        最近 window 秒内被查看过的流；更早的记录顺带清除
+        """
+        now = time.monotonic()
+        for key, at in list(self._viewed.items()):
+            if now - at > window:
+                del self._viewed[key]
+        return list(self._viewed)
+
+    async def refresh_viewed(
+        self, *, window: float, online: Callable[[MediaKey], bool]
+    ) -> int:
+        """
+        刷新最近被查看、仍在线且截图已过半个 TTL 的流，返回刷新数量
+        """
+        keys = []
+        for key in self.viewed(window):
+            if not online(key):
+                self.discard(key)
+                continue
+            item = self._items.get(key)
+            if item is None or item.age >= self.ttl / 2:
+                keys.append(key)
+        results = await asyncio.gather(*(self._load(key) for key in keys))
+        return sum(1 for r in results if r is not None)
@@ -0,0 +1,47 @@
+"""
+进程内统计：固定桶的耗时直方图，由 ZLM 客户端与数据库层记录，/metrics 输出时读取
+"""
+
+import math
+from bisect import bisect_left
+from typing import Iterable
+
+# 秒，覆盖 ZLM 接口从毫秒级到超时上限的耗时
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    固定桶的累计直方图，桶上限按升序排列，+Inf 桶即 count
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        i = bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+
+    def copy(self) -> "Histogram":
+        other = Histogram(self.buckets)
+        other.counts = list(self.counts)
+        other.sum = self.sum
+        other.count = self.count
+        return other
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        result = []
+        running = 0
+        for bound, n in zip(self.buckets, self.counts):
+            running += n
+            result.append((bound, running))
+        result.append((math.inf, self.count))
+        return result
@@ -0,0 +1,38 @@
+"""
+测试公共配置：mk_loader 由 ZLM 镜像提供（读取 ZLM 的 config.ini），
+不在镜像中运行时用固定配置代替；ZLM_NODES 配置三个模拟节点（a、b、c），由各测试用 httpx.MockTransport 响应
+"""
+
+import json
+import os
+import sys
+import tempfile
+import types
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+try:
+    import mk_loader  # noqa: F401
+except ImportError:
+    _config = {
+        "http.port": "80",
+        "api.secret": "secret",
+        "protocol.mp4_save_path": tempfile.mkdtemp(prefix="streamui-record-"),
+        "rtsp.port": "554",
+    }
+    mk_loader = types.ModuleType("mk_loader")
+    mk_loader.get_config = lambda key: _config.get(key, "")
+    sys.modules["mk_loader"] = mk_loader
+
+os.environ.setdefault(
+    "ZLM_NODES",
+    json.dumps(
+        [
+            {"id": node_id, "url": f"http://{node_id}", "secret": f"secret-{node_id}"}
+            for node_id in ("a", "b", "c")
+        ]
+    ),
+)
@@ -0,0 +1,112 @@
+import time
+
+from backend.cluster import NodePool, ZlmNode
+
+
+def _pool(*ids: str, max_streams: int = 10) -> NodePool:
+    return NodePool(
+        [
+            ZlmNode(id=i, url=f"http://{i}", secret="s", max_streams=max_streams)
+            for i in ids
+        ]
+    )
+
+
+def test_pick_prefers_lowest_score_and_skips_unhealthy():
+    pool = _pool("a", "b", "c")
+    pool.update_load("a", threads_load=50, streams=0, bandwidth=0)
+    pool.update_load("b", threads_load=10, streams=0, bandwidth=0)
+    pool.update_load("c", threads_load=5, streams=0, bandwidth=0)
+    assert pool.pick().id == "c"
+    pool.nodes["c"].healthy = False
+    assert pool.pick().id == "b"
+    for node in pool:
+        node.healthy = False
+    assert pool.pick() is None
+
+
+def test_pick_prefers_nodes_that_are_not_overloaded():
+    pool = _pool("a", "b")
+    pool.update_load("a", threads_load=95, streams=0, bandwidth=0, overload_load=90)
+    pool.update_load("b", threads_load=10, streams=10, bandwidth=0, overload_load=90)
+    # 两个节点都过载时仍按得分选择
+    assert pool.nodes["a"].overloaded and pool.nodes["b"].overloaded
+    assert pool.pick().id == "a"
+    pool.update_load("b", threads_load=10, streams=9, bandwidth=0, overload_load=90)
+    assert pool.pick().id == "b"
+
+
+def test_assign_spreads_consecutive_placements():
+    pool = _pool("a", "b", "c")
+    placed = []
+    for _ in range(6):
+        node = pool.pick()
+        pool.assign(node)
+        placed.append(node.id)
+    assert sorted(placed) == ["a", "a", "b", "b", "c", "c"]
+
+
+def test_assign_moves_count_from_previous_node():
+    pool = _pool("a", "b")
+    pool.set_proxy_counts({"a": 3, "b": 1})
+    pool.assign(pool.nodes["b"], "a")
+    assert (pool.nodes["a"].proxies, pool.nodes["b"].proxies) == (2, 2)
+    pool.assign(pool.nodes["b"], "b")
+    assert pool.nodes["b"].proxies == 2
+    pool.set_proxy_counts({})
+    pool.assign(pool.nodes["b"], "a")
+    assert (pool.nodes["a"].proxies, pool.nodes["b"].proxies) == (0, 1)
+
+
+def test_heartbeat_needs_consecutive_failures_and_successes():
+    pool = _pool("a")
+    node = pool.nodes["a"]
+    assert pool.heartbeat("a", ok=True) is None
+    seen = node.last_seen
+    assert pool.heartbeat("a", ok=False) is None
+    assert pool.heartbeat("a", ok=False) is None
+    # 中间一次成功会清零失败计数
+    assert pool.heartbeat("a", ok=True) is None
+    assert [pool.heartbeat("a", ok=False) for _ in range(3)] == [None, None, "down"]
+    assert not node.healthy and node.down_since >= seen
+    assert pool.heartbeat("a", ok=False) is None
+    assert pool.heartbeat("a", ok=True) is None
+    assert pool.heartbeat("a", ok=False) is None
+    assert [pool.heartbeat("a", ok=True) for _ in range(3)] == [None, None, "up"]
+    assert node.healthy and node.down_since is None
+
+
+def test_heartbeat_down_since_is_last_success():
+    pool = _pool("a")
+    pool.heartbeat("a", ok=True)
+    seen = pool.nodes["a"].last_seen
+    time.sleep(0.01)
+    for _ in range(3):
+        pool.heartbeat("a", ok=False, fail_threshold=3)
+    assert pool.nodes["a"].down_since == seen
+
+
+def test_plan_rebalance_moves_from_heaviest_to_lightest():
+    pool = _pool("a", "b", "c")
+    pool.set_proxy_counts({"a": 6})
+    plan = pool.plan_rebalance({"a": [f"s{i}" for i in range(6)]}, tolerance=0.1)
+    assert [src for _, src, _ in plan] == ["a"] * 4
+    targets = [dst for _, _, dst in plan]
+    assert targets.count("b") == 2 and targets.count("c") == 2
+    # 计划不修改节点状态
+    assert pool.nodes["a"].proxies == 6
+
+
+def test_plan_rebalance_respects_tolerance_and_max_moves():
+    pool = _pool("a", "b")
+    pool.set_proxy_counts({"a": 6, "b": 5})
+    assert pool.plan_rebalance({"a": list(range(6)), "b": list(range(5))}) == []
+    pool.set_proxy_counts({"a": 10})
+    assert len(pool.plan_rebalance({"a": list(range(10))}, max_moves=2)) == 2
+
+
+def test_plan_rebalance_ignores_unhealthy_nodes():
+    pool = _pool("a", "b")
+    pool.set_proxy_counts({"a": 6})
+    pool.nodes["b"].healthy = False
+    assert pool.plan_rebalance({"a": list(range(6))}) == []
@@ -0,0 +1,144 @@
+"""
+拉流代理放置与均衡：main 中的 _place_pull_proxies / _rebalance 对接 httpx.MockTransport 模拟的多个 ZLM 节点
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+from backend import main
+from backend.cluster import NodePool, parse_nodes
+from backend.db import sqlite as db
+from backend.zlm_client import ZlmClient
+
+
+class MockZlm:
+    """
+    按请求的 host 区分节点，记录每个节点上的拉流代理
+    """
+
+    def __init__(self, node_ids: list[str]) -> None:
+        self.proxies: dict[str, set[str]] = {i: set() for i in node_ids}
+        self.calls: list[tuple[str, str, dict]] = []
+        self.failing: set[str] = set()
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        node_id = request.url.host
+        api = request.url.path.rsplit("/", 1)[-1]
+        params = dict(request.url.params)
+        self.calls.append((node_id, api, params))
+        assert params["secret"] == f"secret-{node_id}"
+        if api == "addStreamProxy":
+            if node_id in self.failing:
+                return httpx.Response(200, json={"code": -1, "msg": "pull failed"})
+            key = f"{params['vhost']}/{params['app']}/{params['stream']}"
+            self.proxies[node_id].add(key)
+            return httpx.Response(200, json={"code": 0, "data": {"key": key}})
+        if api == "listStreamProxy":
+            data = [{"key": key} for key in sorted(self.proxies[node_id])]
+            return httpx.Response(200, json={"code": 0, "data": data})
+        if api == "delStreamProxy":
+            self.proxies[node_id].discard(params["key"])
+            return httpx.Response(200, json={"code": 0, "data": {"flag": True}})
+        return httpx.Response(200, json={"code": 0, "data": []})
+
+
+@pytest.fixture
+def zlm(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "streamui.db")
+    db.init_db()
+    pool = NodePool(parse_nodes(main.ZLM_NODES, default=main.node_pool.default))
+    monkeypatch.setattr(main, "node_pool", pool)
+    mock = MockZlm([node.id for node in pool])
+    client = ZlmClient(
+        httpx.AsyncClient(transport=httpx.MockTransport(mock.handler)),
+        max_connections=16,
+    )
+    monkeypatch.setattr(main, "zlm_client", client)
+    return mock
+
+
+def _rows(n: int, node_id: str | None = None) -> list[dict]:
+    rows = [
+        {
+            "vhost": "__defaultVhost__",
+            "app": "live",
+            "stream": f"cam{i}",
+            "url": f"rtsp://camera/{i}",
+            "audio_type": None,
+        }
+        for i in range(n)
+    ]
+    db.upsert_pull_proxies(rows)
+    if node_id:
+        db.update_pull_proxy_nodes([{**r, "node_id": node_id} for r in rows])
+    return db.list_pull_proxies()
+
+
+def _assigned() -> dict[str, str]:
+    return {r["stream"]: r["node_id"] for r in db.list_pull_proxies()}
+
+
+def test_place_spreads_new_proxies_and_persists(zlm):
+    rows = _rows(6)
+    nodes = asyncio.run(main._place_pull_proxies(rows))
+    assert sorted(n.id for n in nodes) == ["a", "a", "b", "b", "c", "c"]
+    assert _assigned() == {r["stream"]: n.id for r, n in zip(rows, nodes)}
+    # 放置只写数据库，不调用 ZLM
+    assert zlm.calls == []
+
+
+def test_place_keeps_healthy_and_moves_unhealthy_assignments(zlm):
+    rows = _rows(4, node_id="a")
+    main.node_pool.set_proxy_counts({"a": 4})
+    assert [n.id for n in asyncio.run(main._place_pull_proxies(rows))] == ["a"] * 4
+    main.node_pool.nodes["a"].healthy = False
+    nodes = asyncio.run(main._place_pull_proxies(db.list_pull_proxies()))
+    assert sorted(n.id for n in nodes) == ["b", "b", "c", "c"]
+    assert set(_assigned().values()) == {"b", "c"}
+
+
+def test_rebalance_moves_proxies_between_mock_nodes(zlm):
+    rows = _rows(6, node_id="a")
+    zlm.proxies["a"] = {f"{r['vhost']}/{r['app']}/{r['stream']}" for r in rows}
+    main.node_pool.set_proxy_counts({"a": 6})
+
+    plan = asyncio.run(main._rebalance(max_moves=10, tolerance=0.001, dry_run=True))
+    assert len(plan) == 4 and zlm.calls == []
+
+    moves = asyncio.run(main._rebalance(max_moves=10, tolerance=0.001))
+    assert len(moves) == 4 and all(m["ok"] for m in moves)
+    assert {n: len(p) for n, p in zlm.proxies.items()} == {"a": 2, "b": 2, "c": 2}
+    assigned = _assigned()
+    for node_id, keys in zlm.proxies.items():
+        assert {assigned[k.rsplit("/", 1)[1]] for k in keys} <= {node_id}
+
+
+def test_rebalance_keeps_source_when_target_add_fails(zlm):
+    rows = _rows(4, node_id="a")
+    zlm.proxies["a"] = {f"{r['vhost']}/{r['app']}/{r['stream']}" for r in rows}
+    main.node_pool.set_proxy_counts({"a": 4})
+    zlm.failing = {"b", "c"}
+    moves = asyncio.run(main._rebalance(max_moves=10, tolerance=0.001))
+    assert moves and not any(m["ok"] for m in moves)
+    assert set(_assigned().values()) == {"a"}
+    assert len(zlm.proxies["a"]) == 4
+    assert not any(api == "delStreamProxy" for _, api, _ in zlm.calls)
+
+
+def test_recovered_node_reclaims_running_proxies(zlm, monkeypatch):
+    # a 只是网络中断：故障转移到 b 后，a 上的代理仍在运行
+    rows = _rows(3, node_id="b")
+    keys = {f"{r['vhost']}/{r['app']}/{r['stream']}" for r in rows}
+    zlm.proxies["a"] = keys | {"__defaultVhost__/live/removed"}
+    zlm.proxies["b"] = set(keys)
+    failed_over = {(r["vhost"], r["app"], r["stream"]): "a" for r in rows}
+    monkeypatch.setattr(main, "_failed_over", failed_over)
+
+    asyncio.run(main._remove_stale_proxies(main.node_pool.nodes["a"]))
+    assert zlm.proxies["a"] == keys and zlm.proxies["b"] == set()
+    assert set(_assigned().values()) == {"a"} and failed_over == {}
+    assert not any(
+        node_id == "a" and api == "addStreamProxy" for node_id, api, _ in zlm.calls
+    )
@@ -0,0 +1,95 @@
+"""
+录像索引：reconcile_record_index 对日期目录的扫描与空目录清理，以及按时间窗口查询片段
+"""
+
+import pytest
+
+from backend import scheduler
+from backend.db import sqlite as db
+from backend.thumbnails import thumb_dir
+
+
+@pytest.fixture
+def record_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "streamui.db")
+    db.init_db()
+    root = tmp_path / "record"
+    root.mkdir()
+    return root
+
+
+def test_removes_empty_date_dir(record_root):
+    date_path = record_root / "live" / "cam" / "2026-10-17"
+    date_path.mkdir(parents=True)
+
+    scheduler.reconcile_record_index(record_root)
+
+    assert not date_path.exists()
+
+
+def test_keeps_date_dir_with_in_progress_segment(record_root):
+    date_path = record_root / "live" / "cam" / "2026-10-17"
+    date_path.mkdir(parents=True)
+    segment = date_path / ".00-00-00-0.mp4"
+    segment.write_bytes(b"\0" * 16)
+
+    scheduler.reconcile_record_index(record_root)
+
+    assert segment.exists()
+    assert db.list_record_segments(app="live", stream="cam", date="2026-10-17") == []
+
+
+def test_removes_date_dir_with_only_thumbnails(record_root):
+    date_path = record_root / "live" / "cam" / "2026-10-17"
+    thumb_dir(date_path).mkdir(parents=True)
+    (thumb_dir(date_path) / "00.jpg").write_bytes(b"\0")
+
+    scheduler.reconcile_record_index(record_root)
+
+    assert not date_path.exists()
+
+
+def test_keeps_thumbnails_next_to_in_progress_segment(record_root):
+    date_path = record_root / "live" / "cam" / "2026-10-17"
+    thumb_dir(date_path).mkdir(parents=True)
+    sprite = thumb_dir(date_path) / "00.jpg"
+    sprite.write_bytes(b"\0")
+    segment = date_path / ".00-00-00-0.mp4"
+    segment.write_bytes(b"\0" * 16)
+
+    scheduler.reconcile_record_index(record_root)
+
+    assert sprite.exists()
+    assert segment.exists()
+
+
+def test_window_includes_segment_longer_than_an_hour(record_root):
+    rows = [
+        {
+            "app": "live",
+            "stream": "cam",
+            "date": "2026-10-17",
+            "filename": name,
+            "start_ts": start,
+            "duration": duration,
+            "size": 1,
+            "mtime": 0,
+            "duration_source": "probe",
+        }
+        for name, start, duration in (
+            ("long.mp4", 0, 3 * 3600),
+            ("a.mp4", 3 * 3600, 300),
+            ("b.mp4", 4 * 3600, 300),
+        )
+    ]
+    db.upsert_record_segments(rows)
+
+    window = {"app": "live", "stream": "cam", "start_ts": 2 * 3600, "end_ts": 4 * 3600}
+    assert db.list_record_ranges(**window) == [
+        (0, 3 * 3600),
+        (3 * 3600, 3 * 3600 + 300),
+    ]
+    assert [row["filename"] for row in db.list_record_segments_between(**window)] == [
+        "long.mp4",
+        "a.mp4",
+    ]
@@ -0,0 +1,224 @@
+"""
+录像缩略图：录像片段完成后按固定间隔抽取关键帧，按小时拼成雪碧图，
+并生成 JSON 索引（每张缩略图的时间与在雪碧图中的位置），回放页拖动时间轴时按小时加载
+"""
+
+import asyncio
+import json
+import math
+import os
+import shutil
+import uuid
+import weakref
+from datetime import datetime
+from pathlib import Path
+
+from .utils import TZ_SHANGHAI
+
+# 缩略图存放在日期目录下的隐藏目录中，随日期目录一起清理，索引校准时不会被当作录像
+THUMB_DIR_NAME = ".thumbs"
+
+
+def thumb_dir(date_path: Path) -> Path:
+    return date_path / THUMB_DIR_NAME
+
+
+class ThumbnailGenerator:
+    """
+    有界并发的缩略图任务：ffmpeg 以最低 CPU 优先级运行、只解码关键帧；
+    同一小时的雪碧图串行重建
+    """
+
+    def __init__(
+        self,
+        *,
+        interval: float = 10,
+        width: int = 160,
+        height: int = 90,
+        columns: int = 10,
+        concurrency: int = 1,
+    ) -> None:
+        self.interval = interval
+        self.width = width
+        self.height = height
+        self.columns = columns
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._pending: set[Path] = set()
+        # 只有持有或等待锁的任务引用它，全部结束后条目自动移除
+        self._hour_locks: weakref.WeakValueDictionary[Path, asyncio.Lock] = (
+            weakref.WeakValueDictionary()
+        )
+        self._tasks: set[asyncio.Task] = set()
+        self._nice = ["nice", "-n", "19"] if shutil.which("nice") else []
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def submit(self, path: Path, start_ts: float) -> None:
+        """
+        为一个已完成的录像片段生成缩略图，重复提交的片段忽略
+        """
+        if not self.enabled or path in self._pending:
+            return
+        self._pending.add(path)
+        task = asyncio.create_task(self._run(path, start_ts))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _ffmpeg(self, *args: str) -> None:
+        process = await asyncio.create_subprocess_exec(
+            *self._nice,
+            "ffmpeg",
+            "-hide_banner",
+            "-nostdin",
+            "-loglevel",
+            "error",
+            *args,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(stderr.decode(errors="ignore").strip()[-300:])
+
+    async def _run(self, path: Path, start_ts: float) -> None:
+        try:
+            async with self._semaphore:
+                hours = await self._extract(path, start_ts)
+                for hour_dir in hours:
+                    lock = self._hour_locks.get(hour_dir)
+                    if lock is None:
+                        lock = self._hour_locks[hour_dir] = asyncio.Lock()
+                    async with lock:
+                        await self._pack(hour_dir)
+        except FileNotFoundError:
+            print(f"[Thumbnail] ⚠️ 未找到 ffmpeg，跳过缩略图: {path}")
+        except Exception as e:
+            print(f"[Thumbnail] ❌ 生成缩略图失败 {path}: {e}")
+        finally:
+            self._pending.discard(path)
+
+    async def _extract(self, path: Path, start_ts: float) -> list[Path]:
+        """
+        抽取片段的缩略图帧，按所属小时存入 .thumbs/HH/frames/<毫秒时间戳>.jpg，
+        返回涉及的小时目录
+        """
+        base = thumb_dir(path.parent)
+        tmp = base / f".tmp-{uuid.uuid4().hex}"
+        tmp.mkdir(parents=True, exist_ok=True)
+        w, h = self.width, self.height
+        try:
+            await self._ffmpeg(
+                "-threads",
+                "1",
+                "-skip_frame",
+                "nokey",
+                "-i",
+                str(path),
+                "-an",
+                "-vf",
+                f"fps=1/{self.interval:g},"
+                f"scale={w}:{h}:force_original_aspect_ratio=decrease,"
+                f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2",
+                "-q:v",
+                "5",
+                "-f",
+                "image2",
+                str(tmp / "%05d.jpg"),
+            )
+            date = path.parent.name
+            hours: list[Path] = []
+            for frame in sorted(tmp.iterdir()):
+                ts = start_ts + (int(frame.stem) - 1) * self.interval
+                dt = datetime.fromtimestamp(ts, TZ_SHANGHAI)
+                # 跨零点的帧不属于该日期目录，丢弃
+                if dt.strftime("%Y-%m-%d") != date:
+                    continue
+                hour_dir = base / dt.strftime("%H")
+                frames = hour_dir / "frames"
+                frames.mkdir(parents=True, exist_ok=True)
+                os.replace(frame, frames / f"{int(ts * 1000)}.jpg")
+                if hour_dir not in hours:
+                    hours.append(hour_dir)
+            return hours
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    async def _pack(self, hour_dir: Path) -> None:
+        """
+        将该小时的全部帧拼成一张雪碧图，并写入索引
+        """
+        frames = sorted((hour_dir / "frames").glob("*.jpg"), key=lambda p: int(p.stem))
+        if not frames:
+            return
+        columns = min(self.columns, len(frames))
+        rows = math.ceil(len(frames) / columns)
+        list_path = hour_dir / "frames.txt"
+        list_path.write_text(
+            "".join(f"file 'frames/{p.name}'\n" for p in frames), encoding="utf-8"
+        )
+        sprite_tmp = hour_dir.with_name(f".{hour_dir.name}.tmp.jpg")
+        try:
+            await self._ffmpeg(
+                "-f",
+                "concat",
+                "-safe",
+                "0",
+                "-i",
+                str(list_path),
+                "-vf",
+                f"tile={columns}x{rows}",
+                "-frames:v",
+                "1",
+                "-q:v",
+                "5",
+                "-y",
+                str(sprite_tmp),
+            )
+        finally:
+            list_path.unlink(missing_ok=True)
+        index = {
+            "hour": hour_dir.name,
+            "interval": self.interval,
+            "width": self.width,
+            "height": self.height,
+            "columns": columns,
+            # [毫秒时间戳, x, y]
+            "tiles": [
+                [
+                    int(p.stem),
+                    (i % columns) * self.width,
+                    (i // columns) * self.height,
+                ]
+                for i, p in enumerate(frames)
+            ],
+        }
+        index_tmp = hour_dir.with_name(f".{hour_dir.name}.tmp.json")
+        index_tmp.write_text(json.dumps(index, separators=(",", ":")), encoding="utf-8")
+        os.replace(sprite_tmp, hour_dir.with_name(f"{hour_dir.name}.jpg"))
+        os.replace(index_tmp, hour_dir.with_name(f"{hour_dir.name}.json"))
+
+    def shutdown(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+
+
+def load_thumbnail_indexes(date_path: Path) -> list[dict]:
+    """
+    读取某个日期目录下各小时的缩略图索引，附带雪碧图版本号（mtime）
+    """
+    base = thumb_dir(date_path)
+    result: list[dict] = []
+    try:
+        entries = sorted(base.glob("[0-2][0-9].json"))
+    except OSError:
+        return result
+    for path in entries:
+        try:
+            index = json.loads(path.read_text(encoding="utf-8"))
+            index["version"] = int(path.with_suffix(".jpg").stat().st_mtime)
+        except (OSError, ValueError):
+            continue
+        result.append(index)
+    return result
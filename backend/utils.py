@@ -1,12 +1,23 @@
+import asyncio
 import json
 import os
 import re
+import struct
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Iterable
 from zoneinfo import ZoneInfo
 
+from .mp4 import Mp4Error, iter_boxes
+
 TZ_SHANGHAI = ZoneInfo("Asia/Shanghai")
+# MP4 时间从 1904-01-01 UTC 起算
+_MP4_EPOCH_OFFSET = 2082844800
 
 
 def parse_timestamp_to_shanghai(time_str: str) -> datetime | None:
@@ -28,11 +39,151 @@ def parse_timestamp_to_shanghai(time_str: str) -> datetime | None:
         return None
 
 
-def get_video_shanghai_time(video_path: Path) -> dict | None:
+def _fragment_end_times(
+    fd: int, moofs: list[tuple[int, int]], default_durations: dict[int, int]
+) -> dict[int, int]:
     """
-    提取单个视频在 Asia/Shanghai 时区的时间段
-    Returns: { filepath, duration, start, end } 或 None
+    遍历 moof，按 tfdt + trun 样本时长计算每个轨道最后一个样本的结束时间
+    """
+    ends: dict[int, int] = {}
+    for pos, size in moofs:
+        moof = os.pread(fd, size, pos)
+        _, _, moof_payload, moof_end = next(iter_boxes(moof))
+        for t, _, traf, traf_end in iter_boxes(moof, moof_payload, moof_end):
+            if t != b"traf":
+                continue
+            track_id = 0
+            default_duration = 0
+            decode_time: int | None = None
+            total = 0
+            for t2, _, p, _ in iter_boxes(moof, traf, traf_end):
+                flags = struct.unpack_from(">I", moof, p)[0]
+                version, flags = flags >> 24, flags & 0xFFFFFF
+                if t2 == b"tfhd":
+                    (track_id,) = struct.unpack_from(">I", moof, p + 4)
+                    default_duration = default_durations.get(track_id, 0)
+                    offset = p + 8
+                    if flags & 0x01:
+                        offset += 8
+                    if flags & 0x02:
+                        offset += 4
+                    if flags & 0x08:
+                        (default_duration,) = struct.unpack_from(">I", moof, offset)
+                elif t2 == b"tfdt":
+                    fmt = ">Q" if version == 1 else ">I"
+                    (decode_time,) = struct.unpack_from(fmt, moof, p + 4)
+                elif t2 == b"trun":
+                    (count,) = struct.unpack_from(">I", moof, p + 4)
+                    if not flags & 0x100:
+                        total += count * default_duration
+                        continue
+                    offset = p + 8
+                    if flags & 0x01:
+                        offset += 4
+                    if flags & 0x04:
+                        offset += 4
+                    entry = 4 * bin(flags & 0xF00).count("1")
+                    for i in range(count):
+                        total += struct.unpack_from(">I", moof, offset + i * entry)[0]
+            start = decode_time if decode_time is not None else ends.get(track_id, 0)
+            ends[track_id] = max(ends.get(track_id, 0), start + total)
+    return ends
+
+
+def read_mp4_header(video_path: Path) -> tuple[datetime | None, float]:
     """
+    直接解析 MP4 box 读取 (creation_time, 时长秒)，只读取 box 头和必要的小 box：
+    支持 moov 在文件头或文件尾，以及分片 MP4（mehd 或 moof 中的 tfdt/trun）。
+    解析失败抛出 Mp4Error
+    """
+    with open(video_path, "rb") as f:
+        fd = f.fileno()
+        # 只读取顶层 box 头
+        moov: tuple[int, int] | None = None
+        moofs: list[tuple[int, int]] = []
+        for box_type, pos, payload, end in iter_boxes(fd):
+            if box_type == b"moov":
+                moov = (payload, end)
+            elif box_type == b"moof":
+                moofs.append((pos, end - pos))
+        if moov is None:
+            raise Mp4Error("未找到 moov，文件可能仍在写入")
+
+        mvhd: bytes | None = None
+        mvex: bytes | None = None
+        traks: list[bytes] = []
+        # 逐个读取 moov 子 box 头，只读取 mvhd/mvex（分片文件再读取 trak）
+        for box_type, pos, _, end in iter_boxes(fd, *moov):
+            if box_type == b"mvhd":
+                mvhd = os.pread(fd, end - pos, pos)
+            elif box_type == b"mvex":
+                mvex = os.pread(fd, end - pos, pos)
+            elif box_type == b"trak" and moofs:
+                traks.append(os.pread(fd, end - pos, pos))
+
+        if mvhd is None:
+            raise Mp4Error("缺少 mvhd box")
+        version = mvhd[8]
+        if version == 1:
+            creation, _, timescale, duration = struct.unpack_from(">QQIQ", mvhd, 12)
+        else:
+            creation, _, timescale, duration = struct.unpack_from(">IIII", mvhd, 12)
+            if duration == 0xFFFFFFFF:
+                duration = 0
+        if not timescale:
+            raise Mp4Error("mvhd timescale 为 0")
+        seconds = duration / timescale
+
+        if mvex is not None:
+            default_durations: dict[int, int] = {}
+            for t, _, p, _ in iter_boxes(mvex, 8):
+                if t == b"mehd":
+                    fmt = ">Q" if mvex[p] == 1 else ">I"
+                    (fragment_duration,) = struct.unpack_from(fmt, mvex, p + 4)
+                    seconds = max(seconds, fragment_duration / timescale)
+                elif t == b"trex":
+                    track_id, _, default_duration = struct.unpack_from(
+                        ">III", mvex, p + 4
+                    )
+                    default_durations[track_id] = default_duration
+            if moofs:
+                timescales: dict[int, int] = {}
+                for trak in traks:
+                    track_id = 0
+                    for t, _, p, e in iter_boxes(trak, 8):
+                        if t == b"tkhd":
+                            track_id = struct.unpack_from(
+                                ">I", trak, p + (20 if trak[p] == 1 else 12)
+                            )[0]
+                        elif t == b"mdia":
+                            for t2, _, p2, _ in iter_boxes(trak, p, e):
+                                if t2 == b"mdhd":
+                                    timescales[track_id] = struct.unpack_from(
+                                        ">I", trak, p2 + (20 if trak[p2] == 1 else 12)
+                                    )[0]
+                for track_id, end in _fragment_end_times(
+                    fd, moofs, default_durations
+                ).items():
+                    if timescales.get(track_id):
+                        seconds = max(seconds, end / timescales[track_id])
+
+    created_at = None
+    if creation > _MP4_EPOCH_OFFSET:
+        created_at = datetime.fromtimestamp(creation - _MP4_EPOCH_OFFSET, TZ_SHANGHAI)
+    return created_at, seconds
+
+
+def read_mp4_duration(video_path: Path) -> float | None:
+    """
+    读取 MP4 时长（秒），文件不完整或无法解析时返回 None
+    """
+    try:
+        return read_mp4_header(video_path)[1] or None
+    except (Mp4Error, OSError, struct.error, StopIteration):
+        return None
+
+
+def _ffprobe_shanghai_time(video_path: Path) -> dict | None:
     cmd = [
         "ffprobe",
         "-v",
@@ -81,9 +232,44 @@ def get_video_shanghai_time(video_path: Path) -> dict | None:
         return None
 
 
-def get_video_shanghai_time_from_filename(
-    video_path: Path, *, default_duration_seconds: float = 300.0
-) -> dict | None:
+def get_video_shanghai_time(video_path: Path) -> dict | None:
+    """
+    提取单个视频在 Asia/Shanghai 时区的时间段
+    优先直接解析 MP4 头部，无法解析时回退到 ffprobe
+    Returns: { filepath, duration, start, end } 或 None
+    """
+    try:
+        start_sh, duration = read_mp4_header(video_path)
+    except (Mp4Error, OSError, struct.error, StopIteration):
+        return _ffprobe_shanghai_time(video_path)
+    if not start_sh:
+        print(f"⚠️ 无效 creation_time: {video_path}")
+        return None
+    end_sh = start_sh + timedelta(seconds=duration)
+    return {
+        "filename": video_path,  # 绝对路径
+        "duration": round(duration, 3),
+        "start": start_sh.isoformat(),
+        "end": end_sh.isoformat(),
+    }
+
+
+def probe_videos(paths: list[Path], *, concurrency: int = 4) -> list[dict | None]:
+    """
+    批量执行 get_video_shanghai_time，结果按 paths 顺序返回；
+    回退到 ffprobe 时每个工作线程只等待一个子进程，concurrency 即同时运行的 ffprobe 进程数上限
+    """
+    if not paths:
+        return []
+    workers = max(1, min(concurrency, len(paths)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ffprobe") as pool:
+        return list(pool.map(get_video_shanghai_time, paths))
+
+
+def get_video_shanghai_time_from_filename(video_path: Path) -> dict | None:
+    """
+    起始时间取自文件名，时长从 MP4 头部读取；无法读取时长时返回 None
+    """
     filename = video_path.name
     match = re.match(
         r"(\d{4})-(\d{1,2})-(\d{1,2})-(\d{1,2})-(\d{1,2})-(\d{1,2})",
@@ -96,7 +282,9 @@ def get_video_shanghai_time_from_filename(
         start_sh = datetime(year, month, day, hour, minute, second, tzinfo=TZ_SHANGHAI)
     except ValueError:
         return None
-    duration = float(default_duration_seconds)
+    duration = read_mp4_duration(video_path)
+    if not duration:
+        return None
     end_sh = start_sh + timedelta(seconds=duration)
     return {
         "filename": video_path,
@@ -191,3 +379,49 @@ def summarize_existing_recordings(
         "date_to": date_to,
         "date_count": len(dates),
     }
+
+
+async def run_bounded(
+    items: Iterable[Any],
+    worker: Callable[[Any], Awaitable[Any]],
+    *,
+    concurrency: int,
+) -> list[Any]:
+    """
+    以固定并发窗口对 items 逐个执行 worker，结果按 items 顺序返回；
+    worker 抛出的异常会作为结果返回而不会中断其他任务
+    """
+    indexed = list(enumerate(items))
+    results: list[Any] = [None] * len(indexed)
+    it = iter(indexed)
+
+    async def _run() -> None:
+        for i, item in it:
+            try:
+                results[i] = await worker(item)
+            except Exception as e:
+                results[i] = e
+
+    await asyncio.gather(
+        *(_run() for _ in range(max(1, min(concurrency, len(indexed)))))
+    )
+    return results
+
+
+def merge_time_ranges(
+    segments: Iterable[tuple[float, float]], *, tolerance: float = 0
+) -> list[list[float]]:
+    """
+    将按起始时间排序的 (start, end) 片段合并为连续区间，
+    相邻片段间隔不超过 tolerance 时视为连续
+    """
+    merged: list[list[float]] = []
+    for start, end in segments:
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1] + tolerance:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+            continue
+        merged.append([start, end])
+    return merged
@@ -0,0 +1,315 @@
+"""
+ZLM HTTP API 客户端封装：按节点+接口统计耗时分位数并据此设置自适应超时，
+按节点熔断，连接池占满或熔断时快速失败（只读接口可返回最近一次成功的结果）
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any
+
+import httpx
+
+from .stats import Histogram
+
+# 允许在失败时返回旧数据的只读接口
+STALE_APIS = frozenset(
+    {
+        "getMediaList",
+        "listStreamProxy",
+        "getServerConfig",
+        "getStatistic",
+        "getThreadsLoad",
+        "getWorkThreadsLoad",
+    }
+)
+
+
+class ZlmUnavailable(httpx.TransportError):
+    """
+    熔断打开或连接池排队超时，请求未发出
+    """
+
+
+class LatencyTracker:
+    __slots__ = ("samples", "histogram", "count", "errors", "timeouts")
+
+    def __init__(self, size: int = 256) -> None:
+        # 最近 size 次成功请求的耗时（秒）
+        self.samples: deque[float] = deque(maxlen=size)
+        # 全部成功请求的累计耗时分布，供 /metrics 输出
+        self.histogram = Histogram()
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.histogram.observe(seconds)
+        self.count += 1
+
+    def percentile(self, q: float) -> float | None:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    """
+    closed：正常；连续 failures 次失败后 open，拒绝请求；
+    reset_timeout 秒后 half_open，只放行一个试探请求，成功则 closed，失败重新 open
+    """
+
+    __slots__ = (
+        "threshold",
+        "reset_timeout",
+        "state",
+        "failures",
+        "opened_at",
+        "_trial",
+    )
+
+    def __init__(self, *, failures: int = 5, reset_timeout: float = 10) -> None:
+        self.threshold = failures
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+            self._trial = False
+        if self._trial:
+            return False
+        self._trial = True
+        return True
+
+    @property
+    def rejecting(self) -> bool:
+        """
+        open 且未到 reset_timeout；只读判断，不占用半开试探名额
+        """
+        return (
+            self.state == "open"
+            and time.monotonic() - self.opened_at < self.reset_timeout
+        )
+
+    def success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._trial = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._trial = False
+
+
+class ZlmClient:
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        *,
+        max_connections: int,
+        timeout: float = 5,
+        min_timeout: float = 0.5,
+        timeout_factor: float = 3,
+        min_samples: int = 20,
+        breaker_failures: int = 5,
+        breaker_reset: float = 10,
+        stale_ttl: float = 60,
+    ) -> None:
+        self.client = client
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.min_timeout = min_timeout
+        self.timeout_factor = timeout_factor
+        self.min_samples = min_samples
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.stale_ttl = stale_ttl
+        # 与 httpx 连接池同样大小，排队的请求在这里等待，便于统计池占用
+        self._slots = asyncio.Semaphore(max_connections)
+        self.in_flight = 0
+        self.waiting = 0
+        self.shed = 0
+        self.stale_served = 0
+        self._latency: dict[tuple[str, str], LatencyTracker] = {}
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._stale: dict[tuple, tuple[float, httpx.Response]] = {}
+
+    def breaker(self, node_id: str) -> CircuitBreaker:
+        breaker = self._breakers.get(node_id)
+        if breaker is None:
+            breaker = self._breakers[node_id] = CircuitBreaker(
+                failures=self.breaker_failures, reset_timeout=self.breaker_reset
+            )
+        return breaker
+
+    def deadline(self, node_id: str, api: str) -> float:
+        """
+        样本足够时取近期 p99 的 timeout_factor 倍，限制在 [min_timeout, timeout]
+        """
+        tracker = self._latency.get((node_id, api))
+        if tracker is None or len(tracker.samples) < self.min_samples:
+            return self.timeout
+        p99 = tracker.percentile(0.99) or 0.0
+        return min(self.timeout, max(self.min_timeout, p99 * self.timeout_factor))
+
+    def _serve_stale(self, key: tuple, error: Exception) -> httpx.Response:
+        cached = self._stale.get(key)
+        if cached is None or time.monotonic() - cached[0] > self.stale_ttl:
+            raise error
+        self.stale_served += 1
+        return cached[1]
+
+    async def get(
+        self,
+        node_id: str,
+        url: str,
+        api: str,
+        params: dict[str, Any],
+        *,
+        timeout: float | None = None,
+        stale: bool = False,
+        probe: bool = False,
+    ) -> httpx.Response:
+        """
+        timeout 不传时使用自适应超时（连接池排队时间也计入）；
+        stale 为 True 且是只读接口时，失败或熔断时返回 stale_ttl 内最近一次成功的结果。
+        熔断只统计自适应超时的请求和 probe（心跳）：心跳不受熔断限制，其结果即为试探；
+        显式指定超时的慢接口（截图、添加代理）熔断打开时拒绝，但成败不计入熔断
+        """
+        stale_key = (node_id, api, tuple(sorted(params.items())))
+        stale = stale and api in STALE_APIS
+        breaker = self.breaker(node_id)
+        # trial：经 allow() 放行，半开时可能占用了试探名额；counted：结果计入熔断
+        trial = not probe and timeout is None
+        counted = probe or timeout is None
+        if trial:
+            allowed = breaker.allow()
+        else:
+            allowed = probe or not breaker.rejecting
+        if not allowed:
+            self.shed += 1
+            error = ZlmUnavailable(f"ZLM 节点 {node_id} 熔断中")
+            if stale:
+                return self._serve_stale(stale_key, error)
+            raise error
+
+        budget = self.deadline(node_id, api) if timeout is None else timeout
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=budget)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            # 排队超时说明本服务自身拥塞，不计入节点熔断；释放可能占用的试探名额
+            if trial and breaker.state == "half_open":
+                breaker.failure()
+            error = ZlmUnavailable(f"ZLM 连接池已满（{self.max_connections}）")
+            if stale:
+                return self._serve_stale(stale_key, error)
+            raise error
+        finally:
+            self.waiting -= 1
+
+        tracker = self._latency.get((node_id, api))
+        if tracker is None:
+            tracker = self._latency[(node_id, api)] = LatencyTracker()
+        self.in_flight += 1
+        try:
+            remaining = max(0.05, budget - (time.monotonic() - started))
+            sent = time.monotonic()
+            # httpx 的超时按单次读写计算，这里再限制整个请求的总耗时
+            response = await asyncio.wait_for(
+                self.client.get(url, params=params, timeout=remaining), remaining
+            )
+        except asyncio.TimeoutError:
+            tracker.errors += 1
+            tracker.timeouts += 1
+            if counted:
+                breaker.failure()
+            error = httpx.ReadTimeout(f"ZLM {api} 超过 {remaining:.2f}s 未响应")
+            if stale:
+                return self._serve_stale(stale_key, error)
+            raise error
+        except httpx.HTTPError as e:
+            tracker.errors += 1
+            if isinstance(e, httpx.TimeoutException):
+                tracker.timeouts += 1
+            if counted:
+                breaker.failure()
+            if stale:
+                return self._serve_stale(stale_key, e)
+            raise
+        except asyncio.CancelledError:
+            # 调用方取消不代表节点故障，但要交还半开状态的试探名额
+            if trial and breaker.state == "half_open":
+                breaker.failure()
+            raise
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+        if response.status_code >= 500:
+            tracker.errors += 1
+            if counted:
+                breaker.failure()
+            if stale:
+                return self._serve_stale(
+                    stale_key,
+                    ZlmUnavailable(f"ZLM 节点 {node_id} 返回 {response.status_code}"),
+                )
+            return response
+        tracker.add(time.monotonic() - sent)
+        if counted:
+            breaker.success()
+        if api in STALE_APIS:
+            self._stale[stale_key] = (time.monotonic(), response)
+        return response
+
+    def trackers(self) -> dict[tuple[str, str], LatencyTracker]:
+        return dict(self._latency)
+
+    def stats(self) -> dict[str, Any]:
+        def _ms(value: float | None) -> float | None:
+            return None if value is None else round(value * 1000, 1)
+
+        return {
+            "pool": {
+                "max_connections": self.max_connections,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "saturation": round(self.in_flight / self.max_connections, 3),
+            },
+            "shed": self.shed,
+            "stale_served": self.stale_served,
+            "breakers": {
+                node_id: {"state": b.state, "failures": b.failures}
+                for node_id, b in self._breakers.items()
+            },
+            "apis": [
+                {
+                    "node_id": node_id,
+                    "api": api,
+                    "count": t.count,
+                    "errors": t.errors,
+                    "timeouts": t.timeouts,
+                    "p50_ms": _ms(t.percentile(0.5)),
+                    "p90_ms": _ms(t.percentile(0.9)),
+                    "p99_ms": _ms(t.percentile(0.99)),
+                    "deadline_ms": _ms(self.deadline(node_id, api)),
+                }
+                for (node_id, api), t in sorted(self._latency.items())
+            ],
+        }